@@ -0,0 +1,35 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# time parsing of the recorded cd-paranoia progress output, as whipper reads
+# it from the pipe
+
+import os
+import sys
+import time
+
+from whipper.program import cdparanoia
+
+CHUNK = 64 * 1024
+
+paths = sys.argv[1:] or [
+    os.path.join(os.path.dirname(__file__), '..', 'whipper', 'test', name)
+    for name in ('cdparanoia.progress', 'cdparanoia.progress.error',
+                 'cdparanoia.progress.strokes')]
+
+for path in paths:
+    with open(path, 'rb') as f:
+        data = f.read()
+    # repeat short recordings so timings are not lost in the noise
+    repeat = max(1, 10 * 1024 * 1024 // len(data))
+    data *= repeat
+
+    parser = cdparanoia.ProgressParser(start=0, stop=0)
+    begin = time.perf_counter()
+    for i in range(0, len(data), CHUNK):
+        parser.feed(data[i:i + CHUNK])
+    elapsed = time.perf_counter() - begin
+
+    lines = data.count(b'\n')
+    print("%s: %d lines in %.3f s, %.0f lines/s" % (
+        os.path.basename(path), lines, elapsed, lines / elapsed))
@@ -3,7 +3,8 @@
  Name        : accuraterip-checksum.c
  Authors     : Leo Bogert (http://leo.bogert.de), Andreas Oberritter
  License     : GPLv3
- Description : A Python C extension to compute the AccurateRip checksum of WAV or FLAC tracks.
+ Description : A Python C extension to compute the AccurateRip checksum of WAV or FLAC tracks,
+               or of raw CD audio as it is read.
                Implemented according to http://www.hydrogenaudio.org/forums/index.php?showtopic=97603
  ============================================================================
  */
@@ -39,44 +40,100 @@ static bool check_fileformat(const SF_INFO *sfinfo)
 	return false;
 }
 
-static void *load_full_audiodata(SNDFILE *sndfile, const SF_INFO *sfinfo, size_t size)
+/* each sector holds 588 stereo samples, one 32-bit word each */
+#define SECTOR_WORDS 588
+/* the first and last five sectors of a disc are not checksummed */
+#define SKIPPED_WORDS (SECTOR_WORDS * 5)
+/* how many samples are read from a file at once */
+#define BLOCK_FRAMES (SECTOR_WORDS * 64)
+
+/*
+ * The checksums of a track so far.  Audio is added a block at a time, so
+ * the length of the track does not have to be known up front: the last
+ * words are kept, and taken out again when the checksums of the last
+ * track of a disc are asked for.
+ */
+struct checksum_state {
+	uint32_t csum_hi;
+	uint32_t csum_lo;
+	uint32_t mul_by;		// position of the next word, from 1
+	uint32_t check_from;
+	bool last;
+	uint32_t tail[SKIPPED_WORDS];	// the last words, by position
+	uint8_t partial[sizeof(uint32_t)];
+	size_t partial_size;
+};
+
+static bool check_track(unsigned int track_number, unsigned int total_tracks)
 {
-	void *data = malloc(size);
+	return total_tracks >= 1 && total_tracks <= 99 &&
+	       track_number >= 1 && track_number <= total_tracks;
+}
 
-	if(data == NULL)
-		return NULL;
+static void checksum_init(struct checksum_state *state, unsigned int track_number, unsigned int total_tracks)
+{
+	memset(state, 0, sizeof(*state));
+	state->mul_by = 1;
+	if (track_number == 1)			// first?
+		state->check_from = SKIPPED_WORDS;
+	state->last = (track_number == total_tracks);
+}
 
-	if(sf_readf_short(sndfile, data, sfinfo->frames) !=  sfinfo->frames) {
-		free(data);
-		return NULL;
+static inline void checksum_add_word(struct checksum_state *state, uint32_t word)
+{
+	if (state->mul_by >= state->check_from) {
+		uint64_t product = (uint64_t)word * (uint64_t)state->mul_by;
+		state->csum_hi += (uint32_t)(product >> 32);
+		state->csum_lo += (uint32_t)(product);
 	}
+	state->tail[state->mul_by % SKIPPED_WORDS] = word;
+	state->mul_by++;
+}
 
-	return data;
+static inline uint32_t le32(const uint8_t *p)
+{
+	return (uint32_t)p[0] | (uint32_t)p[1] << 8 |
+	       (uint32_t)p[2] << 16 | (uint32_t)p[3] << 24;
 }
 
-static void compute_checksums(const uint32_t *audio_data, size_t audio_data_size, size_t track_number, size_t total_tracks, uint32_t *v1, uint32_t *v2)
+/* add raw CD audio: 16-bit little-endian stereo samples */
+static void checksum_update(struct checksum_state *state, const uint8_t *data, size_t size)
 {
-	uint32_t csum_hi = 0;
-	uint32_t csum_lo = 0;
-	uint32_t AR_CRCPosCheckFrom = 0;
-	size_t Datauint32_tSize = audio_data_size / sizeof(uint32_t);
-	uint32_t AR_CRCPosCheckTo = Datauint32_tSize;
-	const size_t SectorBytes = 2352;		// each sector
-	uint32_t MulBy = 1;
 	size_t i;
 
-	if (track_number == 1)			// first?
-		AR_CRCPosCheckFrom += ((SectorBytes * 5) / sizeof(uint32_t));
-	if (track_number == total_tracks)		// last?
-		AR_CRCPosCheckTo -= ((SectorBytes * 5) / sizeof(uint32_t));
-
-	for (i = 0; i < Datauint32_tSize; i++) {
-		if (MulBy >= AR_CRCPosCheckFrom && MulBy <= AR_CRCPosCheckTo) {
-			uint64_t product = (uint64_t)audio_data[i] * (uint64_t)MulBy;
-			csum_hi += (uint32_t)(product >> 32);
-			csum_lo += (uint32_t)(product);
+	while (state->partial_size > 0 && size > 0) {
+		state->partial[state->partial_size++] = *data++;
+		size--;
+		if (state->partial_size == sizeof(uint32_t)) {
+			checksum_add_word(state, le32(state->partial));
+			state->partial_size = 0;
+		}
+	}
+
+	for (i = 0; i + sizeof(uint32_t) <= size; i += sizeof(uint32_t))
+		checksum_add_word(state, le32(data + i));
+
+	for (; i < size; i++)
+		state->partial[state->partial_size++] = data[i];
+}
+
+static void checksum_digest(const struct checksum_state *state, uint32_t *v1, uint32_t *v2)
+{
+	uint32_t csum_hi = state->csum_hi;
+	uint32_t csum_lo = state->csum_lo;
+	uint32_t count = state->mul_by - 1;
+	uint32_t i;
+
+	if (state->last && count >= SKIPPED_WORDS) {	// last?
+		for (i = count - SKIPPED_WORDS + 1; i <= count; i++) {
+			uint64_t product;
+
+			if (i < state->check_from)
+				continue;
+			product = (uint64_t)state->tail[i % SKIPPED_WORDS] * (uint64_t)i;
+			csum_hi -= (uint32_t)(product >> 32);
+			csum_lo -= (uint32_t)(product);
 		}
-		MulBy++;
 	}
 
 	*v1 = csum_lo;
@@ -89,21 +146,19 @@ static PyObject *accuraterip_compute(PyObject *self, PyObject *args)
 	unsigned int track_number;
 	unsigned int total_tracks;
 	uint32_t v1, v2;
-	void *audio_data;
-	size_t size;
+	short *block = NULL;
+	sf_count_t frames = 0;
+	sf_count_t count;
+	sf_count_t i;
 	SF_INFO sfinfo;
 	SNDFILE *sndfile = NULL;
+	struct checksum_state *state = NULL;
 
 	if (!PyArg_ParseTuple(args, "sII", &filename, &track_number, &total_tracks))
 		goto err;
 
-	if (track_number < 1 || track_number > total_tracks) {
-		fprintf(stderr, "Invalid track_number!\n");
-		goto err;
-	}
-
-	if (total_tracks < 1 || total_tracks > 99) {
-		fprintf(stderr, "Invalid total_tracks!\n");
+	if (!check_track(track_number, total_tracks)) {
+		fprintf(stderr, "Invalid track_number or total_tracks!\n");
 		goto err;
 	}
 
@@ -123,27 +178,185 @@ static PyObject *accuraterip_compute(PyObject *self, PyObject *args)
 		goto err;
 	}
 
-	size = sfinfo.frames * sfinfo.channels * sizeof(uint16_t);
-	audio_data = load_full_audiodata(sndfile, &sfinfo, size);
-	if (audio_data == NULL) {
-		fprintf(stderr, "load_full_audiodata failed!\n");
+	state = malloc(sizeof(*state));
+	block = malloc(BLOCK_FRAMES * 2 * sizeof(short));
+	if (state == NULL || block == NULL) {
+		fprintf(stderr, "malloc failed!\n");
+		goto err;
+	}
+	checksum_init(state, track_number, total_tracks);
+
+	Py_BEGIN_ALLOW_THREADS
+	while ((count = sf_readf_short(sndfile, block, BLOCK_FRAMES)) > 0) {
+		for (i = 0; i < count; i++)
+			checksum_add_word(state, (uint32_t)(uint16_t)block[2 * i] |
+						 (uint32_t)(uint16_t)block[2 * i + 1] << 16);
+		frames += count;
+	}
+	Py_END_ALLOW_THREADS
+
+	if (frames != sfinfo.frames) {
+		fprintf(stderr, "sf_readf_short failed!\n");
 		goto err;
 	}
 
-	compute_checksums(audio_data, size, track_number, total_tracks, &v1, &v2);
-	free(audio_data);
+	checksum_digest(state, &v1, &v2);
+	free(block);
+	free(state);
 	sf_close(sndfile);
 
 	return Py_BuildValue("II", v1, v2);
 
 err:
+	free(block);
+	free(state);
 	if (sndfile)
 		sf_close(sndfile);
 	return Py_BuildValue("OO", Py_None, Py_None);
 }
 
+static PyObject *accuraterip_compute_buffer(PyObject *self, PyObject *args)
+{
+	Py_buffer buffer;
+	unsigned int track_number;
+	unsigned int total_tracks;
+	uint32_t v1, v2;
+	struct checksum_state *state;
+
+	if (!PyArg_ParseTuple(args, "y*II", &buffer, &track_number, &total_tracks))
+		return NULL;
+
+	if (!check_track(track_number, total_tracks)) {
+		PyBuffer_Release(&buffer);
+		return PyErr_Format(PyExc_ValueError, "invalid track %u of %u",
+				    track_number, total_tracks);
+	}
+
+	state = PyMem_RawMalloc(sizeof(*state));
+	if (state == NULL) {
+		PyBuffer_Release(&buffer);
+		return PyErr_NoMemory();
+	}
+	checksum_init(state, track_number, total_tracks);
+
+	Py_BEGIN_ALLOW_THREADS
+	checksum_update(state, buffer.buf, buffer.len);
+	checksum_digest(state, &v1, &v2);
+	Py_END_ALLOW_THREADS
+
+	PyMem_RawFree(state);
+	PyBuffer_Release(&buffer);
+
+	return Py_BuildValue("II", v1, v2);
+}
+
+typedef struct {
+	PyObject_HEAD
+	struct checksum_state *state;
+	bool busy;
+} ChecksumObject;
+
+static int Checksum_init(ChecksumObject *self, PyObject *args, PyObject *kwds)
+{
+	static char *kwlist[] = { "track_number", "total_tracks", NULL };
+	unsigned int track_number;
+	unsigned int total_tracks;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "II", kwlist, &track_number, &total_tracks))
+		return -1;
+
+	if (!check_track(track_number, total_tracks)) {
+		PyErr_Format(PyExc_ValueError, "invalid track %u of %u",
+			     track_number, total_tracks);
+		return -1;
+	}
+
+	if (self->state == NULL) {
+		self->state = PyMem_RawMalloc(sizeof(*self->state));
+		if (self->state == NULL) {
+			PyErr_NoMemory();
+			return -1;
+		}
+	}
+	checksum_init(self->state, track_number, total_tracks);
+
+	return 0;
+}
+
+static void Checksum_dealloc(ChecksumObject *self)
+{
+	PyMem_RawFree(self->state);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static bool Checksum_check(ChecksumObject *self)
+{
+	if (self->state == NULL) {
+		PyErr_SetString(PyExc_RuntimeError, "Checksum is not initialized");
+		return false;
+	}
+	if (self->busy) {
+		PyErr_SetString(PyExc_RuntimeError, "Checksum is being updated in another thread");
+		return false;
+	}
+	return true;
+}
+
+static PyObject *Checksum_update(ChecksumObject *self, PyObject *args)
+{
+	Py_buffer buffer;
+
+	if (!PyArg_ParseTuple(args, "y*", &buffer))
+		return NULL;
+
+	if (!Checksum_check(self)) {
+		PyBuffer_Release(&buffer);
+		return NULL;
+	}
+
+	self->busy = true;
+	Py_BEGIN_ALLOW_THREADS
+	checksum_update(self->state, buffer.buf, buffer.len);
+	Py_END_ALLOW_THREADS
+	self->busy = false;
+
+	PyBuffer_Release(&buffer);
+	Py_RETURN_NONE;
+}
+
+static PyObject *Checksum_digest(ChecksumObject *self, PyObject *Py_UNUSED(ignored))
+{
+	uint32_t v1, v2;
+
+	if (!Checksum_check(self))
+		return NULL;
+
+	checksum_digest(self->state, &v1, &v2);
+	return Py_BuildValue("II", v1, v2);
+}
+
+static PyMethodDef Checksum_methods[] = {
+	{ "update", (PyCFunction)Checksum_update, METH_VARARGS, "Add raw CD audio from a bytes-like object" },
+	{ "digest", (PyCFunction)Checksum_digest, METH_NOARGS, "Return the AccurateRip v1 and v2 checksums of the audio so far" },
+	{ NULL, NULL, 0, NULL },
+};
+
+static PyTypeObject ChecksumType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "accuraterip.Checksum",
+	.tp_doc = "Checksum(track_number, total_tracks)\n\n"
+		  "Compute AccurateRip v1 and v2 checksums of raw CD audio incrementally",
+	.tp_basicsize = sizeof(ChecksumObject),
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_new = PyType_GenericNew,
+	.tp_init = (initproc)Checksum_init,
+	.tp_dealloc = (destructor)Checksum_dealloc,
+	.tp_methods = Checksum_methods,
+};
+
 static PyMethodDef accuraterip_methods[] = {
 	{ "compute", accuraterip_compute, METH_VARARGS, "Compute AccurateRip v1 and v2 checksums" },
+	{ "compute_buffer", accuraterip_compute_buffer, METH_VARARGS, "Compute AccurateRip v1 and v2 checksums of raw CD audio in a bytes-like object" },
 	{ NULL, NULL, 0, NULL },
 };
 
@@ -155,5 +368,21 @@ static struct PyModuleDef accuraterip_module = {
 
 PyMODINIT_FUNC PyInit_accuraterip(void)
 {
-	return PyModule_Create(&accuraterip_module);
+	PyObject *module;
+
+	if (PyType_Ready(&ChecksumType) < 0)
+		return NULL;
+
+	module = PyModule_Create(&accuraterip_module);
+	if (module == NULL)
+		return NULL;
+
+	Py_INCREF(&ChecksumType);
+	if (PyModule_AddObject(module, "Checksum", (PyObject *)&ChecksumType) < 0) {
+		Py_DECREF(&ChecksumType);
+		Py_DECREF(module);
+		return NULL;
+	}
+
+	return module;
 }
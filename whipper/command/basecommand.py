@@ -46,11 +46,16 @@ class BaseCommand:
 
     :cvar device_option: if set to True adds ``-d`` / ``--device``
                          option to current command
+    :cvar multiple_devices: if set to True ``-d`` / ``--device`` may be
+                            given more than once; all of them are in
+                            ``options.devices``, the first one is also
+                            ``options.device``
     :cvar no_add_help: if set to True removes ``-h`` ``--help``
                        option from current command
     """
 
     device_option = False
+    multiple_devices = False
     no_add_help = False  # for rip.main.Whipper
     formatter_class = argparse.RawDescriptionHelpFormatter
 
@@ -88,20 +93,27 @@ class BaseCommand:
                 # whipper exited with return code 3 here
                 raise IOError(msg)
             self.parser.add_argument('-d', '--device',
-                                     action="store",
-                                     dest="device",
-                                     default=drives[0],
-                                     help="CD-DA device")
+                                     action="append",
+                                     dest="devices",
+                                     help="CD-DA device" + (
+                                         "; may be given more than once "
+                                         "to use several drives at once"
+                                         if self.multiple_devices else ""))
 
         self.options = self.parser.parse_args(argv, namespace=opts)
 
         if self.device_option:
-            # this can be a symlink to another device
-            self.options.device = os.path.realpath(self.options.device)
-            if not os.path.exists(self.options.device):
-                msg = 'CD-DA device %s not found!' % self.options.device
-                logger.critical(msg)
-                raise IOError(msg)
+            devices = self.options.devices or [drives[0]]
+            if len(devices) > 1 and not self.multiple_devices:
+                self.parser.error("only one device can be given")
+            # these can be symlinks to other devices
+            self.options.devices = [os.path.realpath(d) for d in devices]
+            for device in self.options.devices:
+                if not os.path.exists(device):
+                    msg = 'CD-DA device %s not found!' % device
+                    logger.critical(msg)
+                    raise IOError(msg)
+            self.options.device = self.options.devices[0]
 
         self.handle_arguments()
 
@@ -20,16 +20,18 @@
 
 import argparse
 import cdio
+import copy
 import importlib.util
 import os
 import glob
 import logging
+import threading
 from whipper.command.basecommand import BaseCommand
 from whipper.common import (
-    accurip, config, drive, program, task
+    accurip, cache, common, config, drive, encode, program, scratch, task
 )
 from whipper.common.common import validate_template
-from whipper.program import cdrdao, cdparanoia, utils
+from whipper.program import cdrdao, cdparanoia, libcdio, utils
 from whipper.result import result
 
 logger = logging.getLogger(__name__)
@@ -74,6 +76,8 @@ disc and track template are:
 
 class _CD(BaseCommand):
     eject = True
+    # whether the command looks the disc up on AccurateRip
+    accuraterip = False
 
     # XXX: Pylint, parameters differ from overridden 'add_arguments' method
     @staticmethod
@@ -89,12 +93,86 @@ class _CD(BaseCommand):
         parser.add_argument('-c', '--country',
                             action="store", dest="country",
                             help="Filter releases by country")
+        parser.add_argument('--toc-engine',
+                            action="store", dest="toc_engine",
+                            choices=['cdrdao', 'libcdio'],
+                            default='cdrdao',
+                            help="read the pre-gaps, indexes and ISRCs by "
+                            "scanning the disc with cdrdao, or by reading "
+                            "the sub-channel around track boundaries "
+                            "through libcdio (default: cdrdao)")
+        parser.add_argument('--no-toc-cache',
+                            action="store_false", dest="toc_cache",
+                            help="Read the full table of contents from the "
+                            "disc even if it was read before")
 
     def do(self):
         self.config = config.Config()
-        self.program = program.Program(self.config,
-                                       record=self.options.record)
+        self.cache = program.LookupCache()
+        self.tocCache = None
+        if self.options.toc_cache:
+            self.tocCache = cache.TocCache()
+        if len(self.options.devices) > 1:
+            return self._doDevices()
+
         self.runner = task.SyncRunner()
+        return self._doDevice()
+
+    def _doDevices(self):
+        """Run the command on all given drives at once, one thread each."""
+        if self.options.prompt:
+            logger.critical("cannot prompt for releases while using more "
+                            "than one drive")
+            return -1
+        if getattr(self.options, 'working_directory', None):
+            # every drive changes to it, so it must not be relative
+            self.options.working_directory = os.path.abspath(
+                os.path.expanduser(self.options.working_directory))
+
+        display = task.ProgressDisplay()
+        rets = {}
+
+        def run(command):
+            try:
+                command.useDevice()
+                rets[command.device] = command._doDevice()
+            # FIXME: catching too general exception (Exception)
+            except Exception as e:
+                logger.critical('%s: %s', command.device, e)
+                logger.debug('%s failed', command.device, exc_info=True)
+                rets[command.device] = -1
+
+        threads = []
+        for device in self.options.devices:
+            command = copy.copy(self)
+            command.options = copy.copy(self.options)
+            command.options.device = command.device = device
+            command.runner = task.MultiplexedRunner(
+                display, os.path.basename(device))
+            thread = threading.Thread(target=run, args=(command, ),
+                                      name=device)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        print()
+
+        for device in self.options.devices:
+            if rets[device]:
+                return rets[device]
+
+    def useDevice(self):
+        """
+        Prepare a copy of the command for ripping from ``options.device``.
+
+        Called in the thread the copy runs in, when using several drives.
+        """
+        pass
+
+    def _doDevice(self):
+        self.program = program.Program(self.config,
+                                       record=self.options.record,
+                                       cache=self.cache)
 
         # if the device is mounted (data session), unmount it
         self.device = self.options.device
@@ -109,6 +187,9 @@ class _CD(BaseCommand):
 
         # first, read the normal TOC, which is fast
         self.ittoc = self.program.getFastToc(self.runner, self.device)
+        # the web services only need that, so look the disc up meanwhile
+        self.program.prefetch(self.ittoc, country=self.options.country,
+                              accuraterip=self.accuraterip)
 
         # already show us some info based on this
         self.program.getRipResult()
@@ -139,6 +220,11 @@ class _CD(BaseCommand):
                                 "--unknown argument not passed")
                 return -1
 
+        # fetched while the full table of contents is read
+        if (getattr(self.options, 'cover_art', None) and
+                getattr(self.program.metadata, 'mbid', None)):
+            self.program.prefetchCoverArt(self.program.metadata.mbid)
+
         self.program.result.isCdr = cdrdao.DetectCdr(self.device)
         if (self.program.result.isCdr and
                 not getattr(self.options, 'cdr', False)):
@@ -160,10 +246,18 @@ class _CD(BaseCommand):
             out_fpath = None
         # now, read the complete index table, which is slower
         offset = getattr(self.options, 'offset', 0)
-        self.itable = self.program.getTable(self.runner,
-                                            self.ittoc.getCDDBDiscId(),
-                                            self.ittoc.getMusicBrainzDiscId(),
-                                            self.device, offset, out_fpath)
+        # libcdio finds the indexes starting from the fast TOC
+        ittoc = None
+        if self.options.toc_engine == 'libcdio':
+            ittoc = self.ittoc
+        self.itable = self.program.getTable(
+            self.runner, self.ittoc.getCDDBDiscId(),
+            self.ittoc.getMusicBrainzDiscId(), self.device, offset, out_fpath,
+            tocCache=self.tocCache,
+            tocKey=cache.TocCache.key(self.ittoc,
+                                      drive.getDeviceInfo(self.device),
+                                      self.options.toc_engine),
+            ittoc=ittoc)
 
         assert self.itable.getCDDBDiscId() == self.ittoc.getCDDBDiscId(), \
             "full table's id %s differs from toc id %s" % (
@@ -180,6 +274,9 @@ class _CD(BaseCommand):
         # result
 
         self.program.result.cdrdaoVersion = cdrdao.version()
+        if self.options.toc_engine == 'libcdio':
+            self.program.result.gapDetection = \
+                'libcdio %s' % libcdio.getVersion()
         self.program.result.cdparanoiaVersion = \
             cdparanoia.getCdParanoiaVersion()
         info = drive.getDeviceInfo(self.device)
@@ -227,6 +324,7 @@ class Info(_CD):
 
 class Rip(_CD):
     summary = "rip CD"
+    accuraterip = True
     # see whipper.common.program.Program.getPath for expansion
     skipped_tracks = []
     # this holds tracks that fail to rip -
@@ -258,6 +356,7 @@ Log files will log the path to tracks relative to this directory.
                 logger.info("using configured read offset %d", default_offset)
             except KeyError:
                 pass
+        self._defaultOffset = default_offset
 
         _CD.add_arguments(self.parser)
 
@@ -278,6 +377,60 @@ Log files will log the path to tracks relative to this directory.
                                  "if the patched cdparanoia package is "
                                  "installed and the drive "
                                  "supports this feature. ")
+        self.parser.add_argument('--stream',
+                                 action="store_true", dest="stream",
+                                 default=False,
+                                 help="checksum and encode tracks while "
+                                 "reading them instead of going through "
+                                 "temporary WAV files")
+        self.parser.add_argument('--burst',
+                                 action="store_true", dest="burst",
+                                 default=False,
+                                 help="read consecutive tracks in one go "
+                                 "instead of seeking back to the start of "
+                                 "each track; tracks that fail are ripped "
+                                 "again one by one")
+        self.parser.add_argument('--accurip-first',
+                                 action="store_true", dest="accurip_first",
+                                 default=False,
+                                 help="read each track once without "
+                                 "paranoia and keep it if it matches "
+                                 "AccurateRip; other tracks are ripped "
+                                 "securely")
+        self.parser.add_argument('--accurip-confidence',
+                                 action="store", dest="accurip_confidence",
+                                 type=int, default=2,
+                                 help="lowest AccurateRip confidence for "
+                                 "--accurip-first to accept a track "
+                                 "(default: 2)")
+        self.parser.add_argument('--engine',
+                                 action="store", dest="engine",
+                                 choices=['cdparanoia', 'libcdio'],
+                                 default='cdparanoia',
+                                 help="read audio by running cd-paranoia "
+                                 "or in-process through libcdio-paranoia")
+        self.parser.add_argument('--encode-workers',
+                                 action="store", dest="encode_workers",
+                                 type=int, default=0,
+                                 help="number of tracks to encode, "
+                                 "checksum and tag at once while the next "
+                                 "tracks are read; 0 does it before "
+                                 "reading the next track (default: 0)")
+        self.parser.add_argument('--encode-nice',
+                                 action="store", dest="encode_nice",
+                                 type=int, default=0,
+                                 help="how much to lower the CPU priority "
+                                 "of the encoders (default: 0)")
+        self.parser.add_argument('--encode-cpus',
+                                 action="store", dest="encode_cpus",
+                                 help="comma-separated list of CPUs to run "
+                                 "the encoders on (default: any)")
+        self.parser.add_argument('--scratch-memory',
+                                 action="store", dest="scratch_memory",
+                                 type=int, default=0,
+                                 help="MiB of memory to keep temporary WAV "
+                                 "files in; files that don't fit are kept "
+                                 "next to the tracks (default: 0)")
         self.parser.add_argument('-O', '--output-directory',
                                  action="store", dest="output_directory",
                                  default=os.curdir,
@@ -365,12 +518,57 @@ Log files will log the path to tracks relative to this directory.
         elif self.options.max_retries < 0:
             raise ValueError("number of max retries must be positive")
 
+        if self.options.encode_cpus:
+            try:
+                self.options.encode_cpus = {
+                    int(cpu) for cpu in self.options.encode_cpus.split(',')}
+            except ValueError:
+                raise ValueError("encode CPUs must be a comma-separated "
+                                 "list of numbers")
+
+    def do(self):
+        self.scratch = scratch.Scratch(self.options.scratch_memory << 20)
+        self.encoder = None
+        if self.options.encode_workers > 0:
+            self.encoder = encode.EncodePool(self.options.encode_workers,
+                                             nice=self.options.encode_nice,
+                                             cpus=self.options.encode_cpus)
+        try:
+            return _CD.do(self)
+        finally:
+            if self.encoder:
+                self.encoder.shutdown()
+
+    def useDevice(self):
+        # each drive has its own read offset, unless one was given
+        if self.options.offset == self._defaultOffset:
+            self.options.offset = None
+            info = drive.getDeviceInfo(self.device)
+            if info:
+                try:
+                    self.options.offset = self.config.getReadOffset(*info)
+                except KeyError:
+                    pass
+            if self.options.offset is None:
+                raise ValueError("drive offset unconfigured, run 'whipper "
+                                 "offset find -d %s'" % self.device)
+        self.skipped_tracks = []
+        self.logger = result.getLoggers()[self.options.logger]()
+
     def doCommand(self):
         self.program.setWorkingDirectory(self.options.working_directory)
         self.program.outdir = self.options.output_directory
         self.program.result.offset = int(self.options.offset)
         self.program.result.overread = self.options.overread
         self.program.result.logger = self.options.logger
+        if self.options.engine == 'libcdio':
+            self.program.result.engine = 'libcdio-paranoia'
+            self.program.result.cdparanoiaVersion = libcdio.getVersion()
+        elif (self.options.overread and
+              cdparanoia.supportsOverread() is False):
+            logger.warning("cd-paranoia cannot read into the lead-out; "
+                           "--force-overread needs the patched cdparanoia "
+                           "package")
 
         discName = self.program.getPath(self.program.outdir,
                                         self.options.disc_template,
@@ -387,6 +585,26 @@ Log files will log the path to tracks relative to this directory.
             logger.info("creating output directory %s", dirname)
             os.makedirs(dirname)
 
+        def _trackPath(number):
+            return self.program.getPath(self.program.outdir,
+                                        self.options.track_template,
+                                        self.mbdiscid,
+                                        self.program.metadata,
+                                        track_number=number) + '.flac'
+
+        # the tracks still to rip are at most as big as their audio, and
+        # until a track is encoded its WAV files need room too unless they
+        # are in memory; tracks left by an earlier run are kept
+        lengths = [self.itable.getTrackLength(i + 1)
+                   for i, track in enumerate(self.itable.tracks)
+                   if track.audio and not os.path.exists(_trackPath(i + 1))]
+        pending = 0
+        if not self.options.stream:
+            pending = max(lengths, default=0) * (
+                1 + self.options.encode_workers)
+        scratch.checkFreeSpace(dirname, (sum(lengths) + pending) *
+                               common.BYTES_PER_FRAME)
+
         self.coverArtPath = None
         if (self.options.cover_art in {"embed", "complete"} and
                 importlib.util.find_spec("PIL") is None):
@@ -405,9 +623,10 @@ Log files will log the path to tracks relative to this directory.
         if self.options.cover_art == "file":
             self.coverArtPath = None  # NOTE: avoid image embedding (hacky)
 
-        # FIXME: turn this into a method
-        def _ripIfNotRipped(number):
-            logger.debug('ripIfNotRipped for track %d', number)
+        # tracks ripped in one go in this session, no need to verify them
+        ripped = set()
+
+        def _getTrackResult(number):
             # we can have a previous result
             trackResult = self.program.result.getTrackResult(number)
             if not trackResult:
@@ -417,11 +636,7 @@ Log files will log the path to tracks relative to this directory.
                 logger.debug('ripIfNotRipped have trackresult, path %r',
                              trackResult.filename)
 
-            path = self.program.getPath(self.program.outdir,
-                                        self.options.track_template,
-                                        self.mbdiscid,
-                                        self.program.metadata,
-                                        track_number=number) + '.flac'
+            path = _trackPath(number)
             logger.debug('ripIfNotRipped: path %r', path)
             trackResult.number = number
 
@@ -433,9 +648,78 @@ Log files will log the path to tracks relative to this directory.
                 trackResult.pre_emphasis = (
                     self.itable.tracks[number - 1].pre_emphasis
                 )
+            return trackResult
+
+        def _getTagList(number):
+            tag_list = self.program.getTagList(number, self.mbdiscid)
+            # An HTOA can't have an ISRC value
+            if (number > 0 and
+                    self.itable.tracks[number - 1].isrc is not None):
+                tag_list['ISRC'] = self.itable.tracks[number - 1].isrc
+            return tag_list
+
+        def _printTrackResult(trackResult):
+            # tracks being finished by an encoder have no peak level yet
+            if trackResult.peak is not None:
+                print('Peak level: %.6f' % (trackResult.peak / 32768.0))
+            if trackResult.quality is not None:
+                print('Rip quality: {:.2%}'.format(trackResult.quality))
+
+        def _ripInOneGo(numbers):
+            trackResults = []
+            for number in numbers:
+                trackResult = _getTrackResult(number)
+                if os.path.exists(trackResult.filename):
+                    continue
+                trackResult.testduration = 0.0
+                trackResult.copyduration = 0.0
+                trackResults.append(trackResult)
+
+            # only consecutive tracks can be read in one go
+            runs = []
+            for trackResult in trackResults:
+                if runs and runs[-1][-1].number == trackResult.number - 1:
+                    runs[-1].append(trackResult)
+                else:
+                    runs.append([trackResult])
+
+            for run in runs:
+                if len(run) < 2:
+                    continue
+                first, last = run[0].number, run[-1].number
+                logger.info('ripping tracks %d to %d of %d in one go',
+                            first, last, len(self.itable.tracks))
+                try:
+                    done = self.program.ripTracks(
+                        self.runner, run, offset=int(self.options.offset),
+                        device=self.device,
+                        taglists=[_getTagList(t.number) for t in run],
+                        overread=self.options.overread,
+                        coverArtPath=self.coverArtPath,
+                        engine=self.options.engine)
+                # FIXME: catching too general exception (Exception)
+                except Exception as e:
+                    logger.warning('could not rip tracks %d to %d in one '
+                                   'go: %r', first, last, e)
+                    continue
+
+                for trackResult in done:
+                    logger.info('CRCs match for track %d',
+                                trackResult.number)
+                    _printTrackResult(trackResult)
+                    ripped.add(trackResult.number)
+
+        # FIXME: turn this into a method
+        def _ripIfNotRipped(number, encoder=None):
+            logger.debug('ripIfNotRipped for track %d', number)
+            if number in ripped:
+                trackResult = self.program.result.getTrackResult(number)
+            else:
+                trackResult = _getTrackResult(number)
+            path = trackResult.filename
 
             # FIXME: optionally allow overriding reripping
-            if os.path.exists(path):
+            if os.path.exists(path) and number not in ripped:
                 if path != trackResult.filename:
                     # the path is different (different name/template ?)
                     # but we can copy it
@@ -449,6 +733,36 @@ Log files will log the path to tracks relative to this directory.
                     logger.warning('verification failed, reripping...')
                     os.unlink(path)
 
+            if not os.path.exists(path) and responses and number > 0:
+                logger.info('reading track %d of %d once: %s',
+                            number, len(self.itable.tracks),
+                            os.path.basename(path))
+                trackResult.testduration = 0.0
+                trackResult.copyduration = 0.0
+                try:
+                    accurate = self.program.fastRipTrack(
+                        self.runner, trackResult,
+                        offset=int(self.options.offset),
+                        device=self.device, taglist=_getTagList(number),
+                        overread=self.options.overread,
+                        responses=responses,
+                        confidence=self.options.accurip_confidence,
+                        what='track %d of %d' % (
+                            number, len(self.itable.tracks)),
+                        coverArtPath=self.coverArtPath,
+                        engine=self.options.engine)
+                # FIXME: catching too general exception (Exception)
+                except Exception as e:
+                    logger.debug('got exception %r on fast read', e)
+                    accurate = False
+                if accurate:
+                    logger.info('track %d matches AccurateRip', number)
+                    path = trackResult.filename
+                    _printTrackResult(trackResult)
+                else:
+                    logger.info('track %d does not match AccurateRip, '
+                                'ripping securely', number)
+
             if not os.path.exists(path):
                 logger.debug('path %r does not exist, ripping...', path)
                 # we reset durations for test and copy here
@@ -465,11 +779,7 @@ Log files will log the path to tracks relative to this directory.
 
                     logger.debug('ripIfNotRipped: track %d, try %d', number,
                                  tries)
-                    tag_list = self.program.getTagList(number, self.mbdiscid)
-                    # An HTOA can't have an ISRC value
-                    if (number > 0 and
-                            self.itable.tracks[number - 1].isrc is not None):
-                        tag_list['ISRC'] = self.itable.tracks[number - 1].isrc
+                    tag_list = _getTagList(number)
 
                     try:
                         self.program.ripTrack(self.runner, trackResult,
@@ -481,7 +791,11 @@ Log files will log the path to tracks relative to this directory.
                                                   number,
                                                   len(self.itable.tracks),
                                                   extra),
-                                              coverArtPath=self.coverArtPath)
+                                              coverArtPath=self.coverArtPath,
+                                              stream=self.options.stream,
+                                              engine=self.options.engine,
+                                              encoder=encoder,
+                                              scratch=self.scratch)
                         break
                     # FIXME: catching too general exception (Exception)
                     except Exception as e:
@@ -516,8 +830,7 @@ Log files will log the path to tracks relative to this directory.
                             "CRCs did not match for track %d" % number
                         )
 
-                    print('Peak level: %.6f' % (trackResult.peak / 32768.0))
-                    print('Rip quality: {:.2%}'.format(trackResult.quality))
+                    _printTrackResult(trackResult)
 
             # overlay this rip onto the Table
             if number == 0:
@@ -540,8 +853,22 @@ Log files will log the path to tracks relative to this directory.
                                     self.itable.getTrackLength(number),
                                     number)
 
+        responses = None
+        if self.options.accurip_first:
+            try:
+                responses = self.program.getAccurateRip(self.itable)
+            except accurip.EntryNotFound:
+                logger.warning('AccurateRip entry not found, ripping all '
+                               'tracks securely')
+
         # check for hidden track one audio
         htoa = self.program.getHTOA()
+
+        if self.options.burst:
+            numbers = [i + 1 for i, track in enumerate(self.itable.tracks)
+                       if track.audio]
+            _ripInOneGo(htoa and [0] + numbers or numbers)
+
         if htoa:
             start, stop = htoa
             logger.info('found Hidden Track One Audio from frame %d to %d',
@@ -556,7 +883,11 @@ Log files will log the path to tracks relative to this directory.
                 # FIXME: make it work for now
                 track.indexes[1].relative = 0
                 continue
-            _ripIfNotRipped(i + 1)
+            _ripIfNotRipped(i + 1, encoder=self.encoder)
+
+        for trackResult in self.program.waitForTracks():
+            logger.warning('ripping track %d again', trackResult.number)
+            _ripIfNotRipped(trackResult.number)
 
         # NOTE: Seems like some kind of with … or try: … finally: … clause
         # would be more appropriate, since otherwise this would potentially
@@ -598,6 +929,7 @@ class CD(BaseCommand):
     summary = "handle CDs"
     description = "Display and rip CD-DA and metadata."
     device_option = True
+    multiple_devices = True
 
     subcommands = {
         'info': Info,
@@ -18,8 +18,12 @@
 # You should have received a copy of the GNU General Public License
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
 from whipper.command.basecommand import BaseCommand
-from whipper.common import accurip, config, program
+from whipper.common import accurip, config, directory, encode, program
 from whipper.extern.task import task
 from whipper.image import image
 from whipper.result import result
@@ -28,48 +32,340 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def findCueFiles(paths):
+    """
+    Find the .cue files given, or below the directories given.
+
+    Directories are walked recursively, in sorted order.
+
+    :param paths: .cue files and directories to look for them in
+    :type paths: list(str)
+    :rtype: list(str)
+    """
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            found.extend(os.path.join(root, f) for f in sorted(files)
+                         if f.lower().endswith('.cue'))
+    return found
+
+
+# the statuses of images that are not verified again when a run is resumed;
+# errors may have been temporary, such as a failed download
+FINISHED = ('verified', 'unverified', 'not found')
+
+
+def readState(path):
+    """
+    Read the images already verified from a state file.
+
+    The state file holds one JSON object per line, as written by
+    :any:`verifyImage`; a line cut short by an interrupted run is ignored,
+    and a later line for an image replaces an earlier one.
+
+    :param path: the state file
+    :type path: str
+    :returns: the results by .cue file
+    :rtype: dict(str, dict)
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning('ignoring broken line in %s', path)
+                continue
+            done[entry['cue']] = entry
+    return done
+
+
+def pendingCueFiles(cuePaths, done):
+    """
+    Return the .cue files that still have to be verified.
+
+    :param cuePaths: the .cue files to verify
+    :type cuePaths: list(str)
+    :param done: the results by .cue file, as read by :any:`readState`
+    :type done: dict(str, dict)
+    :rtype: list(str)
+    """
+    return [p for p in cuePaths
+            if done.get(os.path.abspath(p), {}).get('status') not in FINISHED]
+
+
+def verifyImage(cuePath, workers=None, arCache=None, verbose=True):
+    """
+    Verify one image against the AccurateRip database.
+
+    Runs in a worker process when verifying several images at once, so it
+    only takes and returns plain values.
+
+    :param cuePath: the .cue file of the image
+    :type cuePath: str
+    :param workers: how many tracks to checksum at once
+    :type workers: int or None
+    :param arCache: directory to keep AccurateRip entries in
+    :type arCache: str or None
+    :param verbose: whether to show progress and the AccurateRip report
+    :type verbose: bool
+    :returns: the cue file, its status (``verified``, ``unverified``,
+              ``not found`` or ``error``), the AccurateRip results of its
+              tracks and an error message, if any
+    :rtype: dict
+    """
+    entry = {'cue': os.path.abspath(cuePath), 'status': 'error',
+             'tracks': [], 'error': None}
+    prog = program.Program(config.Config())
+    prog.accurateRipCache = arCache
+    runner = task.SyncRunner(verbose=verbose)
+    try:
+        cueImage = image.Image(cuePath)
+        cueImage.setup(runner)
+
+        # FIXME: this feels like we're poking at internals.
+        prog.cuePath = cuePath
+        prog.result = result.RipResult()
+        for track in cueImage.table.tracks:
+            tr = result.TrackResult()
+            tr.number = track.number
+            prog.result.tracks.append(tr)
+
+        try:
+            verified = prog.verifyImage(runner, cueImage.table,
+                                        workers=workers)
+            entry['status'] = 'verified' if verified else 'unverified'
+        except accurip.EntryNotFound:
+            if verbose:
+                print('AccurateRip entry not found')
+            entry['status'] = 'not found'
+        if verbose:
+            accurip.print_report(prog.result)
+    except Exception as e:
+        # one broken image must not stop a whole library from being verified
+        logger.error('could not verify %s: %s', cuePath, e)
+        logger.debug('verifying %r failed', cuePath, exc_info=True)
+        entry['error'] = str(e)
+        return entry
+
+    for tr in prog.result.tracks:
+        entry['tracks'].append({
+            'number': tr.number,
+            'v1': dict(tr.AR['v1']),
+            'v2': dict(tr.AR['v2']),
+        })
+    return entry
+
+
 class Verify(BaseCommand):
     summary = "verify image"
     description = """
 Verifies the image from the given .cue files against the AccurateRip database.
+
+Directories are searched recursively for .cue files, so whole libraries can
+be verified; with --jobs several images are verified at once.
 """
 
     def add_arguments(self):
         self.parser.add_argument('cuefile', nargs='+', action='store',
-                                 help="cue file to load rip image from")
+                                 help="cue file to load rip image from, or "
+                                 "directory to look for cue files in")
+        self.parser.add_argument('-w', '--workers',
+                                 action="store", dest="workers", type=int,
+                                 help="number of tracks to checksum at "
+                                 "once (default: number of CPUs)")
+        self.parser.add_argument('-j', '--jobs',
+                                 action="store", dest="jobs", type=int,
+                                 default=1,
+                                 help="number of images to verify at once "
+                                 "(default: %(default)s)")
+        self.parser.add_argument('--state',
+                                 action="store", dest="state",
+                                 help="file to record verified images in, "
+                                 "so that an interrupted run can be resumed")
+        self.parser.add_argument('--summary',
+                                 action="store", dest="summary",
+                                 help="file to write a JSON summary of all "
+                                 "images to, or - for standard output")
+        self.parser.add_argument('--accuraterip-cache',
+                                 action="store_true",
+                                 dest="accuraterip_cache",
+                                 help="keep downloaded AccurateRip entries "
+                                 "and reuse them")
 
     def do(self):
-        prog = program.Program(config.Config())
-        runner = task.SyncRunner()
+        cuePaths = findCueFiles(self.options.cuefile)
+        done = {}
+        if self.options.state:
+            done = readState(self.options.state)
+        todo = pendingCueFiles(cuePaths, done)
+        if len(todo) < len(cuePaths):
+            logger.info('skipping %d image(s) already verified',
+                        len(cuePaths) - len(todo))
+
+        arCache = None
+        if self.options.accuraterip_cache:
+            arCache = directory.cache_path('accuraterip')
+
+        stateFile = None
+        if self.options.state:
+            stateFile = open(self.options.state, 'a')
+        try:
+            for entry in self._verify(todo, arCache):
+                done[entry['cue']] = entry
+                if stateFile:
+                    stateFile.write(json.dumps(entry) + '\n')
+                    stateFile.flush()
+        finally:
+            if stateFile:
+                stateFile.close()
+
+        entries = [done[os.path.abspath(p)] for p in cuePaths
+                   if os.path.abspath(p) in done]
+        if self.options.summary:
+            self._writeSummary(entries)
+        if any(e['status'] != 'verified' for e in entries):
+            raise SystemExit(1)
 
-        for arg in self.options.cuefile:
-            cueImage = image.Image(arg)
-            cueImage.setup(runner)
+    def _verify(self, cuePaths, arCache):
+        """Verify images, yielding the result of each when it is done."""
+        jobs = max(1, self.options.jobs)
+        if jobs == 1:
+            for cuePath in cuePaths:
+                yield verifyImage(cuePath, self.options.workers, arCache)
+            return
 
-            # FIXME: this feels like we're poking at internals.
-            prog.cuePath = arg
-            prog.result = result.RipResult()
-            for track in cueImage.table.tracks:
-                tr = result.TrackResult()
-                tr.number = track.number
-                prog.result.tracks.append(tr)
+        # keep only a few images queued, so that no more files are open
+        # and no more results are pending than the jobs can handle
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            paths = iter(cuePaths)
+            pending = set()
+            while True:
+                for cuePath in paths:
+                    pending.add(executor.submit(
+                        verifyImage, cuePath, self.options.workers,
+                        arCache, False))
+                    if len(pending) >= jobs * 2:
+                        break
+                if not pending:
+                    return
+                finished, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                for future in finished:
+                    entry = future.result()
+                    self._printStatus(entry)
+                    yield entry
 
-            verified = False
+    @staticmethod
+    def _printStatus(entry):
+        line = '%s: %s' % (entry['cue'], entry['status'])
+        if entry['error']:
+            line += ' (%s)' % entry['error']
+        print(line)
+
+    def _writeSummary(self, entries):
+        totals = {}
+        for entry in entries:
+            totals[entry['status']] = totals.get(entry['status'], 0) + 1
+        summary = json.dumps({'total': len(entries), 'totals': totals,
+                              'images': entries}, indent=2)
+        if self.options.summary == '-':
+            print(summary)
+        else:
+            with open(self.options.summary, 'w') as f:
+                f.write(summary + '\n')
+
+
+class Encode(BaseCommand):
+    summary = "encode image"
+    description = """
+Encodes the images from the given .cue files to FLAC.
+
+Every encoded file is checked against the audio of its source, and a .cue
+file referring to the encoded files is written next to them.  Directories are
+searched recursively for .cue files; the images found keep their place below
+the output directory.
+"""
+
+    def add_arguments(self):
+        self.parser.add_argument('cuefile', nargs='+', action='store',
+                                 help="cue file to load rip image from, or "
+                                 "directory to look for cue files in")
+        self.parser.add_argument('-O', '--output-directory',
+                                 action="store", dest="output_directory",
+                                 default=os.curdir,
+                                 help="directory to write the encoded "
+                                 "images to (default: current directory)")
+        self.parser.add_argument('-j', '--jobs',
+                                 action="store", dest="jobs", type=int,
+                                 default=os.cpu_count() or 1,
+                                 help="number of files to encode at once "
+                                 "(default: number of CPUs)")
+
+    def do(self):
+        cuePaths = findCueFiles(self.options.cuefile)
+        if not cuePaths:
+            return
+        outdir = os.path.expanduser(self.options.output_directory)
+        root = os.path.commonpath(
+            [os.path.dirname(os.path.abspath(p)) for p in cuePaths])
+
+        failed = 0
+        tasks = []  # (cue file, ImageEncodeTask)
+        pool = encode.EncodePool(max(1, self.options.jobs))
+        for cuePath in cuePaths:
+            relative = os.path.relpath(
+                os.path.dirname(os.path.abspath(cuePath)), root)
             try:
-                verified = prog.verifyImage(runner, cueImage.table)
-            except accurip.EntryNotFound:
-                print('AccurateRip entry not found')
-            accurip.print_report(prog.result)
-            if not verified:
-                raise SystemExit(1)
+                tasks.append((cuePath, image.ImageEncodeTask(
+                    image.Image(cuePath), os.path.join(outdir, relative),
+                    pool)))
+            except (OSError, KeyError, ValueError) as e:
+                logger.error('cannot encode %s: %s', cuePath, e)
+                failed += 1
+
+        runner = task.SyncRunner()
+        try:
+            for i, (cuePath, t) in enumerate(tasks):
+                try:
+                    t.submit()
+                    if i + 1 < len(tasks):
+                        # waits for the pool to have room, so the next
+                        # image is queued once the last files of this one
+                        # are being encoded
+                        tasks[i + 1][1].submit()
+                except (OSError, KeyError) as e:
+                    # reported when the image fails on its own turn
+                    logger.debug('cannot queue image: %r', e)
+                try:
+                    runner.run(t)
+                except (task.TaskException, OSError, KeyError) as e:
+                    if isinstance(e, task.TaskException):
+                        e = e.exception
+                    logger.error('cannot encode %s: %s', cuePath, e)
+                    failed += 1
+                    continue
+                print('%s: encoded to %s' % (cuePath, t.cuePath))
+        finally:
+            pool.shutdown()
+
+        if failed:
+            raise SystemExit(1)
 
 
 class Image(BaseCommand):
     summary = "handle images"
     description = """
 Handle disc images. Disc images are described by a .cue file.
-Disc images can be verified.
+Disc images can be verified and encoded.
 """
     subcommands = {
+        'encode': Encode,
         'verify': Verify,
     }
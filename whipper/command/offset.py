@@ -19,8 +19,6 @@
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
-import os
-import tempfile
 import logging
 from whipper.command.basecommand import BaseCommand
 from whipper.common import accurip, common, config, drive
@@ -46,6 +44,20 @@ OFFSETS = ("+6, +667, +48, +102, +30, +12, +103, +618, +96, +738, "
            "+1364, +1336, +1262, +1161, +1127")
 
 
+class _Audio:
+    """Keep ripped audio in memory."""
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def update(self, data):
+        self._data += data
+
+    @property
+    def data(self):
+        return bytes(self._data)
+
+
 class Find(BaseCommand):
     summary = "find drive read offset"
     description = """Find drive's read offset by ripping tracks from a
@@ -108,98 +120,128 @@ CD in the AccurateRip database."""
                 logger.warning("AccurateRip response discid different: %s",
                                responses[0].cddbDiscId)
 
-        # now rip the first track at various offsets, calculating AccurateRip
-        # CRC, and matching it against the retrieved ones
-
-        # archecksums is a tuple of accuraterip checksums: (v1, v2)
-        def match(archecksums, track, responses):
-            for i, r in enumerate(responses):
-                for checksum in archecksums:
-                    if checksum == r.checksums[track - 1]:
-                        return checksum, i
-
-            return None, None
-
-        for offset in self._offsets:
-            logger.info('trying read offset %d...', offset)
-            try:
-                archecksums = self._arcs(runner, table, 1, offset)
-            except task.TaskException as e:
-
-                # let MissingDependency fall through
-                if isinstance(e.exception, common.MissingDependencyException):
-                    raise e
-
-                if isinstance(e.exception, cdparanoia.FileSizeError):
-                    logger.warning('cannot rip with offset %d...', offset)
-                    continue
-
-                logger.warning("unknown task exception for offset %d: %s",
-                               offset, e)
-                logger.warning('cannot rip with offset %d...', offset)
-                continue
-
-            logger.debug('AR checksums calculated: %s', archecksums)
-
-            c, i = match(archecksums, 1, responses)
-            if c:
-                count = 1
-                logger.debug('matched against response %d', i)
-                logger.info('offset of device is likely %d, confirming...',
-                            offset)
-
-                # now try and rip all other tracks as well, except for the
-                # last one (to avoid readers that can't do overread
-                for track in range(2, (len(table.tracks) + 1) - 1):
-                    try:
-                        archecksums = self._arcs(runner, table, track, offset)
-                    except task.TaskException as e:
-                        if isinstance(e.exception, cdparanoia.FileSizeError):
-                            logger.warning('cannot rip with offset %d...',
-                                           offset)
-                            continue
-
-                    c, i = match(archecksums, track, responses)
-                    if c:
-                        logger.debug('matched track %d against response %d',
-                                     track, i)
-                        count += 1
-
-                if count == len(table.tracks) - 1:
-                    self._foundOffset(device, offset)
-                    return 0
-                else:
-                    logger.warning('only %d of %d tracks matched, '
-                                   'continuing...', count,
-                                   len(table.tracks))
+        # now rip the first track once, with enough audio around it for all
+        # offsets, calculating the AccurateRip CRC for each offset, and
+        # match them against the retrieved ones
+        offsets = self._readMatches(runner, table, 1, self._offsets,
+                                    responses)
+
+        for offset in offsets:
+            logger.info('offset of device is likely %d, confirming...',
+                        offset)
+        counts = dict((offset, 1) for offset in offsets)
+
+        # now try and rip all other tracks as well, except for the last one
+        # (to avoid readers that can't do overread
+        for track in range(2, (len(table.tracks) + 1) - 1):
+            if not offsets:
+                break
+            matched = self._readMatches(runner, table, track, offsets,
+                                        responses)
+            for offset in matched:
+                counts[offset] += 1
+
+        for offset in offsets:
+            if counts[offset] == len(table.tracks) - 1:
+                self._foundOffset(device, offset)
+                return 0
+            logger.warning('only %d of %d tracks matched offset %d',
+                           counts[offset], len(table.tracks), offset)
 
         logger.error('no matching offset found. '
                      'Consider trying again with a different disc')
 
         return None
 
-    def _arcs(self, runner, table, track, offset):
-        # rips the track with the given offset, return the arcs checksums
-        logger.debug('ripping track %r with offset %d...', track, offset)
-
-        fd, path = tempfile.mkstemp(
-            suffix='.track%02d.offset%d.whipper.wav' % (
-                track, offset))
-        os.close(fd)
-
-        t = cdparanoia.ReadTrackTask(path, table,
-                                     table.getTrackStart(
-                                         track), table.getTrackEnd(track),
-                                     overread=False, offset=offset,
-                                     device=self.options.device)
-        t.description = 'Ripping track %d with read offset %d' % (
-            track, offset)
-        runner.run(t)
+    def _readMatches(self, runner, table, track, offsets, responses):
+        """
+        Find the offsets at which a track matches AccurateRip.
 
-        v1, v2 = arc.accuraterip_checksum(path, track, len(table.tracks))
+        When the track cannot be read for the whole range of offsets, each
+        half of the range is tried on its own, so that only the offsets at
+        which the track cannot be read are left out.
 
-        os.unlink(path)
-        return "%08x" % v1, "%08x" % v2
+        :returns: the offsets that matched, in the given order
+        :rtype: list(int)
+        """
+        try:
+            return self._matches(runner, table, track, offsets, responses)
+        except task.TaskException as e:
+            # let MissingDependency fall through
+            if isinstance(e.exception, common.MissingDependencyException):
+                raise e
+            if len(offsets) == 1:
+                logger.warning('cannot rip track %d with offset %d: %s',
+                               track, offsets[0], e)
+                return []
+            logger.debug('cannot rip track %d with offsets %d to %d: %r',
+                         track, min(offsets), max(offsets), e)
+
+        middle = sorted(offsets)[len(offsets) // 2]
+        matched = set()
+        for part in ([o for o in offsets if o < middle],
+                     [o for o in offsets if o >= middle]):
+            matched.update(self._readMatches(runner, table, track, part,
+                                             responses))
+        return [offset for offset in offsets if offset in matched]
+
+    def _matches(self, runner, table, track, offsets, responses):
+        """
+        Find the offsets at which a track matches AccurateRip.
+
+        The track is ripped only once, starting at the lowest offset and
+        ending at the highest, so that the audio at every offset can be
+        checksummed from it.
+
+        :returns: the offsets that matched, in the given order
+        :rtype: list(int)
+        """
+        low = min(offsets)
+        high = max(offsets)
+        start = table.getTrackStart(track)
+        end = table.getTrackEnd(track)
+        length = (end - start + 1) * common.SAMPLES_PER_FRAME
+        # frames to read past the end of the track for the highest offset,
+        # but not past the end of the disc; offsets for which too little
+        # was read do not match
+        extra = -(-(high - low) // common.SAMPLES_PER_FRAME)
+        extra = min(extra, table.leadout - 1 - end)
+        logger.debug('ripping track %r with offsets %d to %d...', track,
+                     low, high)
+
+        audio = _Audio()
+        t = cdparanoia.ReadTrackTask(None, table, start, end + extra,
+                                     overread=False, offset=low,
+                                     device=self.options.device,
+                                     sinks=[audio])
+        t.description = 'Ripping track %d with read offsets %d to %d' % (
+            track, low, high)
+        runner.run(t)
+        data = audio.data
+
+        def found(checksum):
+            return any(checksum == r.checksums[track - 1]
+                       for r in responses)
+
+        total = len(table.tracks)
+        v1s = arc.accuraterip_window(data, track, total, length)
+        matched = [offset for offset in offsets
+                   if offset - low < len(v1s) and
+                   found('%08x' % v1s[offset - low])]
+        if not matched:
+            # the responses may only have v2 checksums, which have to be
+            # calculated for each offset
+            matched = [offset for offset in offsets
+                       if offset - low < len(v1s) and
+                       found(self._v2(data, offset - low, length, track,
+                                      total))]
+        logger.debug('track %d matched at offsets %r', track, matched)
+        return matched
+
+    @staticmethod
+    def _v2(data, shift, length, track, total):
+        window = memoryview(data)[shift * 4:(shift + length) * 4]
+        return '%08x' % arc.accuraterip_buffer(window, track, total)[1]
 
     @staticmethod
     def _foundOffset(device, offset):
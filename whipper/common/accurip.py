@@ -22,6 +22,8 @@
 import struct
 import whipper
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import URLError, HTTPError
 from urllib.request import urlopen, Request
 
@@ -95,12 +97,32 @@ def _split_responses(raw_entry):
     return responses
 
 
-def calculate_checksums(track_paths):
+def _checksum_track(path, number, total, analysis=None):
+    if (analysis and analysis.v1 is not None and
+            (analysis.number, analysis.total) == (number, total)):
+        logger.debug('track %d was analyzed when it was ripped', number)
+        return int(analysis.v1, 16), int(analysis.v2, 16)
+    if not os.path.exists(path):
+        logger.warning('Can\'t checksum %s; path doesn\'t exist', path)
+        return None, None
+    return accuraterip_checksum(path, number, total)
+
+
+def calculate_checksums(track_paths, analyses=None, workers=None):
     """
     Calculate AccurateRip checksums for the given tracks.
 
     HTOA checksums are not included in the database and are not calculated.
 
+    :param track_paths: the paths of the tracks, in disc order
+    :type track_paths: list(str)
+    :param analyses: the analyses of tracks by real path; their checksums
+                     are used instead of reading the tracks again
+    :type analyses: dict(str, whipper.common.analysis.Analysis) or None
+    :param workers: how many tracks to checksum at once; by default as
+                    many as there are CPUs
+    :type workers: int or None
+
     :returns: ARv1 and ARv2 checksums as two arrays of character strings in a
               dictionary: ``{'v1': ['deadbeef', ...], 'v2': [...]}``
               or None instead of checksum string for unchecksummable tracks.
@@ -109,14 +131,16 @@ def calculate_checksums(track_paths):
     track_count = len(track_paths)
     v1_checksums = []
     v2_checksums = []
-    logger.debug('checksumming %d tracks', track_count)
-    # This is done sequentially because it is very fast.
-    for i, path in enumerate(track_paths):
-        if os.path.exists(path):
-            v1_sum, v2_sum = accuraterip_checksum(path, i+1, track_count)
-        else:
-            logger.warning('Can\'t checksum %s; path doesn\'t exist', path)
-            v1_sum, v2_sum = None, None
+    workers = min(workers or os.cpu_count() or 1, track_count or 1)
+    logger.debug('checksumming %d tracks, %d at once', track_count, workers)
+    # the extension decodes and checksums without holding the GIL
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sums = list(executor.map(
+            _checksum_track, track_paths, range(1, track_count + 1),
+            [track_count] * track_count,
+            [(analyses or {}).get(os.path.realpath(path))
+             for path in track_paths]))
+    for i, (path, (v1_sum, v2_sum)) in enumerate(zip(track_paths, sums)):
         if v1_sum is None:
             logger.error('could not calculate AccurateRip v1 checksum '
                          'for track %d %r', i + 1, path)
@@ -143,19 +167,61 @@ def _download_entry(path):
         logger.error('error retrieving AccurateRip entry: %s', e)
 
 
-def get_db_entry(path):
+def get_db_entry(path, cache=None):
     """
     Download entry from accuraterip.com.
 
     ``path`` is in the format of the output of ``table.accuraterip_path()``.
+
+    :param cache: directory to keep downloaded entries in, and to take them
+                  from instead of downloading them again
+    :type cache: str or None
     """
-    raw_entry = _download_entry(path)
+    raw_entry = None
+    cached = cache and os.path.join(cache, path)
+    if cached and os.path.exists(cached):
+        logger.debug('using kept AccurateRip entry %s', cached)
+        with open(cached, 'rb') as f:
+            raw_entry = f.read()
+    if not raw_entry:
+        raw_entry = _download_entry(path)
+        if raw_entry and cached:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            fd, tmppath = tempfile.mkstemp(prefix='.',
+                                           dir=os.path.dirname(cached))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(raw_entry)
+            os.replace(tmppath, cached)
     if not raw_entry:
         logger.warning('entry not found in AccurateRip database')
         raise EntryNotFound
     return _split_responses(raw_entry)
 
 
+def match_track(responses, number, checksums):
+    """
+    Match the checksums of a single track against all responses.
+
+    :param responses: AccurateRip responses for the disc
+    :type responses: list(_AccurateRipResponse)
+    :param number: the track number, HTOA not included
+    :type number: int
+    :param checksums: ARv1 and ARv2 checksums of the track, in the format
+                      of ``calculate_checksums``: ``{'v1': 'deadbeef', ...}``
+    :type checksums: dict(string, string)
+    :returns: the highest confidence of a response matching either
+              checksum, or 0 if there is no match
+    :rtype: int
+    """
+    confidence = 0
+    for r in responses:
+        if number > r.num_tracks:
+            continue
+        if r.checksums[number - 1] in (checksums['v1'], checksums['v2']):
+            confidence = max(confidence, r.confidences[number - 1])
+    return confidence
+
+
 def _assign_checksums_and_confidences(tracks, checksums, responses):
     for i, track in enumerate(tracks):
         for v in ('v1', 'v2'):
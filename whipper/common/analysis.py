@@ -0,0 +1,180 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_analysis -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# This file is part of whipper.
+#
+# whipper is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whipper is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whipper.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Everything whipper needs to know about audio, from one pass over it."""
+
+import hashlib
+
+from whipper.common import checksum, encode
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Analysis:
+    """
+    The facts about a track of audio.
+
+    :cvar checksum: the CRC32 checksum of the audio
+    :cvar peak: the highest absolute sample value
+    :cvar number: the number of the track on the disc, if known
+    :cvar total: the number of tracks on the disc, if known
+    :cvar v1: the AccurateRip v1 checksum, as hex string, if the position of
+              the track on the disc was known
+    :cvar v2: the AccurateRip v2 checksum, as hex string, likewise
+    :cvar md5: the MD5 sum of the audio as stored in FLAC files, as hex
+               string
+    :cvar length: the length of the audio, in bytes
+    """
+
+    checksum = None
+    peak = None
+    number = None
+    total = None
+    v1 = None
+    v2 = None
+    md5 = None
+    length = 0
+
+
+class Analyzer:
+    """
+    Incrementally analyze raw CD audio.
+
+    Every piece of audio handed to ``update()`` is checksummed, measured and
+    hashed at once, while it is still in the CPU caches, instead of in a
+    separate pass per fact.  Used as a sink for streamed audio, in place of
+    :any:`checksum.CRC32` and :any:`encode.PeakLevel`.
+
+    :ivar frames: the checksum of each frame so far, if asked for
+    :vartype frames: array.array or None
+    """
+
+    frames = None
+
+    def __init__(self, number=None, total=None, frames=False):
+        """
+        Init Analyzer.
+
+        :param number: the number of the track on the disc, 1-based; the
+                       AccurateRip checksums are only calculated if given
+        :type number: int or None
+        :param total: the number of tracks on the disc
+        :type total: int or None
+        :param frames: whether to checksum each frame too
+        :type frames: bool
+        """
+        self._crc = checksum.CRC32()
+        self._peak = encode.PeakLevel()
+        self._md5 = hashlib.md5()
+        self._number = number
+        self._total = total
+        self._ar = None
+        if number:
+            from whipper.program import arc
+            self._ar = arc.accuraterip_sink(number, total)
+        self._frameCRCs = None
+        if frames:
+            self._frameCRCs = checksum.FrameCRC32()
+            self.frames = self._frameCRCs.frames
+        self._length = 0
+
+    def update(self, data):
+        self._crc.update(data)
+        self._peak.update(data)
+        self._md5.update(data)
+        if self._ar:
+            self._ar.update(data)
+        if self._frameCRCs:
+            self._frameCRCs.update(data)
+        self._length += len(data)
+
+    @property
+    def checksum(self):
+        return self._crc.checksum & 0xffffffff
+
+    @property
+    def peak(self):
+        return self._peak.peak
+
+    def result(self):
+        """
+        Return the analysis of the audio so far.
+
+        :rtype: Analysis
+        """
+        analysis = Analysis()
+        analysis.checksum = self.checksum
+        analysis.peak = self.peak
+        analysis.md5 = self._md5.hexdigest()
+        analysis.length = self._length
+        if self._ar:
+            analysis.number = self._number
+            analysis.total = self._total
+            analysis.v1, analysis.v2 = ('%08x' % c for c in self._ar.digest())
+        return analysis
+
+
+class AnalyzeTask(checksum.AudioFileTask):
+    """
+    Analyze a WAV or FLAC file in one pass.
+
+    :ivar analysis: the facts about the audio
+    :vartype analysis: Analysis
+    :ivar checksum: the CRC32 checksum of the audio
+    :ivar peak: the peak level of the audio
+    :ivar frames: the checksum of each frame, if asked for
+    :vartype frames: array.array or None
+    """
+
+    description = 'Analyzing audio'
+    analysis = None
+    checksum = None
+    peak = None
+
+    def __init__(self, path, number=None, total=None, is_wave=True,
+                 frames=False):
+        """
+        Init AnalyzeTask.
+
+        :param path: the file to analyze
+        :type path: str
+        :param number: the number of the track on the disc, 1-based; the
+                       AccurateRip checksums are only calculated if given
+        :type number: int or None
+        :param total: the number of tracks on the disc
+        :type total: int or None
+        :param is_wave: whether the file is a WAV file instead of FLAC
+        :type is_wave: bool
+        :param frames: whether to checksum each frame too
+        :type frames: bool
+        """
+        checksum.AudioFileTask.__init__(self, path, is_wave)
+        self._analyzer = Analyzer(number, total, frames)
+        self.frames = self._analyzer.frames
+
+    def _update(self, data):
+        self._analyzer.update(data)
+
+    def _done(self):
+        self.analysis = self._analyzer.result()
+        self.checksum = self.analysis.checksum
+        self.peak = self.analysis.peak
+        logger.debug('analyzed %r: crc %08x, peak %d, md5 %s',
+                     self.path, self.checksum, self.peak, self.analysis.md5)
+        self.stop()
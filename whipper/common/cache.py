@@ -0,0 +1,261 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_cache -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# This file is part of whipper.
+#
+# whipper is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whipper is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whipper.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Results of slow disc reads and program probes, kept across runs."""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+
+from whipper.common import directory
+from whipper.image import table
+
+import logging
+logger = logging.getLogger(__name__)
+
+# how many bytes of tables to keep by default
+DEFAULT_SIZE = 8 << 20
+
+
+class TocCache:
+    """
+    Remember the full table of contents of discs.
+
+    Reading the full table of contents scans the whole disc for pre-gaps
+    and ISRCs, which can take minutes.  Tables are kept by the ids of the
+    fast table of contents of their disc and the drive they were read
+    with, together with the ``.toc`` file cdrdao wrote for them.  The least
+    recently used tables are dropped once they take more than the given
+    size.
+    """
+
+    def __init__(self, path=None, size=DEFAULT_SIZE):
+        """
+        Init TocCache.
+
+        :param path: the directory to keep tables in
+        :type path: str or None
+        :param size: how many bytes of tables to keep at most
+        :type size: int
+        """
+        self.path = path or directory.cache_path('toc')
+        self.size = size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(ittoc, info=None, engine='cdrdao'):
+        """
+        Return the key of a disc in a drive.
+
+        :param ittoc: the fast table of contents of the disc
+        :type ittoc: table.Table
+        :param info: the vendor, model and release of the drive
+        :type info: tuple(str, str, str) or None
+        :param engine: what reads the full table of contents
+        :type engine: str
+        :rtype: str
+        """
+        last = ittoc.tracks[-1].number
+        ids = (ittoc.getMusicBrainzDiscId(), ittoc.getCDDBDiscId(),
+               ittoc.getTrackEnd(last) + 1) + tuple(info or ())
+        if engine != 'cdrdao':
+            ids += (engine, )
+        return hashlib.sha1(repr(ids).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.path, key + '.pickle')
+
+    def get(self, key):
+        """
+        Return the table kept for a key.
+
+        :param key: a key returned by :any:`key`
+        :type key: str
+        :returns: the contents of the ``.toc`` file, if cdrdao wrote one,
+                  and the table; or None
+        :rtype: tuple(bytes or None, table.Table) or None
+        """
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, 'rb') as f:
+                    toc, itable = pickle.load(f)
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                logger.debug('dropping unreadable table %r: %r', path, e)
+                os.unlink(path)
+                return None
+            if getattr(itable, 'instanceVersion', None) != \
+                    table.Table.classVersion:
+                logger.debug('dropping outdated table %r', path)
+                os.unlink(path)
+                return None
+            # mark as recently used
+            os.utime(path)
+        itable.unpickled()
+        logger.debug('found table %r for key %s', itable, key)
+        return toc, itable
+
+    def put(self, key, toc, itable):
+        """
+        Keep a table.
+
+        :param key: a key returned by :any:`key`
+        :type key: str
+        :param toc: the contents of the ``.toc`` file of the table, if
+                    cdrdao wrote one
+        :type toc: bytes or None
+        :param itable: the full table of contents
+        :type itable: table.Table
+        """
+        with self._lock:
+            fd, tmppath = tempfile.mkstemp(prefix='.', dir=self.path)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((toc, itable), f)
+            os.replace(tmppath, self._path(key))
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.pickle'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                # dropped by another whipper
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        entries.sort(reverse=True)
+        used = 0
+        for _, size, name in entries:
+            used += size
+            if used > self.size:
+                logger.debug('dropping least recently used table %r', name)
+                try:
+                    os.unlink(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+
+class ProbeCache:
+    """
+    Remember what external programs told about themselves.
+
+    Versions and features of programs are learnt by running them, which
+    every command did again.  What a program answered is kept until the
+    binary found for it changes, by path, inode, size or modification time.
+    Failed probes, answering None, are not remembered.
+    """
+
+    def __init__(self, path=None):
+        """
+        Init ProbeCache.
+
+        :param path: the file to keep the answers in
+        :type path: str or None
+        """
+        self.path = path or os.path.join(directory.cache_path(),
+                                         'probes.json')
+        self._lock = threading.Lock()
+        self._programs = None  # program: {'binary': ..., 'facts': {}}
+
+    @staticmethod
+    def _binary(program):
+        found = shutil.which(program)
+        if not found:
+            return None
+        path = os.path.realpath(found)
+        st = os.stat(path)
+        return [path, st.st_ino, st.st_size, st.st_mtime_ns]
+
+    def _load(self):
+        if self._programs is None:
+            try:
+                with open(self.path) as f:
+                    self._programs = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug('cannot read probes %r: %r', self.path, e)
+                self._programs = {}
+        return self._programs
+
+    def _save(self):
+        fd, tmppath = tempfile.mkstemp(prefix='.',
+                                       dir=os.path.dirname(self.path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._programs, f, indent=1, sort_keys=True)
+        os.replace(tmppath, self.path)
+
+    def get(self, program, fact, probe):
+        """
+        Return what ``probe()`` answers about the installed program.
+
+        :param program: the name of the program, as it is run
+        :type program: str
+        :param fact: what the probe finds out, like ``'version'``
+        :type fact: str
+        :param probe: runs the program to find it out
+        :type probe: callable
+        """
+        binary = self._binary(program)
+        if not binary:
+            # let the probe complain about the missing program
+            return probe()
+        with self._lock:
+            programs = self._load()
+            entry = programs.get(program)
+            if not entry or entry['binary'] != binary:
+                entry = programs[program] = {'binary': binary, 'facts': {}}
+            if fact in entry['facts']:
+                return entry['facts'][fact]
+            logger.debug('probing %s of %s', fact, program)
+            answer = probe()
+            if answer is not None:
+                entry['facts'][fact] = answer
+                try:
+                    self._save()
+                except OSError as e:
+                    logger.debug('cannot save probes %r: %r', self.path, e)
+            return answer
+
+
+_probes = None
+
+
+def probeOnce(program, fact, probe):
+    """
+    Return what ``probe()`` answers about a program, probing it only once.
+
+    Uses a :any:`ProbeCache` shared by all commands.
+
+    :param program: the name of the program, as it is run
+    :type program: str
+    :param fact: what the probe finds out, like ``'version'``
+    :type fact: str
+    :param probe: runs the program to find it out
+    :type probe: callable
+    """
+    global _probes
+    if _probes is None:
+        _probes = ProbeCache()
+    return _probes.get(program, fact, probe)
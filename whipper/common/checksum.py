@@ -19,46 +19,247 @@
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
 import binascii
+import hashlib
+import mmap
 import wave
-import tempfile
-import subprocess
-import os
-
+from array import array
+from subprocess import CalledProcessError
 
+from whipper.common import common
+from whipper.common import task as ctask
 from whipper.extern.task import task as etask
+from whipper.program import flac, soxi
 
 import logging
 logger = logging.getLogger(__name__)
 
+# how much audio is checksummed at once: the same for every track, however
+# long it is
+_CHUNK = 1024 * common.BYTES_PER_FRAME
+
 # checksums are not CRC's. a CRC is a specific type of checksum.
 
 
-class CRC32Task(etask.Task):
-    # TODO: Support sampleStart, sampleLength later on (should be trivial, just
-    # add change the read part in _crc32 to skip some samples and/or not
-    # read too far)
-    def __init__(self, path, sampleStart=0, sampleLength=-1, is_wave=True):
+class CRC32:
+    """
+    Incrementally calculate the CRC32 checksum of audio data.
+
+    Used as a sink for streamed audio, see
+    :any:`whipper.program.cdparanoia.ReadTrackTask`.
+
+    :ivar checksum: the CRC32 checksum of the data seen so far
+    :vartype checksum: int
+    """
+
+    def __init__(self):
+        self.checksum = 0
+
+    def update(self, data):
+        self.checksum = binascii.crc32(data, self.checksum)
+
+
+class FrameCRC32:
+    """
+    Incrementally calculate the CRC32 checksum of each frame of audio data.
+
+    :ivar frames: the CRC32 checksum of each complete frame seen so far
+    :vartype frames: array.array
+    """
+
+    def __init__(self):
+        self.frames = array('L')
+        self._remainder = b''
+
+    def update(self, data):
+        if self._remainder:
+            data = self._remainder + data
+        end = len(data) - len(data) % common.BYTES_PER_FRAME
+        view = memoryview(data)
+        for i in range(0, end, common.BYTES_PER_FRAME):
+            self.frames.append(binascii.crc32(
+                view[i:i + common.BYTES_PER_FRAME]))
+        # copied, data may be a view of a buffer that goes away
+        self._remainder = bytes(data[end:])
+
+
+class ChecksumMismatch(Exception):
+    """Audio data does not match the checksums it was compared against."""
+
+
+class FrameVerifier(FrameCRC32):
+    """
+    Compare audio data frame by frame against known frame checksums.
+
+    Used as a sink for a copy read, so that it can be stopped as soon as
+    too many of its frames differ from the test read.
+
+    :ivar mismatches: the number of frames that differed so far
+    :vartype mismatches: int
+    """
+
+    def __init__(self, expected, limit=0):
+        """
+        Init FrameVerifier.
+
+        :param expected: an object whose ``frames`` attribute holds the
+                         expected checksum of each frame once it is
+                         known, such as :any:`FrameCRC32` or
+                         :any:`CRC32Task`
+        :param limit: number of differing frames that is tolerated
+        :type limit: int
+        """
+        FrameCRC32.__init__(self)
+        self.mismatches = 0
+        self._expected = expected
+        self._limit = limit
+
+    def update(self, data):
+        checked = len(self.frames)
+        FrameCRC32.update(self, data)
+        expected = self._expected.frames
+        for i in range(checked, len(self.frames)):
+            if i >= len(expected) or self.frames[i] != expected[i]:
+                self.mismatches += 1
+        if self.mismatches > self._limit:
+            raise ChecksumMismatch('%d frames differ' % self.mismatches)
+
+
+def getAudioMD5(path):
+    """
+    Return the MD5 sum of the audio of a WAV or FLAC file, as FLAC stores it.
+
+    The sum of a FLAC file is read from its header; the one of a 16-bit WAV
+    file is calculated from its samples.
+
+    :param path: path to a WAV or FLAC file
+    :type path: str
+    :returns: the MD5 sum as hex string; None if it is not known
+    :rtype: str or None
+    """
+    md5 = soxi.getFlacMD5(path)
+    if md5:
+        return md5
+    try:
+        with wave.open(path) as w:
+            if w.getsampwidth() != 2:
+                return None
+            h = hashlib.md5()
+            frames = _CHUNK // (w.getnchannels() * w.getsampwidth())
+            while True:
+                data = w.readframes(frames)
+                if not data:
+                    break
+                h.update(data)
+            return h.hexdigest()
+    except (wave.Error, EOFError) as e:
+        logger.debug('cannot read audio of %r: %r', path, e)
+        return None
+
+
+class AudioFileTask(etask.Task):
+    """
+    Hand the audio of a WAV or FLAC file to ``_update()`` a chunk at a time.
+
+    Memory use does not depend on the length of the track: WAV files are
+    mapped into memory and FLAC files are decoded through a pipe from
+    ``flac``.  Once all audio is handed over, ``_done()`` is called; it
+    has to stop the task.
+    """
+
+    def __init__(self, path, is_wave=True):
         self.path = path
         self.is_wave = is_wave
 
     def start(self, runner):
         etask.Task.start(self, runner)
-        self.schedule(0.0, self._crc32)
+        if self.is_wave:
+            self.schedule(0.0, self._map)
+        else:
+            ctask.Process(self, flac.decode_command(self.path),
+                          stdout=self._update, exited=self._decoded,
+                          bufsize=_CHUNK)
+
+    def _update(self, data):
+        raise NotImplementedError
+
+    def _done(self):
+        raise NotImplementedError
 
-    def _crc32(self):
-        if not self.is_wave:
-            _, tmpf = tempfile.mkstemp()
+    def _map(self):
+        with open(self.path, 'rb') as f:
+            w = wave.open(f)
+            # the file is left at the start of the audio data
+            start = f.tell()
+            length = w.getnframes() * w.getnchannels() * w.getsampwidth()
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self._position = start
+        self._end = min(start + length, len(self._mmap))
+        self._next()
 
-            try:
-                subprocess.check_call(['flac', '-d', self.path, '-fo', tmpf])
+    def _next(self):
+        try:
+            end = min(self._position + _CHUNK, self._end)
+            self._update(self._view[self._position:end])
+            self._position = end
+        except Exception:
+            self._unmap()
+            raise
 
-                w = wave.open(tmpf)
-            finally:
-                os.remove(tmpf)
+        if end < self._end:
+            self.setProgress(float(end) / self._end)
+            self.schedule(0.0, self._next)
         else:
-            w = wave.open(self.path)
+            self._unmap()
+            self._done()
+
+    def _unmap(self):
+        self._view.release()
+        self._mmap.close()
+
+    def _decoded(self, returncode):
+        if returncode:
+            self.setException(
+                CalledProcessError(returncode, flac.decode_command(
+                    self.path)))
+        self._done()
+
+
+class CRC32Task(AudioFileTask):
+    """
+    Calculate the CRC32 checksum of a WAV or FLAC file.
+
+    :ivar checksum: the checksum of the audio
+    :vartype checksum: int
+    :ivar frames: the checksum of each frame, if asked for
+    :vartype frames: array.array or None
+    """
+
+    description = 'Calculating CRC'
+    checksum = None
+    frames = None
+
+    # TODO: Support sampleStart, sampleLength later on (should be trivial, just
+    # start and end the chunks somewhere else)
+    def __init__(self, path, sampleStart=0, sampleLength=-1, is_wave=True,
+                 frames=False):
+        AudioFileTask.__init__(self, path, is_wave)
+        self._frames = frames
+
+    def start(self, runner):
+        self._crc = CRC32()
+        self._frameCRCs = None
+        if self._frames:
+            self._frameCRCs = FrameCRC32()
+        AudioFileTask.start(self, runner)
 
-        d = w._data_chunk.read()
+    def _update(self, data):
+        self._crc.update(data)
+        if self._frameCRCs:
+            self._frameCRCs.update(data)
 
-        self.checksum = binascii.crc32(d) & 0xffffffff
+    def _done(self):
+        self.checksum = self._crc.checksum & 0xffffffff
+        if self._frameCRCs:
+            self.frames = self._frameCRCs.frames
         self.stop()
@@ -37,3 +37,12 @@ def data_path(name=None):
         path = join(path, name)
     makedirs(path, exist_ok=True)
     return path
+
+
+def cache_path(name=None):
+    path = join(getenv('XDG_CACHE_HOME') or join(expanduser('~'), '.cache'),
+                'whipper')
+    if name:
+        path = join(path, name)
+    makedirs(path, exist_ok=True)
+    return path
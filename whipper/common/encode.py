@@ -18,6 +18,12 @@
 # You should have received a copy of the GNU General Public License
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import sys
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import CalledProcessError
 
 from mutagen.flac import FLAC, Picture
 from mutagen.id3 import PictureType
@@ -30,6 +36,11 @@ from whipper.program import flac
 import logging
 logger = logging.getLogger(__name__)
 
+# encodes of ripped files running at once, shared by all drives ripping in
+# this process; streaming encodes are not counted, they are held back by
+# the drive they read from anyway
+_ENCODERS = threading.BoundedSemaphore(os.cpu_count() or 1)
+
 
 class SoxPeakTask(task.Task):
     description = 'Calculating peak level'
@@ -47,21 +58,188 @@ class SoxPeakTask(task.Task):
         self.stop()
 
 
+class PeakLevel:
+    """
+    Incrementally calculate the peak level of audio data.
+
+    Used as a sink for streamed audio, as an in-process replacement for
+    :any:`SoxPeakTask`.
+
+    :ivar peak: the highest absolute sample value seen so far
+    :vartype peak: int
+    """
+
+    def __init__(self):
+        self.peak = 0
+        self._remainder = b''
+
+    def update(self, data):
+        if self._remainder:
+            data = self._remainder + data
+        # samples are 2 bytes; keep an odd trailing byte for the next call
+        end = len(data) & ~1
+        # copied, data may be a view of a buffer that goes away
+        self._remainder = bytes(data[end:])
+        if not end:
+            return
+
+        samples = array('h')
+        samples.frombytes(data[:end])
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        self.peak = max(self.peak, max(samples), -min(samples))
+
+
 class FlacEncodeTask(task.Task):
+    """
+    Encode a track to FLAC.
+
+    If no track path is given, the audio is streamed to the encoder through
+    ``update()`` while it is being read, and starting the task waits for the
+    encoder to finish.
+    """
+
     description = 'Encoding to FLAC'
 
-    def __init__(self, track_path, track_out_path, what="track"):
+    def __init__(self, track_path, track_out_path, what="track", nice=0,
+                 cpus=None):
+        """
+        Init FlacEncodeTask.
+
+        :param nice: how much to lower the priority of the encoder
+        :type nice: int
+        :param cpus: the cores to run the encoder on, or None for any
+        :type cpus: set(int) or None
+        """
         self.track_path = track_path
         self.track_out_path = track_out_path
         self.new_path = None
         self.description = 'Encoding %s to FLAC' % what
+        self._nice = nice
+        self._cpus = cpus
+        self._popen = None
 
     def start(self, runner):
         task.Task.start(self, runner)
-        self.schedule(0.0, self._flac_encode)
+        if self.track_path is None:
+            self.schedule(0.0, self._flac_finish)
+        else:
+            self.schedule(0.0, self._flac_encode)
+
+    def update(self, data):
+        if not self._popen:
+            logger.debug('starting streaming encode to %r',
+                         self.track_out_path)
+            self._popen = flac.encoder(self.track_out_path)
+        self._popen.stdin.write(data)
+
+    def close(self):
+        """Tell a streaming encode that all audio has been written."""
+        if self._popen:
+            self._popen.stdin.close()
+
+    def abort(self):
+        """Stop a streaming encode and remove its partial output."""
+        if not self._popen:
+            return
+        self._popen.kill()
+        self._popen.stdin.close()
+        self._popen.wait()
+        self._popen = None
+        if os.path.exists(self.track_out_path):
+            os.unlink(self.track_out_path)
 
     def _flac_encode(self):
-        flac.encode(self.track_path, self.track_out_path)
+        with _ENCODERS:
+            flac.encode(self.track_path, self.track_out_path,
+                        nice=self._nice, cpus=self._cpus)
+        self.stop()
+
+    def _flac_finish(self):
+        if self._popen:
+            self._popen.stdin.close()
+            if self._popen.wait():
+                self.setExceptionAndTraceback(CalledProcessError(
+                    self._popen.returncode, self._popen.args))
+        self.stop()
+
+
+class EncodePool:
+    """
+    Finish ripped tracks in the background.
+
+    Encoding, checksumming and tagging a track can be handed to a worker,
+    so the drive can read the next track in the meantime.  Encoding is done
+    by flac processes, which run in parallel on the workers and can be run
+    at a lower priority or on some cores only, so they do not slow down
+    reading.
+
+    The analysis of a track (see :any:`analysis.AnalyzeTask`) runs in the
+    worker thread itself.  Its CRC32, MD5 and AccurateRip checksums release
+    the GIL, but the peak level is found by Python code that holds it, so
+    that part of the analysis of several tracks takes turns instead of
+    running at once; more workers than cores do not speed it up.
+
+    Only a bounded number of tracks wait for a worker: each one keeps a
+    temporary WAV file around, so ``submit()`` blocks once too many are
+    waiting until a worker catches up.
+
+    :ivar nice: how much to lower the priority of the encoders
+    :ivar cpus: the cores to run the encoders on, or None for any
+    """
+
+    def __init__(self, workers=1, nice=0, cpus=None, waiting=2):
+        """
+        Init EncodePool.
+
+        :param workers: how many tracks to finish at once
+        :type workers: int
+        :param nice: how much to lower the priority of the encoders
+        :type nice: int
+        :param cpus: the cores to run the encoders on, or None for any
+        :type cpus: set(int) or None
+        :param waiting: how many tracks may wait for a worker
+        :type waiting: int
+        """
+        self.nice = nice
+        self.cpus = cpus
+        self._slots = threading.BoundedSemaphore(workers + waiting)
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='encode')
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run ``fn(*args, **kwargs)`` on a worker.
+
+        :rtype: concurrent.futures.Future
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        """Wait for all tracks to be finished and stop the workers."""
+        self._executor.shutdown()
+
+
+class FlacDecodeTask(task.Task):
+    description = 'Decoding FLAC'
+
+    def __init__(self, track_path, track_out_path):
+        self.track_path = track_path
+        self.track_out_path = track_out_path
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self.schedule(0.0, self._flac_decode)
+
+    def _flac_decode(self):
+        flac.decode(self.track_path, self.track_out_path)
         self.stop()
 
 
@@ -20,15 +20,18 @@
 
 """Common functionality and class for all programs using whipper."""
 
+import copy
 import musicbrainzngs
 import re
 import os
 import shutil
+import threading
 import time
 
+from concurrent.futures import Future
 from tempfile import NamedTemporaryFile
 from whipper.common import accurip, checksum, common, mbngs, path
-from whipper.program import cdrdao, cdparanoia
+from whipper.program import cdrdao, cdparanoia, libcdio
 from whipper.result import result
 from whipper.image import image
 from whipper.extern import freedb
@@ -38,6 +41,87 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class LookupCache:
+    """
+    Remember the results of network lookups.
+
+    Programs ripping in parallel from one process share one cache, so a
+    disc in several drives is looked up once.  Lookups of one web service
+    are made one at a time, which also keeps concurrent rips within its
+    rate limits.  Failed lookups are not remembered.
+
+    Lookups can be started in the background with :any:`prefetch`, long
+    before their result is needed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}  # key: Future
+        self._services = {}  # first item of key: lock
+
+    def _lookup(self, future, key, lookup, args, kwargs):
+        with self._lock:
+            service = self._services.setdefault(key[0], threading.Lock())
+        with service:
+            try:
+                future.set_result(lookup(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _future(self, key):
+        # return the future for key, and whether it has to be looked up
+        with self._lock:
+            if key in self._results:
+                return self._results[key], False
+            future = self._results[key] = Future()
+            return future, True
+
+    def prefetch(self, key, lookup, *args, **kwargs):
+        """
+        Start ``lookup(*args, **kwargs)`` in the background.
+
+        Its result is returned by :any:`get` for the same key.
+
+        :param key: identifies the lookup and its arguments; the first
+                    item names the web service
+        :type key: tuple
+        :param lookup: function doing the lookup
+        :type lookup: callable
+        """
+        future, new = self._future(key)
+        if new:
+            logger.debug('prefetching %r', key)
+            threading.Thread(target=self._lookup,
+                             args=(future, key, lookup, args, kwargs),
+                             name='prefetch %s' % key[0],
+                             daemon=True).start()
+
+    def get(self, key, lookup, *args, **kwargs):
+        """
+        Return the result of ``lookup(*args, **kwargs)``.
+
+        Waits for the lookup if it was prefetched.
+
+        :param key: identifies the lookup and its arguments; the first
+                    item names the web service
+        :type key: tuple
+        :param lookup: function doing the lookup
+        :type lookup: callable
+        """
+        future, new = self._future(key)
+        if new:
+            self._lookup(future, key, lookup, args, kwargs)
+        try:
+            result = future.result()
+        except Exception:
+            with self._lock:
+                if self._results.get(key) is future:
+                    del self._results[key]
+            raise
+        # every rip gets its own copy to change
+        return copy.deepcopy(result)
+
+
 # FIXME: should Program have a runner ?
 
 
@@ -54,19 +138,25 @@ class Program:
 
     cuePath = None
     logPath = None
+    accurateRipCache = None  # directory to keep AccurateRip entries in
     metadata = None
     outdir = None
     result = None
     skipped_tracks = None
 
-    def __init__(self, config, record=False):
+    def __init__(self, config, record=False, cache=None):
         """
         Init Program.
 
         :param record: whether to record results of API calls for playback
+        :param cache: cache to share lookups with other programs
+        :type cache: LookupCache or None
         """
         self._record = record
         self._config = config
+        self._cache = cache or LookupCache()
+        self._finishing = []  # (TrackResult, task) finished by encoders
+        self._analyses = {}  # real path: analysis.Analysis of ripped tracks
 
         d = {}
 
@@ -113,19 +203,41 @@ class Program:
         return toc
 
     def getTable(self, runner, cddbdiscid, mbdiscid, device, offset,
-                 toc_path):
+                 toc_path, tocCache=None, tocKey=None, ittoc=None):
         """
         Retrieve the Table from the drive.
 
+        :param tocCache: tables read before, to skip reading the disc
+        :type tocCache: whipper.common.cache.TocCache or None
+        :param tocKey: the key of the disc in ``tocCache``
+        :type tocKey: str or None
+        :param ittoc: the fast table of contents; if given, the indexes are
+                      read through libcdio from it instead of by cdrdao
+        :type ittoc: table.Table or None
         :rtype: table.Table
         """
         itable = None
         tdict = {}
 
-        t = cdrdao.ReadTOCTask(device, toc_path=toc_path)
-        t.description = "Reading table"
-        runner.run(t)
-        itable = t.toc.table
+        cached = tocCache.get(tocKey) if tocCache else None
+        if cached:
+            contents, itable = cached
+            logger.info('using cached table of contents')
+            if toc_path is not None and contents:
+                cdrdao.saveToc(contents, toc_path)
+        elif ittoc:
+            t = libcdio.ReadIndexesTask(device, ittoc)
+            runner.run(t)
+            itable = t.table
+            if tocCache:
+                tocCache.put(tocKey, None, itable)
+        else:
+            t = cdrdao.ReadTOCTask(device, toc_path=toc_path)
+            t.description = "Reading table"
+            runner.run(t)
+            itable = t.toc.table
+            if tocCache:
+                tocCache.put(tocKey, t.contents, itable)
         tdict[offset] = itable
         logger.debug('getTable: read table %r', itable)
 
@@ -278,6 +390,40 @@ class Program:
 
         return None
 
+    def prefetch(self, ittoc, country=None, accuraterip=True):
+        """
+        Start looking up the disc on the web services in the background.
+
+        The lookups only need the fast table of contents, so they can run
+        while the drive is still busy reading the full one.
+
+        :param ittoc: disc TOC
+        :type ittoc: whipper.image.table.Table
+        :param country: country name used to filter releases by provenance
+        :type country: str or None
+        :param accuraterip: whether to look the disc up on AccurateRip too
+        :type accuraterip: bool
+        """
+        mbdiscid = ittoc.getMusicBrainzDiscId()
+        self._cache.prefetch(('musicbrainz', mbdiscid, country),
+                             mbngs.musicbrainz, mbdiscid, country=country,
+                             record=self._record)
+        if accuraterip:
+            path = ittoc.accuraterip_path()
+            self._cache.prefetch(('accuraterip', path),
+                                 accurip.get_db_entry, path,
+                                 self.accurateRipCache)
+
+    def prefetchCoverArt(self, release_id):
+        """
+        Start downloading the cover art of a release in the background.
+
+        :param release_id: a release id (self.program.metadata.mbid)
+        :type  release_id: str
+        """
+        self._cache.prefetch(('coverart', release_id),
+                             musicbrainzngs.get_image_front, release_id, 500)
+
     def getMusicBrainz(self, ittoc, mbdiscid, release=None, country=None,
                        prompt=False):
         """
@@ -307,9 +453,9 @@ class Program:
 
         for _ in range(0, 4):
             try:
-                metadatas = mbngs.musicbrainz(mbdiscid,
-                                              country=country,
-                                              record=self._record)
+                metadatas = self._cache.get(
+                    ('musicbrainz', mbdiscid, country), mbngs.musicbrainz,
+                    mbdiscid, country=country, record=self._record)
                 break
             except mbngs.NotFoundException as e:
                 logger.warning("release not found: %r", (e, ))
@@ -508,8 +654,41 @@ class Program:
         stop = track.getIndex(1).absolute - 1
         return start, stop
 
-    @staticmethod
-    def getCoverArt(path, release_id):
+    def getTrackRange(self, number):
+        """
+        Return the frames to rip for the given track.
+
+        :param number: the track number (0 for HTOA)
+        :type number: int
+        :returns: tuple of (start, stop), stop being inclusive
+        :rtype: tuple(int, int)
+        """
+        if number == 0:
+            return self.getHTOA()
+
+        return (self.result.table.getTrackStart(number),
+                self.result.table.getTrackEnd(number))
+
+    def getAccurateRipPosition(self, number):
+        """
+        Return the position of a track on the disc as AccurateRip counts.
+
+        AccurateRip only counts audio tracks, the same way
+        :any:`accurip.calculate_checksums` does, so data tracks of
+        enhanced CDs are left out of both the position and the total.
+
+        :param number: the track number (0 for HTOA)
+        :type number: int
+        :returns: the 1-based position of the track among the audio
+                  tracks, or None for HTOA, and the number of audio tracks
+        :rtype: tuple(int or None, int)
+        """
+        audio = [t.number for t in self.result.table.tracks if t.audio]
+        if number not in audio:
+            return None, len(audio)
+        return audio.index(number) + 1, len(audio)
+
+    def getCoverArt(self, path, release_id):
         """
         Get cover art image from Cover Art Archive.
 
@@ -524,7 +703,9 @@ class Program:
 
         logger.debug('fetching cover art for release: %r', release_id)
         try:
-            data = musicbrainzngs.get_image_front(release_id, 500)
+            data = self._cache.get(('coverart', release_id),
+                                   musicbrainzngs.get_image_front,
+                                   release_id, 500)
         except musicbrainzngs.ResponseError as e:
             logger.error('error fetching cover art: %r', e)
             return
@@ -552,13 +733,18 @@ class Program:
             else:
                 raise
 
-        ret = trackResult.testcrc == t.checksum
+        # tracks accepted by AccurateRip only have a copy checksum
+        crc = trackResult.testcrc
+        if crc is None:
+            crc = trackResult.copycrc
+        ret = crc == t.checksum
         logger.debug('verifyTrack: track result crc %r, file crc %r, '
-                     'result %r', trackResult.testcrc, t.checksum, ret)
+                     'result %r', crc, t.checksum, ret)
         return ret
 
     def ripTrack(self, runner, trackResult, offset, device, taglist,
-                 overread, what=None, coverArtPath=None):
+                 overread, what=None, coverArtPath=None, stream=False,
+                 engine='cdparanoia', encoder=None, scratch=None):
         """
         Rip and store a track of the disc.
 
@@ -582,18 +768,26 @@ class Program:
         :type what: str or None
         :param coverArtPath: path to the downloaded cover art file
         :type coverArtPath: str or None
+        :param stream: whether to stream the audio through checksumming
+                       and encoding while reading it
+        :type stream: bool
+        :param engine: what to read the audio with; cdparanoia or libcdio
+        :type engine: str
+        :param encoder: where to finish the track while the next one is
+                        read; the track and its peak level are only there
+                        after :any:`waitForTracks`
+        :type encoder: whipper.common.encode.EncodePool or None
+        :param scratch: where to keep the WAV files of the track
+        :type scratch: whipper.common.scratch.Scratch or None
         """
-        if trackResult.number == 0:
-            start, stop = self.getHTOA()
-        else:
-            start = self.result.table.getTrackStart(trackResult.number)
-            stop = self.result.table.getTrackEnd(trackResult.number)
+        start, stop = self.getTrackRange(trackResult.number)
 
         dirname = os.path.dirname(trackResult.filename)
         os.makedirs(dirname, exist_ok=True)
 
         if not what:
             what = 'track %d' % (trackResult.number, )
+        number, total = self.getAccurateRipPosition(trackResult.number)
 
         t = cdparanoia.ReadVerifyTrackTask(trackResult.filename,
                                            self.result.table, start,
@@ -602,7 +796,13 @@ class Program:
                                            device=device,
                                            taglist=taglist,
                                            what=what,
-                                           coverArtPath=coverArtPath)
+                                           coverArtPath=coverArtPath,
+                                           stream=stream,
+                                           engine=engine,
+                                           encoder=encoder,
+                                           scratch=scratch,
+                                           number=number,
+                                           total=total)
 
         runner.run(t)
 
@@ -615,6 +815,7 @@ class Program:
         trackResult.copycrc = t.copychecksum
         trackResult.peak = t.peak
         trackResult.quality = t.quality
+        trackResult.rereads = t.rereads
         trackResult.testspeed = t.testspeed
         trackResult.copyspeed = t.copyspeed
         # we want rerips to add cumulatively to the time
@@ -625,7 +826,201 @@ class Program:
             trackResult.filename = t.path
             logger.info('filename changed to %r', trackResult.filename)
 
-    def verifyImage(self, runner, table):
+        if t.finished:
+            self._finishing.append((trackResult, t))
+        else:
+            self._addAnalysis(t)
+
+    def _addAnalysis(self, t):
+        if t.analysis:
+            self._analyses[os.path.realpath(t.path)] = t.analysis
+
+    def waitForTracks(self):
+        """
+        Wait for the tracks ripped with an encoder to be finished.
+
+        :returns: the tracks that could not be finished; they have to be
+                  ripped again
+        :rtype: list(result.TrackResult)
+        """
+        failed = []
+        for trackResult, t in self._finishing:
+            try:
+                t.finished.result()
+            # FIXME: catching too general exception (Exception)
+            except Exception as e:
+                logger.warning('could not finish track %d: %r',
+                               trackResult.number, e)
+                failed.append(trackResult)
+                continue
+            trackResult.peak = t.peak
+            self._addAnalysis(t)
+            logger.info('finished track %d, peak level %.6f',
+                        trackResult.number, trackResult.peak / 32768.0)
+        self._finishing = []
+        return failed
+
+    def fastRipTrack(self, runner, trackResult, offset, device, taglist,
+                     overread, responses, confidence=2, what=None,
+                     coverArtPath=None, engine='cdparanoia'):
+        """
+        Rip a track in a single pass and keep it if AccurateRip matches.
+
+        See :any:`cdparanoia.FastReadTrackTask`.  The track is only stored,
+        and trackResult only updated, if it was accurately ripped.
+
+        :param runner: synchronous track rip task
+        :type runner: task.SyncRunner
+        :param trackResult: the object to store information in
+        :type trackResult: result.TrackResult
+        :param offset: ripping offset, in CD frames
+        :type offset: int
+        :param device: path to the hardware disc drive
+        :type device: str
+        :param taglist: dictionary of tags for the given track
+        :type taglist: dict
+        :param overread: whether to force overreading into the
+                         lead-out portion of the disc
+        :type overread: bool
+        :param responses: AccurateRip responses for the disc
+        :type responses: list(accurip._AccurateRipResponse)
+        :param confidence: lowest confidence for a match to be accepted
+        :type confidence: int
+        :param what: a string representing what's being read; e.g. Track
+        :type what: str or None
+        :param coverArtPath: path to the downloaded cover art file
+        :type coverArtPath: str or None
+        :param engine: what to read the audio with; cdparanoia or libcdio
+        :type engine: str
+        :returns: whether the track was accurately ripped
+        :rtype: bool
+        """
+        start, stop = self.getTrackRange(trackResult.number)
+        os.makedirs(os.path.dirname(trackResult.filename), exist_ok=True)
+
+        if not what:
+            what = 'track %d' % (trackResult.number, )
+
+        number, total = self.getAccurateRipPosition(trackResult.number)
+        t = cdparanoia.FastReadTrackTask(trackResult.filename,
+                                         self.result.table, start, stop,
+                                         overread, number, total,
+                                         responses, confidence=confidence,
+                                         offset=offset, device=device,
+                                         taglist=taglist, what=what,
+                                         coverArtPath=coverArtPath,
+                                         engine=engine)
+
+        runner.run(t)
+
+        logger.debug('fast read track %d: accurate %r, confidence %d',
+                     trackResult.number, t.accurate, t.confidence)
+        if not t.accurate:
+            return False
+
+        # there is no test pass; AccurateRip vouches for the copy
+        trackResult.testcrc = None
+        trackResult.copycrc = t.checksum
+        trackResult.peak = t.peak
+        trackResult.quality = None
+        trackResult.copyspeed = t.speed
+        trackResult.copyduration += t.duration
+        self._addAnalysis(t)
+
+        if trackResult.filename != t.path:
+            trackResult.filename = t.path
+            logger.info('filename changed to %r', trackResult.filename)
+        return True
+
+    def ripTracks(self, runner, trackResults, offset, device, taglists,
+                  overread, coverArtPath=None, engine='cdparanoia'):
+        """
+        Rip and store consecutive tracks of the disc in one go.
+
+        The tracks are read in one test pass and one copy pass over all of
+        them, see :any:`cdparanoia.ReadVerifyDiscTask`.
+
+        Ripping the tracks may change their filenames as stored in
+        trackResults.
+
+        :param runner: synchronous track rip task
+        :type runner: task.SyncRunner
+        :param trackResults: the objects to store information in, ordered
+                             by track number
+        :type trackResults: list(result.TrackResult)
+        :param offset: ripping offset, in CD frames
+        :type offset: int
+        :param device: path to the hardware disc drive
+        :type device: str
+        :param taglists: the tags of each track
+        :type taglists: list(dict)
+        :param overread: whether to force overreading into the
+                         lead-out portion of the disc
+        :type overread: bool
+        :param coverArtPath: path to the downloaded cover art file
+        :type coverArtPath: str or None
+        :param engine: what to read the audio with; cdparanoia or libcdio
+        :type engine: str
+        :returns: the track results of the tracks that were ripped; the
+                  others need to be ripped one by one
+        :rtype: list(result.TrackResult)
+        """
+        tracks = []
+        for trackResult, taglist in zip(trackResults, taglists):
+            start, stop = self.getTrackRange(trackResult.number)
+            os.makedirs(os.path.dirname(trackResult.filename),
+                        exist_ok=True)
+            tracks.append((trackResult.filename, start, stop, taglist))
+
+        numbers = [trackResult.number for trackResult in trackResults]
+        t = cdparanoia.ReadVerifyDiscTask(tracks, self.result.table,
+                                          overread, offset=offset,
+                                          device=device,
+                                          what='tracks %d to %d' % (
+                                              numbers[0], numbers[-1]),
+                                          coverArtPath=coverArtPath,
+                                          engine=engine)
+
+        runner.run(t)
+
+        ripped = []
+        for trackResult, track in zip(trackResults, t.tracks):
+            if track.exception:
+                logger.warning('could not rip track %d in one go: %s',
+                               trackResult.number, track.exception)
+                continue
+
+            trackResult.testcrc = track.testchecksum
+            trackResult.copycrc = track.copychecksum
+            trackResult.peak = track.peak
+            trackResult.quality = track.quality
+            trackResult.testspeed = track.testspeed
+            trackResult.copyspeed = track.copyspeed
+            trackResult.testduration += track.testduration
+            trackResult.copyduration += track.copyduration
+
+            if trackResult.filename != track.path:
+                trackResult.filename = track.path
+                logger.info('filename changed to %r', trackResult.filename)
+            ripped.append(trackResult)
+
+        return ripped
+
+    def getAccurateRip(self, table):
+        """
+        Download the AccurateRip responses for the disc.
+
+        :type table: whipper.image.table.Table
+        :rtype: list(whipper.common.accurip._AccurateRipResponse)
+        :raises whipper.common.accurip.EntryNotFound: if the disc is not
+                                                      in the database
+        """
+        path = table.accuraterip_path()
+        return self._cache.get(('accuraterip', path),
+                               accurip.get_db_entry, path,
+                               self.accurateRipCache)
+
+    def verifyImage(self, runner, table, workers=None):
         """
         Verify table against AccurateRip and cue_path track lengths.
 
@@ -635,6 +1030,10 @@ class Program:
         Will set accurip and friends on each TrackResult.
 
         Populates self.result.tracks with above TrackResults.
+
+        :param workers: how many tracks to checksum at once; by default as
+                        many as there are CPUs
+        :type workers: int or None
         """
         cueImage = image.Image(self.cuePath)
         # assigns track lengths
@@ -649,13 +1048,13 @@ class Program:
             logger.error(verifytask.exceptionMessage)
             return False
 
-        responses = accurip.get_db_entry(table.accuraterip_path())
+        responses = self.getAccurateRip(table)
         logger.info('%d AccurateRip response(s) found', len(responses))
 
         checksums = accurip.calculate_checksums([
             os.path.join(os.path.dirname(self.cuePath), t.indexes[1].path)
             for t in [t for t in cueImage.cue.table.tracks if t.number != 0]
-        ])
+        ], analyses=self._analyses, workers=workers)
         if not (checksums and any(checksums['v1']) and any(checksums['v2'])):
             return False
 
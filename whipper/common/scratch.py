@@ -0,0 +1,173 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_scratch -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# This file is part of whipper.
+#
+# whipper is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whipper is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whipper.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Space for the intermediate files of a rip."""
+
+import errno
+import os
+import shutil
+import tempfile
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+# memory-backed directories tried for scratch files, in order
+MEMORY_DIRECTORIES = ('/dev/shm', os.environ.get('XDG_RUNTIME_DIR'))
+
+
+class NoSpaceError(RuntimeError):
+    """There is not enough free space to store a rip."""
+
+
+def getFreeSpace(path):
+    """
+    Return how many bytes can still be written to the filesystem of a path.
+
+    :param path: a file or directory on the filesystem
+    :type path: str
+    :rtype: int
+    """
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def checkFreeSpace(path, needed):
+    """
+    Make sure the filesystem of a path has enough free space.
+
+    :param path: a file or directory on the filesystem
+    :type path: str
+    :param needed: how many bytes will be written to it
+    :type needed: int
+    :raises NoSpaceError: when there is less free space than needed
+    """
+    free = getFreeSpace(path)
+    logger.debug('%d bytes free in %r, %d needed', free, path, needed)
+    if free < needed:
+        raise NoSpaceError('not enough free space in %s: %d MiB needed, '
+                           '%d MiB free' % (path, needed >> 20, free >> 20))
+
+
+def publish(source, destination):
+    """
+    Move a finished file to its final path in one atomic rename.
+
+    Readers of the final path either see nothing or the whole file.  A file
+    on another filesystem is first copied next to its final path, so that
+    the copy can be renamed.
+
+    :param source: the finished file
+    :type source: str
+    :param destination: the final path
+    :type destination: str
+    """
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    logger.debug('copying %r to the filesystem of %r', source, destination)
+    fd, tmppath = tempfile.mkstemp(
+        prefix='.', suffix='.whipper',
+        dir=os.path.dirname(destination) or os.curdir)
+    try:
+        with open(source, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        shutil.copymode(source, tmppath)
+        os.replace(tmppath, destination)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+    os.unlink(source)
+
+
+class Scratch:
+    """
+    Hand out space for the intermediate audio files of a rip.
+
+    Files are created on a memory-backed filesystem as long as they fit in
+    the memory budget, and otherwise in a given directory, normally the
+    one of the file they turn into.  Either way nothing is written to the
+    filesystem of ``/tmp`` only to be copied elsewhere later.
+
+    Files are handed out to all drives and encoders of a rip, so they have
+    to be released with :any:`release` to give their memory back.
+
+    :ivar memory: how many bytes of files can be kept in memory at once
+    :vartype memory: int
+    """
+
+    def __init__(self, memory=0, directories=MEMORY_DIRECTORIES):
+        """
+        Init Scratch.
+
+        :param memory: how many bytes of files can be kept in memory at once
+        :type memory: int
+        :param directories: memory-backed directories to create files in
+        :type directories: iterable(str)
+        """
+        self.memory = memory
+        self._directories = [d for d in directories
+                             if d and os.path.isdir(d) and
+                             os.access(d, os.W_OK)]
+        self._lock = threading.Lock()
+        self._used = {}  # path: bytes of the budget taken
+
+    def mkstemp(self, size, directory, suffix='.whipper.wav'):
+        """
+        Create an empty scratch file.
+
+        :param size: how big the file will get, in bytes
+        :type size: int
+        :param directory: where to create the file when it does not fit in
+                          memory
+        :type directory: str
+        :param suffix: the end of the file name
+        :type suffix: str
+        :returns: the path of the file
+        :rtype: str
+        """
+        with self._lock:
+            if sum(self._used.values()) + size <= self.memory:
+                for d in self._directories:
+                    if getFreeSpace(d) >= size:
+                        directory = d
+                        break
+            fd, path = tempfile.mkstemp(prefix='.', suffix=suffix,
+                                        dir=directory or os.curdir)
+            if directory in self._directories:
+                self._used[path] = size
+        os.fchmod(fd, 0o644)
+        os.close(fd)
+        logger.debug('created scratch file %r for %d bytes', path, size)
+        return path
+
+    def release(self, path):
+        """
+        Delete a scratch file and give back the memory it took.
+
+        :param path: a path returned by :any:`mkstemp`
+        :type path: str
+        """
+        with self._lock:
+            self._used.pop(path, None)
+        if os.path.exists(path):
+            os.unlink(path)
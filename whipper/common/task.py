@@ -4,8 +4,9 @@
 import os
 import signal
 import subprocess
+import sys
+import threading
 
-from whipper.extern import asyncsub
 from whipper.extern.task import task
 
 import logging
@@ -16,6 +17,52 @@ class SyncRunner(task.SyncRunner):
     pass
 
 
+class ProgressDisplay:
+    """Show the progress of several runners on one line."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}  # runner name -> what it is doing
+        self._longest = 0  # longest line shown; for clearing
+
+    def show(self, name, status):
+        with self._lock:
+            self._status[name] = status
+            line = ' | '.join('%s: %s' % item
+                              for item in self._status.items())
+            print(line.ljust(self._longest), end='\r')
+            sys.stdout.flush()
+            self._longest = max(self._longest, len(line))
+
+
+class MultiplexedRunner(SyncRunner):
+    """
+    Runner sharing its progress display with other runners.
+
+    Used to run tasks for several drives at once, each in its own thread.
+    """
+
+    def __init__(self, display, name, verbose=True):
+        """
+        Init MultiplexedRunner.
+
+        :param display: the display to show progress on
+        :type display: ProgressDisplay
+        :param name: what to show the progress of this runner as
+        :type name: str
+        """
+        SyncRunner.__init__(self, verbose)
+        self._display = display
+        self._name = name
+
+    def _output(self, what, newline=False, ret=True):
+        self._display.show(self._name, what.strip())
+
+    def progressed(self, task, value):
+        if self._verboseRun:
+            self._report()
+
+
 class LoggableTask(task.Task):
     pass
 
@@ -24,6 +71,107 @@ class LoggableMultiSeparateTask(task.MultiSeparateTask):
     pass
 
 
+class Process:
+    """
+    A command run on behalf of a task.
+
+    The output pipes and the exit of the command are watched by the task
+    runner's event loop, so output is handed over as soon as it is written
+    and the end of the command is noticed without polling.  The exit is
+    watched through a pidfd where the platform has them; elsewhere the
+    command is taken to be exiting once it closed its output.
+
+    :ivar pid: the process id of the command
+    :ivar stdout: the pipe the command writes its standard output to
+    """
+
+    def __init__(self, task, argv, stdout=None, stderr=None, exited=None,
+                 cwd=None, bufsize=64 * 1024):
+        """
+        Start ``argv``.
+
+        :param task: the task running the command
+        :type task: whipper.extern.task.task.Task
+        :param argv: the command and its arguments
+        :type argv: list(str)
+        :param stdout: called with each chunk of standard output
+        :type stdout: callable
+        :param stderr: called with each chunk of standard error
+        :type stderr: callable
+        :param exited: called with the exit code, after all output
+        :type exited: callable
+        :param bufsize: the most bytes to read from a pipe at once
+        :type bufsize: int
+        """
+        # keep the runner: the task may stop before the command does
+        self._runner = task.runner
+        self._task = task
+        self._exited = exited
+        self._bufsize = bufsize
+        self._popen = subprocess.Popen(argv,
+                                       stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       close_fds=True, cwd=cwd)
+        self.pid = self._popen.pid
+        self.stdout = self._popen.stdout
+
+        self._pipes = {}
+        for pipe, callback in ((self._popen.stdout, stdout),
+                               (self._popen.stderr, stderr)):
+            fd = pipe.fileno()
+            os.set_blocking(fd, False)
+            self._pipes[fd] = pipe
+            self._runner.addReader(task, fd, self._readable, fd, callback)
+
+        self._pidfd = None
+        try:
+            self._pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError) as e:
+            logger.debug('cannot watch exit of %d: %r', self.pid, e)
+        else:
+            self._runner.addReader(task, self._pidfd, self._check)
+
+    @property
+    def returncode(self):
+        return self._popen.returncode
+
+    def terminate(self):
+        self._popen.terminate()
+
+    def _readable(self, fd, callback):
+        try:
+            data = os.read(fd, self._bufsize)
+        except BlockingIOError:
+            return
+        if data:
+            if callback:
+                callback(data)
+            return
+
+        self._runner.removeReader(fd)
+        self._pipes.pop(fd).close()
+        self._check()
+
+    def _check(self):
+        if self._pipes:
+            return
+        if self._popen.poll() is None:
+            # without a pidfd nothing tells us when the command exits, but
+            # having closed its output it will be gone in a moment
+            if self._pidfd is None:
+                self._runner.schedule(self._task, 0.01, self._check)
+            return
+
+        if self._pidfd is not None:
+            self._runner.removeReader(self._pidfd)
+            os.close(self._pidfd)
+            self._pidfd = None
+        if self._exited:
+            exited, self._exited = self._exited, None
+            exited(self._popen.returncode)
+
+
 class PopenTask(task.Task):
     """Task that runs a command using Popen."""
 
@@ -36,12 +184,11 @@ class PopenTask(task.Task):
         task.Task.start(self, runner)
 
         try:
-            self._popen = asyncsub.Popen(self.command,
-                                         bufsize=self.bufsize,
-                                         stdin=subprocess.PIPE,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE,
-                                         close_fds=True, cwd=self.cwd)
+            self._popen = Process(self, self.command,
+                                  stdout=self._readout,
+                                  stderr=self._readerr,
+                                  exited=self._exited,
+                                  cwd=self.cwd, bufsize=self.bufsize)
         except OSError as e:
             import errno
             if e.errno == errno.ENOENT:
@@ -51,43 +198,26 @@ class PopenTask(task.Task):
 
         logger.debug('started %r with pid %d', self.command, self._popen.pid)
 
-        self.schedule(1.0, self._read, runner)
+    def _readout(self, data):
+        logger.debug("read from stdout: %s", data)
+        self._call(self.readbytesout, data)
 
-    def _read(self, runner):
-        try:
-            read = False
+    def _readerr(self, data):
+        logger.debug("read from stderr: %s", data)
+        self._call(self.readbyteserr, data)
 
-            ret = self._popen.recv()
+    def _exited(self, returncode):
+        self._call(self._done)
 
-            if ret:
-                logger.debug("read from stdout: %s", ret)
-                self.readbytesout(ret)
-                read = True
-
-            ret = self._popen.recv_err()
-
-            if ret:
-                logger.debug("read from stderr: %s", ret)
-                self.readbyteserr(ret)
-                read = True
-
-            # if we read anything, we might have more to read, so
-            # reschedule immediately
-            if read and self.runner:
-                self.schedule(0.0, self._read, runner)
-                return
-
-            # if we didn't read anything, give the command more time to
-            # produce output
-            if self._popen.poll() is None and self.runner:
-                # not finished yet
-                self.schedule(1.0, self._read, runner)
-                return
-
-            self._done()
+    def _call(self, callable_task, *args):
+        if not self.runner:
+            return
+        try:
+            callable_task(*args)
         # FIXME: catching too general exception (Exception)
         except Exception as e:
-            logger.debug('exception during _read(): %s', e)
+            logger.debug('exception during %s(): %s',
+                         callable_task.__name__, e)
             self.setException(e)
             self.stop()
 
@@ -219,6 +219,27 @@ class Task(LogStub):
             return
         self.runner.schedule(self, delta, callable_task, *args, **kwargs)
 
+    def callFromThread(self, callable_task, *args, **kwargs):
+        """
+        Call a callable in the runner, from another thread.
+
+        Used to hand results of work done in other threads back to the task.
+        """
+        self.runner.callFromThread(self, callable_task, *args, **kwargs)
+
+    def addReader(self, fd, callable_task, *args, **kwargs):
+        """
+        Call a callable whenever a file descriptor has data to read.
+
+        :param fd: the file descriptor to watch
+        :type fd: int
+        """
+        self.runner.addReader(self, fd, callable_task, *args, **kwargs)
+
+    def removeReader(self, fd):
+        """Stop watching a file descriptor passed to ``addReader()``."""
+        self.runner.removeReader(fd)
+
     def addListener(self, listener):
         """
         Add a listener for task status changes.
@@ -467,6 +488,41 @@ class TaskRunner(LogStub):
         """
         raise NotImplementedError
 
+    def callFromThread(self, task, callable_task, *args, **kwargs):
+        """
+        Call a callable as soon as possible, from another thread.
+
+        Subclasses should implement this.
+
+        :param callable_task: a task
+        :type callable_task: Task
+        """
+        raise NotImplementedError
+
+    def addReader(self, task, fd, callable_task, *args, **kwargs):
+        """
+        Call a callable whenever a file descriptor has data to read.
+
+        Subclasses should implement this.
+
+        :param fd: the file descriptor to watch
+        :type fd: int
+        :param callable_task: a task
+        :type callable_task: Task
+        """
+        raise NotImplementedError
+
+    def removeReader(self, fd):
+        """
+        Stop watching a file descriptor.
+
+        Subclasses should implement this.
+
+        :param fd: the file descriptor passed to ``addReader()``
+        :type fd: int
+        """
+        raise NotImplementedError
+
 
 class SyncRunner(TaskRunner, ITaskListener):
     """Run the task synchronously in an asyncio event loop."""
@@ -516,7 +572,7 @@ class SyncRunner(TaskRunner, ITaskListener):
             self.debug('exception during start: %r', task.exceptionMessage)
             self.stopped(task)
 
-    def schedule(self, task, delta, callable_task, *args, **kwargs):
+    def _wrap(self, task, callable_task, *args, **kwargs):
         def c():
             try:
                 callable_task(*args, **kwargs)
@@ -528,7 +584,22 @@ class SyncRunner(TaskRunner, ITaskListener):
                 self.stopped(task)
                 raise
 
-        self._loop.call_later(delta, c)
+        return c
+
+    def schedule(self, task, delta, callable_task, *args, **kwargs):
+        self._loop.call_later(delta, self._wrap(
+            task, callable_task, *args, **kwargs))
+
+    def callFromThread(self, task, callable_task, *args, **kwargs):
+        self._loop.call_soon_threadsafe(self._wrap(
+            task, callable_task, *args, **kwargs))
+
+    def addReader(self, task, fd, callable_task, *args, **kwargs):
+        self._loop.add_reader(fd, self._wrap(
+            task, callable_task, *args, **kwargs))
+
+    def removeReader(self, fd):
+        self._loop.remove_reader(fd)
 
     # ITaskListener methods
     def progressed(self, task, value):
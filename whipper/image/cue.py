@@ -187,6 +187,33 @@ class CueFile:
         """
         return common.getRealPath(self._path, path)
 
+    def rewrite(self, path, files, file_format='WAVE'):
+        """
+        Write a copy of the .cue file that refers to other files.
+
+        Every line is kept as it is, except for the FILE lines of the given
+        files.
+
+        :param path: where to write the copy
+        :type path: str
+        :param files: the new file names, relative to the copy, by FILE of
+                      this .cue file
+        :type files: dict(str, str)
+        :param file_format: the format to give the new files
+        :type file_format: str
+        """
+        with open(self._path, newline='') as f:
+            content = f.readlines()
+        with open(path, 'w', newline='') as f:
+            for line in content:
+                stripped = line.rstrip()
+                m = _FILE_RE.search(stripped)
+                if m and m.group('name') in files:
+                    line = 'FILE "%s" %s%s' % (files[m.group('name')],
+                                               file_format,
+                                               line[len(stripped):])
+                f.write(line)
+
 
 class File:
     """Represent a FILE line in a cue file."""
@@ -22,11 +22,13 @@
 
 import os
 
+from whipper.common import checksum
 from whipper.common import encode
 from whipper.common import common
 from whipper.image import cue, table
 from whipper.extern.task import task
-from whipper.program.soxi import AudioLengthTask
+from whipper.program import flac
+from whipper.program.soxi import AudioLengthTask, getLengths
 
 import logging
 logger = logging.getLogger(__name__)
@@ -113,7 +115,12 @@ class Image:
 
 
 class ImageVerifyTask(task.MultiSeparateTask):
-    """Verify a disk image and get the necessary track lengths."""
+    """
+    Verify a disk image and get the necessary track lengths.
+
+    Lengths are read from the headers of the FLAC and WAV files, all at
+    once; soxi is only run for files in other formats.
+    """
 
     logCategory = 'ImageVerifyTask'
 
@@ -130,6 +137,7 @@ class ImageVerifyTask(task.MultiSeparateTask):
         cue = image.cue
         self._tasks = []
         self.lengths = {}
+        scans = []  # (trackIndex, track, path)
 
         try:
             htoa = cue.table.tracks[0].indexes[0]
@@ -137,9 +145,7 @@ class ImageVerifyTask(task.MultiSeparateTask):
             path = image.getRealPath(htoa.path)
             assert isinstance(path, str), "%r is not str" % path
             logger.debug('schedule scan of audio length of %r', path)
-            taskk = AudioLengthTask(path)
-            self.addTask(taskk)
-            self._tasks.append((0, track, taskk))
+            scans.append((0, track, path))
         except (KeyError, IndexError):
             logger.debug('no HTOA track')
 
@@ -162,13 +168,39 @@ class ImageVerifyTask(task.MultiSeparateTask):
                         raise
                 assert isinstance(path, str), "%r is not str" % path
                 logger.debug('schedule scan of audio length of %r', path)
+                scans.append((trackIndex + 1, track, path))
+            else:
+                logger.debug('track %d has length %d', trackIndex + 1, length)
+
+        self._headerLengths = []  # (trackIndex, track, length)
+        lengths = getLengths([path for _, _, path in scans])
+        for (trackIndex, track, path), length in zip(scans, lengths):
+            if length is None:
                 taskk = AudioLengthTask(path)
                 self.addTask(taskk)
-                self._tasks.append((trackIndex + 1, track, taskk))
+                self._tasks.append((trackIndex, track, taskk))
             else:
-                logger.debug('track %d has length %d', trackIndex + 1, length)
+                self._headerLengths.append((trackIndex, track, length))
+
+    def start(self, runner):
+        if self.tasks:
+            task.MultiSeparateTask.start(self, runner)
+            return
+
+        # every length was read from the headers
+        task.Task.start(self, runner)
+        self.schedule(0, self.stop)
+
+    def _setLength(self, trackIndex, track, length):
+        index = track.indexes[1]
+        assert length % common.SAMPLES_PER_FRAME == 0
+        end = length // common.SAMPLES_PER_FRAME
+        self.lengths[trackIndex] = end - index.relative
 
     def stop(self):
+        for trackIndex, track, length in self._headerLengths:
+            self._setLength(trackIndex, track, length)
+
         for trackIndex, track, taskk in self._tasks:
             if taskk.exception:
                 logger.debug('subtask %r had exception %r, shutting down',
@@ -180,48 +212,150 @@ class ImageVerifyTask(task.MultiSeparateTask):
                 raise ValueError("Track length was not found; "
                                  "look for earlier errors "
                                  "in debug log (set RIP_DEBUG=4)")
-            index = track.indexes[1]
-            assert taskk.length % common.SAMPLES_PER_FRAME == 0
-            end = taskk.length // common.SAMPLES_PER_FRAME
-            self.lengths[trackIndex] = end - index.relative
+            self._setLength(trackIndex, track, taskk.length)
 
         task.MultiSeparateTask.stop(self)
 
 
-class ImageEncodeTask(task.MultiSeparateTask):
-    """Encode a disk image to a different format."""
-
-    description = "Encoding tracks"
-
-    def __init__(self, image, outdir):
-        task.MultiSeparateTask.__init__(self)
+def encodeFile(path, outpath, nice=0, cpus=None):
+    """
+    Encode a file of an image to FLAC and check the result.
+
+    flac checks that what it encoded decodes to what it read; the MD5 sum
+    of the audio it stores is then compared to the one of the source file.
+    Nothing is left at ``outpath`` if either fails.
+
+    :param path: the file to encode
+    :type path: str
+    :param outpath: the FLAC file to write
+    :type outpath: str
+    :param nice: how much to lower the priority of the encoder
+    :type nice: int
+    :param cpus: the cores to run the encoder on, or None for any
+    :type cpus: set(int) or None
+    :raises checksum.ChecksumMismatch: when the encoded audio differs from
+                                       the source
+    """
+    try:
+        flac.encode(path, outpath, nice=nice, cpus=cpus)
+        expected = checksum.getAudioMD5(path)
+        if expected is None:
+            logger.warning('cannot checksum %r; only checked by flac', path)
+        elif checksum.getAudioMD5(outpath) != expected:
+            raise checksum.ChecksumMismatch(
+                '%s does not hold the audio of %s' % (outpath, path))
+    except BaseException:
+        if os.path.exists(outpath):
+            os.unlink(outpath)
+        raise
+    logger.debug('encoded %r to %r', path, outpath)
+
+
+class ImageEncodeTask(task.Task):
+    """
+    Encode a disk image to FLAC.
 
-        self._image = image
-        # XXX: Pylint, redefining name 'cue' from outer scope (import)
-        cue = image.cue
-        self._tasks = []
-        self.lengths = {}
+    All files of the image are encoded at once on an encode pool, and a
+    .cue file referring to the encoded files is written next to them.
 
-        def add(index):
+    :ivar cuePath: the .cue file to write
+    :vartype cuePath: str
+    :ivar paths: the encoded files, by FILE of the .cue file of the image
+    :vartype paths: dict(str, str)
+    """
 
-            path = image.getRealPath(index.path)
-            assert isinstance(path, str), "%r is not str" % path
-            logger.debug('schedule encode of %r', path)
-            root, _ = os.path.splitext(os.path.basename(path))
-            outpath = os.path.join(outdir, root + '.' + 'flac')
-            logger.debug('schedule encode to %r', outpath)
-            taskk = encode.FlacEncodeTask(
-                path, os.path.join(outdir, root + '.' + 'flac'))
-            self.addTask(taskk)
+    description = "Encoding tracks"
 
-        try:
-            htoa = cue.table.tracks[0].indexes[0]
-            logger.debug('encoding HTOA track')
-            add(htoa)
-        except (KeyError, IndexError):
-            logger.debug('no HTOA track')
+    def __init__(self, image, outdir, pool=None):
+        """
+        Init ImageEncodeTask.
+
+        :param image: the image to encode
+        :type image: Image
+        :param outdir: the directory to write the encoded image to
+        :type outdir: str
+        :param pool: the pool to encode on, which can be shared by several
+                     images; by default one with a worker per CPU
+        :type pool: encode.EncodePool or None
+        """
+        self._image = image
+        self._outdir = outdir
+        self._pool = pool
+        self._ownPool = pool is None
+        self._futures = None
+
+        self.cuePath = os.path.join(outdir, os.path.basename(image._path))
+        self.paths = {}
+        for track in image.cue.table.tracks:
+            for number in sorted(track.indexes):
+                name = track.indexes[number].path
+                if name in self.paths:
+                    continue
+                root, _ = os.path.splitext(os.path.basename(name))
+                self.paths[name] = os.path.join(outdir, root + '.flac')
+
+        for source, target in [(image._path, self.cuePath)] + [
+                (image.getRealPath(name), path)
+                for name, path in self.paths.items()]:
+            if (os.path.exists(target) and
+                    os.path.samefile(source, target)):
+                raise ValueError('encoding %s would overwrite it' % source)
+
+    def submit(self):
+        """
+        Queue the files of the image to be encoded.
 
-        for trackIndex, track in enumerate(cue.table.tracks):
-            logger.debug('encoding track %d', trackIndex + 1)
-            index = track.indexes[1]
-            add(index)
+        Done by ``start()`` if not done before.  Queueing the next image
+        while the last files of this one are encoded keeps the pool busy.
+        """
+        if self._futures is not None:
+            return
+        if self._pool is None:
+            self._pool = encode.EncodePool(os.cpu_count() or 1)
+        sources = [(self._image.getRealPath(name), path)
+                   for name, path in self.paths.items()]
+        os.makedirs(self._outdir, exist_ok=True)
+        futures = []
+        for source, path in sources:
+            logger.debug('schedule encode of %r to %r', source, path)
+            futures.append(self._pool.submit(
+                encodeFile, source, path,
+                nice=self._pool.nice, cpus=self._pool.cpus))
+        self._futures = futures
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self.submit()
+        self._encoded = 0
+        self._failure = None
+        if not self._futures:
+            self.schedule(0.0, self._finish)
+        for future in self._futures:
+            future.add_done_callback(
+                lambda f: self.callFromThread(self._done, f))
+
+    def _done(self, future):
+        self._encoded += 1
+        if future.exception() and not self._failure:
+            self._failure = future.exception()
+        if self._encoded < len(self._futures):
+            self.setProgress(float(self._encoded) / len(self._futures))
+            return
+        self._finish()
+
+    def _finish(self):
+        if self._ownPool:
+            self._pool.shutdown()
+        if self._failure:
+            # no partial image is left behind
+            for path in self.paths.values():
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise self._failure
+
+        cueDir = os.path.dirname(self.cuePath)
+        self._image.cue.rewrite(self.cuePath, {
+            name: os.path.relpath(path, cueDir)
+            for name, path in self.paths.items()})
+        logger.debug('wrote %r', self.cuePath)
+        self.stop()
@@ -1,5 +1,91 @@
+import sys
+from array import array
+
 import accuraterip
 
+# samples at the start of the first and the end of the last track of a disc
+# that are not checksummed
+_SKIPPED = 5 * 588
+_MASK = 0xffffffff
+
 
 def accuraterip_checksum(f, track_number, total_tracks):
     return accuraterip.compute(f, track_number, total_tracks)
+
+
+def accuraterip_buffer(data, track_number, total_tracks):
+    return accuraterip.compute_buffer(data, track_number, total_tracks)
+
+
+def accuraterip_sink(track_number, total_tracks):
+    """
+    Return an object computing AccurateRip checksums of streamed audio.
+
+    It is a sink for :any:`whipper.program.cdparanoia.ReadTrackTask`:
+    its ``update()`` method takes raw CD audio, and ``digest()`` returns
+    the v1 and v2 checksums of the audio so far.
+
+    :param track_number: the track number, 1-based
+    :type track_number: int
+    :param total_tracks: the number of tracks on the disc
+    :type total_tracks: int
+    :rtype: accuraterip.Checksum
+    """
+    return accuraterip.Checksum(track_number, total_tracks)
+
+
+def accuraterip_window(data, track_number, total_tracks, length):
+    """
+    Compute the AccurateRip v1 checksum of every window of a track's length.
+
+    Reading a track at read offset ``o`` gives the same audio as reading it
+    at a lower offset and skipping the difference, so reading it once with
+    a margin gives the audio for every offset in the margin.  The checksum
+    of the first window is computed in full; each next one is derived
+    from the previous one in constant time, as the v1 checksum is a sum of
+    each sample times its position.
+
+    v2 checksums can not be derived this way; compute those with
+    ``accuraterip.compute_buffer`` for the windows that need them.
+
+    :param data: raw CD audio
+    :type data: bytes
+    :param track_number: the track number, 1-based
+    :type track_number: int
+    :param total_tracks: the number of tracks on the disc
+    :type total_tracks: int
+    :param length: the length of the track, in samples
+    :type length: int
+    :returns: the v1 checksum of the window starting at each sample
+    :rtype: list(int)
+    """
+    words = array('I')
+    words.frombytes(memoryview(data)[:len(data) & ~3])
+    if sys.byteorder == 'big':
+        words.byteswap()
+    if len(words) < length:
+        return []
+
+    # the positions of the window that are checksummed, 1-based
+    first = 1
+    last = length
+    if track_number == 1:
+        first = _SKIPPED
+    if track_number == total_tracks and length >= _SKIPPED:
+        last = length - _SKIPPED
+
+    view = memoryview(data)
+    v1 = accuraterip.compute_buffer(
+        view[:length * 4], track_number, total_tracks)[0]
+    checksums = [v1]
+    if last < first:
+        return checksums * (len(words) - length + 1)
+
+    total = sum(words[first - 1:last]) & _MASK
+    for start in range(len(words) - length):
+        gone = words[start + first - 1]
+        added = words[start + last]
+        total = (total - gone + added) & _MASK
+        v1 = (v1 - first * gone + (last + 1) * added - total) & _MASK
+        checksums.append(v1)
+    return checksums
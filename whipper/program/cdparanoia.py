@@ -19,17 +19,21 @@
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
 import errno
+import fcntl
 import os
 import re
 import shutil
 import stat
+import struct
 import subprocess
 import tempfile
 import time
+import wave
+from array import array
 
-from whipper.common import common
+from whipper.common import cache, common
+from whipper.common import scratch as cscratch
 from whipper.common import task as ctask
-from whipper.extern import asyncsub
 from whipper.extern.task import task
 
 import logging
@@ -61,13 +65,24 @@ class ChecksumException(Exception):
 
 # example:
 # ##: 0 [read] @ 24696
-_PROGRESS_RE = re.compile(r"""
-    ^\#\#: (?P<code>.+)\s         # function code
-    \[(?P<function>.*)\]\s@\s     # [function name] @
-    (?P<offset>\d+)               # offset in words (2-byte one channel value)
-""", re.VERBOSE)
-
-_ERROR_RE = re.compile("^scsi_read error:")
+# cd-paranoia prints a line like this for every read, which adds up to
+# hundreds of thousands of lines per disc; so its output is scanned as bytes
+# a chunk at a time, and only [read] and [wrote] lines and scsi errors match
+_PROGRESS_RE = re.compile(rb"""
+    ^(?:
+        \#\#:\ -?\d+\                      # function code
+        \[(?P<function>read|wrote)\]\ @\    # [function name] @
+        (?P<offset>\d+)                    # offset in words
+    |
+        scsi_read\ error:
+    )
+""", re.VERBOSE | re.MULTILINE)
+
+_WAV_HEADER_SIZE = 44
+# frames re-read on either side of frames that differ between reads
+_REREAD_MARGIN = 5
+# size of the pipe cdparanoia streams audio through, about 6 seconds of audio
+_PIPE_SIZE = 1024 * 1024
 
 # from reading cdparanoia source code, it looks like offset is reported in
 # number of single-channel samples, ie. 2 bytes (word) per unit, and absolute
@@ -96,23 +111,56 @@ class ProgressParser:
         # FIXME: privatize
         self.read = start
 
-        self._reads = {}  # read count for each sector
+        # difference array of the read count of each frame: a read of
+        # frames [a, b) adds one at a and subtracts one at b
+        self._reads = array('l', bytes(
+            (stop - start + 2) * array('l').itemsize))
+
+        self._pending = bytearray()  # output after the last complete line
 
     def parse(self, line):
         """Parse a line."""
-        m = _PROGRESS_RE.search(line)
-        if m:
-            # code = int(m.group('code'))
+        self._scan(line.encode())
+
+    def feed(self, data):
+        """
+        Parse a chunk of cd-paranoia's output.
+
+        An incomplete last line is kept until the rest of it is fed.
+
+        :type data: bytes
+        """
+        pending = self._pending
+        pending += data
+        end = pending.rfind(b'\n') + 1
+        if end:
+            self._scan(pending, end)
+            del pending[:end]
+
+    def _scan(self, data, end=None):
+        for m in _PROGRESS_RE.finditer(data, 0, len(data) if end is None
+                                       else end):
             function = m.group('function')
-            wordOffset = int(m.group('offset'))
-            if function == 'read':
-                self._parse_read(wordOffset)
-            elif function == 'wrote':
-                self._parse_wrote(wordOffset)
+            if function is None:
+                self.errors += 1
+            elif function == b'read':
+                self._parse_read(int(m.group('offset')))
+            else:
+                self._parse_wrote(int(m.group('offset')))
+
+    def event(self, function, wordOffset):
+        """
+        Handle a paranoia callback.
 
-        m = _ERROR_RE.search(line)
-        if m:
-            self.errors += 1
+        :param function: the callback name, as printed by cd-paranoia
+        :type function: str
+        :param wordOffset: absolute offset in words
+        :type wordOffset: int
+        """
+        if function == 'read':
+            self._parse_read(wordOffset)
+        elif function == 'wrote':
+            self._parse_wrote(wordOffset)
 
     def _parse_read(self, wordOffset):
         if wordOffset % common.WORDS_PER_FRAME != 0:
@@ -153,12 +201,6 @@ class ProgressParser:
             markStart = frameOffset  # - self._firstFrames
             markEnd = frameOffset
 
-        # FIXME: doing this is way too slow even for a testcase, so disable
-        # for frame in range(markStart, markEnd):
-        #     if frame not in list(self._reads.keys()):
-        #         self._reads[frame] = 0
-        #     self._reads[frame] += 1
-
         # cdparanoia reads quite a bit beyond the current track before it
         # goes back to verify; don't count those
         # markStart, markEnd of 0, 21 with stop 0 should give 1 read
@@ -169,6 +211,12 @@ class ProgressParser:
 
         self.reads += markEnd - markStart
 
+        first = max(int(markStart), self.start) - self.start
+        end = max(int(markEnd), self.start) - self.start
+        if first < end:
+            self._reads[first] += 1
+            self._reads[end] -= 1
+
         # update our read pointer
         self.read = frameOffset
 
@@ -177,6 +225,20 @@ class ProgressParser:
         frameOffset = (wordOffset + 1) / common.WORDS_PER_FRAME
         self.wrote = frameOffset
 
+    def getReadCounts(self):
+        """
+        Return how many times each frame was read.
+
+        :returns: the read count of each frame from start to stop
+        :rtype: array.array
+        """
+        counts = array('H')
+        count = 0
+        for delta in self._reads[:-1]:
+            count += delta
+            counts.append(min(count, 0xffff))
+        return counts
+
     def getTrackQuality(self):
         """
         Each frame gets read twice.
@@ -195,6 +257,30 @@ class ProgressParser:
             raise RuntimeError("cdparanoia couldn't read any frames "
                                "for the current track")
 
+
+def getRereadMap(counts, nominal=2, bucket=common.FRAMES_PER_SECOND):
+    """
+    Summarize where frames had to be read more often than usual.
+
+    :param counts: the read count of each frame
+    :type counts: sequence(int)
+    :param nominal: the read count of a frame that reads fine
+    :type nominal: int
+    :param bucket: the number of frames to add up
+    :type bucket: int
+    :returns: the first frame of each bucket with extra reads, relative
+              to the first count, and the number of extra reads in it
+    :rtype: list(tuple(int, int))
+    """
+    rereads = []
+    for first in range(0, len(counts), bucket):
+        extra = sum(count - nominal for count in counts[first:first + bucket]
+                    if count > nominal)
+        if extra:
+            rereads.append((first, extra))
+    return rereads
+
+
 # FIXME: handle errors
 
 
@@ -203,18 +289,24 @@ class ReadTrackTask(task.Task):
 
     description = "Reading track"
     quality = None  # set at end of reading
+    readCounts = None  # read count of each frame, set at end of reading
     speed = None
     duration = None  # in seconds
 
     _MAXERROR = 100  # number of errors detected by parser
 
     def __init__(self, path, table, start, stop, overread, offset=0,
-                 device=None, action="Reading", what="track"):
+                 device=None, action="Reading", what="track", sinks=None,
+                 paranoia=True):
         """
         Read the given track.
 
-        :param path: where to store the ripped track
-        :type path: str
+        If sinks are given, cdparanoia writes the track to a pipe instead
+        of a file and the audio data (without WAV header) is handed to each
+        sink's ``update()`` method as soon as it is read.
+
+        :param path: where to store the ripped track; None when streaming
+        :type path: str or None
         :param table: table of contents of CD
         :type table: table.Table
         :param start: first frame to rip
@@ -229,11 +321,18 @@ class ReadTrackTask(task.Task):
         :type action: str
         :param what: a string representing what's being read; e.g. Track
         :type what: str
+        :param sinks: objects to stream the audio data to
+        :type sinks: list or None
+        :param paranoia: whether to verify the data read; without it every
+                         sector is read only once
+        :type paranoia: bool
         """
-        assert isinstance(path, str), "%r is not str" % path
+        if not sinks:
+            assert isinstance(path, str), "%r is not str" % path
 
         self.path = path
         self._table = table
+        self._paranoia = paranoia
         self._start = start
         self._stop = stop
         self._offset = offset
@@ -242,10 +341,14 @@ class ReadTrackTask(task.Task):
         self._start_time = None
         self._overread = overread
 
-        self._buffer = ""  # accumulate characters
         self._errors = []
         self.description = "%s %s" % (action, what)
 
+        self._sinks = sinks
+        self._header = _WAV_HEADER_SIZE  # header bytes still to skip
+        self._streamed = 0  # audio bytes handed to the sinks
+        self._sinkException = None
+
     def start(self, runner):
         task.Task.start(self, runner)
 
@@ -269,19 +372,20 @@ class ReadTrackTask(task.Task):
                      startOffset)
         logger.debug('stopping at track %d, offset %d', stopTrack, stopOffset)
 
-        bufsize = 1024
         if self._overread:
             argv = ["cd-paranoia", "--stderr-progress",
                     "--sample-offset=%d" % self._offset, "--force-overread", ]
         else:
             argv = ["cd-paranoia", "--stderr-progress",
                     "--sample-offset=%d" % self._offset, ]
+        if not self._paranoia:
+            argv.append("--disable-paranoia")
         if self._device:
             argv.extend(["--force-cdrom-device", self._device, ])
         argv.extend(["%d[%s]-%d[%s]" % (
             startTrack, common.framesToHMSF(startOffset),
             stopTrack, common.framesToHMSF(stopOffset)),
-            self.path])
+            self._sinks and '-' or self.path])
         logger.debug('running %s', (" ".join(argv), ))
         if self._offset > 587:
             logger.warning(
@@ -301,80 +405,88 @@ class ReadTrackTask(task.Task):
                 "For more details please check the following issue: "
                 "https://github.com/whipper-team/whipper/issues/302"
             )
+        self._start_time = time.time()
         try:
-            self._popen = asyncsub.Popen(argv,
-                                         bufsize=bufsize,
-                                         stdin=subprocess.PIPE,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE,
-                                         close_fds=True)
+            self._popen = ctask.Process(
+                self, argv, stdout=self._sinks and self._feed,
+                stderr=self._readerr, exited=self._exited,
+                bufsize=_PIPE_SIZE)
         except OSError as e:
             if e.errno == errno.ENOENT:
                 raise common.MissingDependencyException('cd-paranoia')
 
             raise
 
-        self._start_time = time.time()
-        self.schedule(1.0, self._read, runner)
-
-    def _read(self, runner):
-        ret = self._popen.recv_err()
-        if not ret:
-            if self._popen.poll() is not None:
-                self._done()
+        if self._sinks:
+            # a bigger pipe lets cdparanoia keep reading while we are busy
+            # with the sinks
+            try:
+                fcntl.fcntl(self._popen.stdout,
+                            getattr(fcntl, 'F_SETPIPE_SZ', 1031),
+                            _PIPE_SIZE)
+            except OSError as e:
+                logger.debug('could not resize pipe: %r', e)
+
+    def _feed(self, data):
+        if self._header:
+            skip = min(self._header, len(data))
+            self._header -= skip
+            data = data[skip:]
+            if not data:
                 return
-            self.schedule(0.01, self._read, runner)
-            return
 
-        self._buffer += ret.decode()
-
-        # parse buffer into lines if possible, and parse them
-        if "\n" in self._buffer:
-            lines = self._buffer.split('\n')
-            if lines[-1] != "\n":
-                # last line didn't end yet
-                self._buffer = lines[-1]
-                del lines[-1]
-            else:
-                self._buffer = ""
-
-            for line in lines:
-                self._parser.parse(line)
-
-            # fail if too many errors
-            if self._parser.errors > self._MAXERROR:
-                logger.debug('%d errors, terminating', self._parser.errors)
-                self._popen.terminate()
-
-            num = self._parser.wrote - self._start + 1
-            den = self._stop - self._start + 1
-            assert den != 0, "stop %d should be >= start %d" % (
-                self._stop, self._start)
-            progress = float(num) / float(den)
-            if progress < 1.0:
-                self.setProgress(progress)
-
-        # 0 does not give us output before we complete, 1.0 gives us output
-        # too late
-        self.schedule(0.01, self._read, runner)
-
-    def _poll(self, runner):
-        if self._popen.poll() is None:
-            self.schedule(1.0, self._poll, runner)
+        self._streamed += len(data)
+        if self._sinkException:
             return
-
+        try:
+            for sink in self._sinks:
+                sink.update(data)
+        # FIXME: catching too general exception (Exception)
+        except Exception as e:
+            logger.debug('exception while streaming to sink: %r', e)
+            self._sinkException = e
+            self._popen.terminate()
+
+    def _readerr(self, data):
+        self._parser.feed(data)
+
+        # fail if too many errors
+        if self._parser.errors > self._MAXERROR:
+            logger.debug('%d errors, terminating', self._parser.errors)
+            self._popen.terminate()
+
+        num = self._parser.wrote - self._start + 1
+        den = self._stop - self._start + 1
+        assert den != 0, "stop %d should be >= start %d" % (
+            self._stop, self._start)
+        progress = float(num) / float(den)
+        if progress < 1.0:
+            self.setProgress(progress)
+
+    def _exited(self, returncode):
         self._done()
 
     def _done(self):
         end_time = time.time()
         self.setProgress(1.0)
 
+        for sink in self._sinks or []:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+        if self._sinkException:
+            self.setException(self._sinkException)
+
         # check if the length matches
-        size = os.stat(self.path)[stat.ST_SIZE]
-        # wav header is 44 bytes
         offsetLength = self._stop - self._start + 1
-        expected = offsetLength * common.BYTES_PER_FRAME + 44
-        if size != expected:
+        if self._sinks:
+            size = self._streamed
+            expected = offsetLength * common.BYTES_PER_FRAME
+        else:
+            size = os.stat(self.path)[stat.ST_SIZE]
+            expected = offsetLength * common.BYTES_PER_FRAME + \
+                _WAV_HEADER_SIZE
+        if not self.exception and size != expected:
             # FIXME: handle errors better
             logger.warning('file size %d did not match expected size %d',
                            size, expected)
@@ -397,7 +509,10 @@ class ReadTrackTask(task.Task):
                 logger.warning('exit code %r', self._popen.returncode)
                 self.exception = ReturnCodeError(self._popen.returncode)
 
-        self.quality = self._parser.getTrackQuality()
+        # without paranoia each frame is read once, there is no quality
+        if self._paranoia:
+            self.quality = self._parser.getTrackQuality()
+            self.readCounts = self._parser.getReadCounts()
         self.duration = end_time - self._start_time
         self.speed = (offsetLength / 75.0) / self.duration
 
@@ -405,6 +520,184 @@ class ReadTrackTask(task.Task):
         return
 
 
+def getDivergentRanges(test, copy, margin=0):
+    """
+    Return the ranges of frames whose checksums differ.
+
+    :param test: the checksum of each frame of the test read
+    :type test: sequence(int)
+    :param copy: the checksum of each frame of the copy read
+    :type copy: sequence(int)
+    :param margin: frames to add on either side of each range
+    :type margin: int
+    :returns: merged ranges of frame indexes, last one inclusive
+    :rtype: list(tuple(int, int))
+    """
+    length = max(len(test), len(copy))
+    ranges = []
+    for i in range(length):
+        if i < len(test) and i < len(copy) and test[i] == copy[i]:
+            continue
+        first = max(i - margin, 0)
+        last = min(i + margin, length - 1)
+        if ranges and first <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], last)
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+class WavWriter:
+    """Write streamed audio to a WAV file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._wav = None
+
+    def update(self, data):
+        if not self._wav:
+            self._wav = wave.open(self.path, 'wb')
+            self._wav.setnchannels(2)
+            self._wav.setsampwidth(2)
+            self._wav.setframerate(44100)
+        self._wav.writeframesraw(data)
+
+    def close(self):
+        if self._wav:
+            self._wav.close()
+            self._wav = None
+
+
+class _Buffer:
+    """Keep streamed audio in memory."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def update(self, data):
+        self._chunks.append(data)
+
+    @property
+    def data(self):
+        return b''.join(self._chunks)
+
+
+def _findDataChunk(f):
+    """
+    Find the audio data in a WAV file.
+
+    :param f: the WAV file
+    :type f: file
+    :returns: the offset and size of the data chunk
+    :rtype: tuple(int, int)
+    """
+    f.seek(12)  # RIFF header
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError('%r has no data chunk' % f.name)
+        size = struct.unpack('<I', header[4:])[0]
+        if header[:4] == b'data':
+            return f.tell(), size
+        f.seek(size + size % 2, os.SEEK_CUR)
+
+
+class SpliceTask(task.Task):
+    """
+    Task that writes re-read frames into a WAV file.
+
+    Each range is read twice; the two reads have to agree.  Afterwards,
+    the checksum and peak level of the whole file are calculated.
+
+    :cvar checksum: the CRC32 checksum of the resulting audio
+    :cvar peak: the peak level of the resulting audio
+    :cvar frames: the number of frames written
+    """
+
+    description = 'Splicing re-read frames'
+
+    checksum = None
+    peak = None
+    frames = 0
+
+    def __init__(self, path, rereads):
+        """
+        Init SpliceTask.
+
+        :param path: the WAV file to write into
+        :type path: str
+        :param rereads: the first frame of each range and the two buffers
+                        it was read into
+        :type rereads: list(tuple(int, _Buffer, _Buffer))
+        """
+        self.path = path
+        self._rereads = rereads
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self.schedule(0.0, self._splice)
+
+    def _splice(self):
+        from whipper.common import checksum, encode
+
+        with open(self.path, 'r+b') as f:
+            dataOffset, size = _findDataChunk(f)
+            for first, read, verify in self._rereads:
+                data = read.data
+                if data != verify.data:
+                    self.setAndRaiseException(ChecksumException(
+                        're-reads of frames from %d differ' % first))
+                    self.stop()
+                    return
+                f.seek(dataOffset + first * common.BYTES_PER_FRAME)
+                f.write(data)
+                self.frames += len(data) // common.BYTES_PER_FRAME
+
+            f.seek(dataOffset)
+            crc = checksum.CRC32()
+            peak = encode.PeakLevel()
+            while size > 0:
+                data = f.read(min(size, _PIPE_SIZE))
+                if not data:
+                    break
+                size -= len(data)
+                crc.update(data)
+                peak.update(data)
+
+        self.checksum = crc.checksum
+        self.peak = peak.peak
+        self.stop()
+
+
+def _createPartFile(path):
+    """
+    Create the file a track gets encoded to before it is verified.
+
+    :param path: the final path of the track
+    :type path: str
+    :returns: the final path, shortened if it is too long, and the path of
+              the created file
+    :rtype: tuple(str, str)
+    """
+    try:
+        tmpoutpath = path + '.part'
+        open(tmpoutpath, 'wb').close()
+    except IOError as e:
+        if errno.ENAMETOOLONG != e.errno:
+            raise
+        path = common.truncate_filename(common.shrinkPath(path))
+        tmpoutpath = common.truncate_filename(path + '.part')
+        open(tmpoutpath, 'wb').close()
+    return path, tmpoutpath
+
+
+def _getReadTrackTask(engine):
+    if engine == 'libcdio':
+        from whipper.program import libcdio
+        return libcdio.ReadTrackTask
+    return ReadTrackTask
+
+
 class ReadVerifyTrackTask(task.MultiSeparateTask):
     """
     Task that reads and verifies a track using cdparanoia.
@@ -414,6 +707,10 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
     The path where the file is stored can be changed if necessary, for
     example if the file name is too long.
 
+    When streaming, cdparanoia's output is checksummed, measured and
+    encoded while it is being read, instead of being written to a temporary
+    WAV file which is read back for each of these steps.
+
     :cvar checksum: the checksum of the track; set if they match
     :cvar testchecksum: the test checksum of the track
     :cvar copychecksum: the copy checksum of the track
@@ -424,6 +721,14 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
     :cvar testduration: the test duration of the track, in seconds
     :cvar copyduration: the copy duration of the track, in seconds
     :cvar peak: the peak level of the track
+    :cvar rereads: where frames had to be read again, see
+                   :any:`getRereadMap`
+    :cvar analysis: the facts about the stored track, if known
+    :vartype analysis: whipper.common.analysis.Analysis
+    :cvar finished: when the track is finished on an encode worker, the
+                    future to wait for before using the track and its peak
+                    level; it raises what went wrong finishing the track
+    :vartype finished: concurrent.futures.Future
     """
 
     checksum = None
@@ -431,16 +736,21 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
     copychecksum = None
     peak = None
     quality = None
+    rereads = None
     testspeed = None
     copyspeed = None
     testduration = None
     copyduration = None
+    analysis = None
+    finished = None
 
     _tmpwavpath = None
     _tmppath = None
 
     def __init__(self, path, table, start, stop, overread, offset=0,
-                 device=None, taglist=None, what="track", coverArtPath=None):
+                 device=None, taglist=None, what="track", coverArtPath=None,
+                 stream=False, engine='cdparanoia', encoder=None,
+                 scratch=None, number=None, total=None):
         """
         Init ReadVerifyTrackTask.
 
@@ -458,6 +768,24 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
         :type device: str
         :param taglist: a dict of tags
         :type taglist: dict
+        :param stream: whether to stream the audio instead of using a
+                       temporary WAV file
+        :type stream: bool
+        :param engine: what to read the audio with; cdparanoia or libcdio
+        :type engine: str
+        :param encoder: where to encode, checksum and tag the track once it
+                        has been read, instead of doing it before stopping;
+                        not used when streaming
+        :type encoder: whipper.common.encode.EncodePool or None
+        :param scratch: where to keep the WAV files of the track; by
+                        default next to the track
+        :type scratch: whipper.common.scratch.Scratch or None
+        :param number: the position of the track among the audio tracks,
+                       1-based, as AccurateRip counts; its AccurateRip
+                       checksums are only calculated if given
+        :type number: int or None
+        :param total: the number of audio tracks on the disc
+        :type total: int or None
         """
         task.MultiSeparateTask.__init__(self)
 
@@ -465,71 +793,175 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
 
         if taglist:
             logger.debug('read and verify with taglist %r', taglist)
-        # FIXME: choose a dir on the same disk/dir as the final path
-        fd, tmppath = tempfile.mkstemp(suffix='.whipper.wav')
-        os.fchmod(fd, 0o644)
-        os.close(fd)
-        self._tmpwavpath = tmppath
-
-        from whipper.common import checksum
-
-        self.tasks = []
-        self.tasks.append(
-            ReadTrackTask(tmppath, table, start, stop, overread,
-                          offset=offset, device=device, what=what))
-        self.tasks.append(checksum.CRC32Task(tmppath))
-        t = ReadTrackTask(tmppath, table, start, stop, overread,
-                          offset=offset, device=device, action="Verifying",
-                          what=what)
-        self.tasks.append(t)
-        self.tasks.append(checksum.CRC32Task(tmppath))
-
-        # encode to the final path + '.part'
-        try:
-            tmpoutpath = path + '.part'
-            open(tmpoutpath, 'wb').close()
-        except IOError as e:
-            if errno.ENAMETOOLONG != e.errno:
-                raise
-            path = common.truncate_filename(common.shrinkPath(path))
-            tmpoutpath = common.truncate_filename(path + '.part')
-            open(tmpoutpath, 'wb').close()
+
+        self.path, tmpoutpath = _createPartFile(path)
         self._tmppath = tmpoutpath
-        self.path = path
+        self._scratch = scratch or cscratch.Scratch()
+        self._wavsize = (stop - start + 1) * common.BYTES_PER_FRAME + 44
+
+        from whipper.common import analysis, checksum, encode
+
+        reader = _getReadTrackTask(engine)
+        # stop the copy pass once re-reading the frames that differ from
+        # the test pass would not be worth it anymore
+        limit = (stop - start + 1) // 2
+
+        if stream:
+            self._encode = encode.FlacEncodeTask(None, tmpoutpath)
+            testcrc = checksum.CRC32()
+            # the copy is what gets stored, so it is fully analyzed
+            self._peak = copy = analysis.Analyzer(number, total)
+            testframes = checksum.FrameCRC32()
+            self._read = reader(None, table, start, stop, overread,
+                                offset=offset, device=device, what=what,
+                                sinks=[testcrc, testframes])
+            copyframes = checksum.FrameVerifier(testframes, limit)
+            self._verify = reader(None, table, start, stop, overread,
+                                  offset=offset, device=device,
+                                  action="Verifying", what=what,
+                                  sinks=[copy, copyframes, self._encode])
+            self._checksums = (testcrc, copy, copy)
+            self._frames = (testframes, copyframes)
+            self.tasks = [self._read, self._verify, self._encode]
+            finish = []
+            # the copy is only available again once it is encoded
+            self._compareAfter = self._encode
+            encoder = None
+        else:
+            tmppath = self._scratch.mkstemp(self._wavsize,
+                                            os.path.dirname(self.path))
+            self._tmpwavpath = tmppath
+
+            self._encode = encode.FlacEncodeTask(
+                tmppath, tmpoutpath,
+                nice=encoder and encoder.nice or 0,
+                cpus=encoder and encoder.cpus)
+            # MerlijnWajer: XXX: We run the CRC32Task on the wav file,
+            # because it's in general stupid to run the CRC32 on the flac
+            # file since it already has --verify. We should just get rid of
+            # this CRC32 step.
+            # make sure our encoding is accurate; the peak level and
+            # AccurateRip checksums come from the same pass
+            self._peak = analysis.AnalyzeTask(tmppath, number, total)
+            self._checksums = (checksum.CRC32Task(tmppath, frames=True),
+                               checksum.CRC32Task(tmppath, frames=True),
+                               self._peak)
+            self._read = reader(tmppath, table, start, stop, overread,
+                                offset=offset, device=device, what=what)
+            # the copy is streamed so that it can be compared while it is
+            # being read
+            self._verify = reader(None, table, start, stop, overread,
+                                  offset=offset, device=device,
+                                  action="Verifying", what=what,
+                                  sinks=[WavWriter(tmppath),
+                                         checksum.FrameVerifier(
+                                             self._checksums[0], limit)])
+            self._frames = self._checksums[:2]
+            self.tasks = [self._read, self._checksums[0],
+                          self._verify, self._checksums[1]]
+            finish = [self._encode, self._peak]
+            self._compareAfter = self._checksums[1]
 
-        from whipper.common import encode
+        # TODO: Move tagging and embed picture outside of cdparanoia
+        finish.append(encode.TaggingTask(tmpoutpath, taglist))
+        finish.append(encode.EmbedPictureTask(tmpoutpath, coverArtPath))
+        # the drive is done with the track once it is read and verified
+        self._encoder = encoder
+        self._finishTasks = finish
+        if not encoder:
+            self.tasks.extend(finish)
 
-        self.tasks.append(encode.FlacEncodeTask(tmppath, tmpoutpath))
+        self.checksum = None
 
-        # MerlijnWajer: XXX: We run the CRC32Task on the wav file, because it's
-        # in general stupid to run the CRC32 on the flac file since it already
-        # has --verify. We should just get rid of this CRC32 step.
-        # make sure our encoding is accurate
-        self.tasks.append(checksum.CRC32Task(tmppath))
-        self.tasks.append(encode.SoxPeakTask(tmppath))
+        self._reader = reader
+        self._readArgs = (table, start, overread, offset, device, what)
+        self._splice = None
+        self._repairwavpath = None
 
-        # TODO: Move tagging and embed picture outside of cdparanoia
-        self.tasks.append(encode.TaggingTask(tmpoutpath, taglist))
-        self.tasks.append(encode.EmbedPictureTask(tmpoutpath, coverArtPath))
+    def stopped(self, t):
+        if not t.exception and t is self._compareAfter:
+            try:
+                self._repair()
+            # FIXME: catching too general exception (Exception)
+            except Exception as e:
+                logger.debug('could not set up re-reads: %r', e)
 
-        self.checksum = None
+        task.MultiSeparateTask.stopped(self, t)
+
+    def _repair(self):
+        """
+        Re-read only the frames that differ between the test and the copy.
+
+        The re-read tasks are inserted after the current one.  If the
+        re-reads agree with each other, they are spliced into the copy.
+        """
+        from whipper.common import encode
+
+        test, copy = (f.frames for f in self._frames)
+        if test == copy:
+            return
+
+        ranges = getDivergentRanges(test, copy, margin=_REREAD_MARGIN)
+        frames = sum(last - first + 1 for first, last in ranges)
+        if frames * 2 > len(copy):
+            logger.info('%d of %d frames differ, not re-reading them',
+                        frames, len(copy))
+            return
+        logger.info('re-reading %d frames in %d range(s) that differ',
+                    frames, len(ranges))
+
+        tasks = []
+        wavpath = self._tmpwavpath
+        if wavpath is None:
+            wavpath = self._scratch.mkstemp(self._wavsize,
+                                            os.path.dirname(self.path))
+            self._repairwavpath = wavpath
+            tasks.append(encode.FlacDecodeTask(self._tmppath, wavpath))
+
+        table, start, overread, offset, device, what = self._readArgs
+        rereads = []
+        for first, last in ranges:
+            buffers = (_Buffer(), _Buffer())
+            for action, buf in zip(("Re-reading", "Re-verifying"),
+                                   buffers):
+                tasks.append(self._reader(
+                    None, table, start + first, start + last, overread,
+                    offset=offset, device=device, action=action,
+                    what='%s, frames %d to %d' % (what, first, last),
+                    sinks=[buf]))
+            rereads.append((first, ) + buffers)
+
+        self._splice = SpliceTask(wavpath, rereads)
+        tasks.append(self._splice)
+        if self._tmpwavpath is None:
+            tasks.append(encode.FlacEncodeTask(wavpath, self._tmppath))
+
+        self.tasks[self._task:self._task] = tasks
 
     def stop(self):
         # FIXME: maybe this kind of try-wrapping to make sure
         # we chain up should be handled by a parent class function ?
         try:
             if not self.exception:
-                self.quality = max(self.tasks[0].quality,
-                                   self.tasks[2].quality)
-                self.peak = self.tasks[6].peak
-                logger.debug('peak: %r', self.peak)
-                self.testspeed = self.tasks[0].speed
-                self.copyspeed = self.tasks[2].speed
-                self.testduration = self.tasks[0].duration
-                self.copyduration = self.tasks[2].duration
-
-                self.testchecksum = c1 = self.tasks[1].checksum
-                self.copychecksum = c2 = self.tasks[3].checksum
+                self.quality = max(self._read.quality,
+                                   self._verify.quality)
+                self.rereads = getRereadMap([
+                    a + b for a, b in zip(self._read.readCounts,
+                                          self._verify.readCounts)],
+                    nominal=4)
+                self.testspeed = self._read.speed
+                self.copyspeed = self._verify.speed
+                self.testduration = self._read.duration
+                self.copyduration = self._verify.duration
+
+                self.testchecksum = c1 = self._checksums[0].checksum
+                self.copychecksum = c2 = self._checksums[1].checksum
+                if self._splice:
+                    # the re-reads agreed on all frames that differed
+                    logger.info('repaired %d frames',
+                                self._splice.frames)
+                    self.testchecksum = self.copychecksum = c1 = c2 = \
+                        self._splice.checksum
                 if c1 == c2:
                     logger.info('checksums match, %08x', c1)
                     self.checksum = self.testchecksum
@@ -540,32 +972,389 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
                     self.exception = ChecksumException(
                         'read and verify failed: test checksum')
 
-                if self.tasks[5].checksum != self.checksum:
-                    self.exception = ChecksumException(
-                        'Encoding failed, checksum does not match')
-
-                # delete the unencoded file
-                os.unlink(self._tmpwavpath)
-
-                if not self.exception:
-                    try:
-                        logger.debug('moving to final path %r', self.path)
-                        shutil.move(self._tmppath, self.path)
-                    # FIXME: catching too general exception (Exception)
-                    except Exception as e:
-                        logger.debug('exception while moving to final '
-                                     'path %r: %s', self.path, e)
-                        self.exception = e
+                if self._encoder and not self.exception:
+                    self.finished = self._encoder.submit(self._finish)
+                else:
+                    self._complete()
+            else:
+                logger.debug('stop: exception %r', self.exception)
+                if self._tmpwavpath is None:
+                    self._encode.abort()
                 else:
+                    self._scratch.release(self._tmpwavpath)
+                if self._repairwavpath:
+                    self._scratch.release(self._repairwavpath)
+        # FIXME: catching too general exception (Exception)
+        except Exception as e:
+            print('WARNING: unhandled exception %r' % (e, ))
+
+        task.MultiSeparateTask.stop(self)
+
+    def _finish(self):
+        """Encode, checksum and tag the track on an encode worker."""
+        t = task.MultiSeparateTask()
+        t.description = 'Finishing %s' % self._readArgs[-1]
+        t.tasks = self._finishTasks
+        try:
+            task.SyncRunner(verbose=False).run(t)
+        except task.TaskException as e:
+            self.exception = e.exception
+        self._complete()
+        if self.exception:
+            raise self.exception
+
+    def _complete(self):
+        """
+        Check the encoded track and move it to its final path.
+
+        If anything went wrong, ``exception`` is set and the encoded track
+        removed.
+        """
+        self.peak = self._peak.peak
+        logger.debug('peak: %r', self.peak)
+        encoded = self._checksums[2].checksum
+        if self._splice and self._tmpwavpath is None:
+            # the streamed copy was analyzed before it was repaired
+            self.peak = self._splice.peak
+            encoded = self._splice.checksum
+        elif self._tmpwavpath:
+            self.analysis = self._peak.analysis
+        else:
+            self.analysis = self._peak.result()
+        if not self.exception and encoded != self.checksum:
+            self.exception = ChecksumException(
+                'Encoding failed, checksum does not match')
+
+        # delete the unencoded file
+        if self._tmpwavpath:
+            self._scratch.release(self._tmpwavpath)
+        if self._repairwavpath:
+            self._scratch.release(self._repairwavpath)
+
+        if not self.exception:
+            try:
+                logger.debug('moving to final path %r', self.path)
+                cscratch.publish(self._tmppath, self.path)
+            # FIXME: catching too general exception (Exception)
+            except Exception as e:
+                logger.debug('exception while moving to final '
+                             'path %r: %s', self.path, e)
+                self.exception = e
+        else:
+            os.unlink(self._tmppath)
+
+
+class FastReadTrackTask(task.MultiSeparateTask):
+    """
+    Task that reads a track once, without paranoia, and checks it against
+    AccurateRip.
+
+    The track is checksummed and encoded while it is being read.  The
+    encoded file is only kept if its AccurateRip checksum matches one of
+    the given responses with enough confidence; otherwise the track has to
+    be ripped securely with :any:`ReadVerifyTrackTask`.
+
+    :cvar checksum: the CRC32 checksum of the track
+    :cvar archecksums: the AccurateRip checksums of the track
+    :cvar confidence: the highest confidence of a matching response
+    :cvar accurate: whether the track was kept
+    :cvar speed: the read speed of the track, as a multiple of track duration
+    :cvar duration: the read duration of the track, in seconds
+    :cvar peak: the peak level of the track
+    :cvar analysis: the facts about the track
+    :vartype analysis: whipper.common.analysis.Analysis
+    """
+
+    checksum = None
+    archecksums = None
+    confidence = 0
+    accurate = False
+    speed = None
+    duration = None
+    peak = None
+    analysis = None
+
+    def __init__(self, path, table, start, stop, overread, number, total,
+                 responses, confidence=2, offset=0, device=None,
+                 taglist=None, what="track", coverArtPath=None,
+                 engine='cdparanoia'):
+        """
+        Init FastReadTrackTask.
+
+        :param path: where to store the ripped track
+        :type path: str
+        :param table: table of contents of CD
+        :type table: table.Table
+        :param start: first frame to rip
+        :type start: int
+        :param stop: last frame to rip (inclusive)
+        :type stop: int
+        :param number: the position of the track among the audio tracks,
+                       1-based, as AccurateRip counts
+        :type number: int
+        :param total: the number of audio tracks on the disc
+        :type total: int
+        :param responses: AccurateRip responses for the disc
+        :type responses: list(accurip._AccurateRipResponse)
+        :param confidence: lowest confidence for a match to be accepted
+        :type confidence: int
+        :param offset: read offset, in samples
+        :type offset: int
+        :param device: the device to rip from
+        :type device: str
+        :param taglist: a dict of tags
+        :type taglist: dict
+        :param engine: what to read the audio with; cdparanoia or libcdio
+        :type engine: str
+        """
+        task.MultiSeparateTask.__init__(self)
+
+        from whipper.common import analysis, encode
+
+        self.path, self._tmppath = _createPartFile(path)
+        self._number = number
+        self._responses = responses
+        self._confidence = confidence
+
+        self._analyzer = analysis.Analyzer(number, total)
+        self._encode = encode.FlacEncodeTask(None, self._tmppath)
+        self._read = _getReadTrackTask(engine)(
+            None, table, start, stop, overread, offset=offset,
+            device=device, what=what, paranoia=False,
+            sinks=[self._analyzer, self._encode])
+
+        self.tasks = [self._read, self._encode,
+                      encode.TaggingTask(self._tmppath, taglist),
+                      encode.EmbedPictureTask(self._tmppath, coverArtPath)]
+
+    def stop(self):
+        try:
+            if not self.exception:
+                self.analysis = self._analyzer.result()
+                self.checksum = self.analysis.checksum
+                self.peak = self.analysis.peak
+                self.speed = self._read.speed
+                self.duration = self._read.duration
+
+                from whipper.common import accurip
+                self.archecksums = {
+                    'v1': self.analysis.v1,
+                    'v2': self.analysis.v2,
+                }
+                self.confidence = accurip.match_track(
+                    self._responses, self._number, self.archecksums)
+                self.accurate = self.confidence >= self._confidence
+                logger.debug('track %d: AccurateRip v1 %s v2 %s, '
+                             'confidence %d', self._number,
+                             self.archecksums['v1'], self.archecksums['v2'],
+                             self.confidence)
+
+            if self.accurate:
+                logger.debug('moving to final path %r', self.path)
+                cscratch.publish(self._tmppath, self.path)
+            else:
+                self._encode.abort()
+                if os.path.exists(self._tmppath):
                     os.unlink(self._tmppath)
+        # FIXME: catching too general exception (Exception)
+        except Exception as e:
+            logger.debug('exception while finishing fast read: %r', e)
+            self.accurate = False
+            self.exception = e
+
+        task.MultiSeparateTask.stop(self)
+
+
+class Splitter:
+    """
+    Split streamed audio into consecutive ranges, for example tracks.
+
+    The data of each range is handed to the sinks of that range.  Once a
+    range is complete, its sinks that have a ``close()`` method are closed.
+    """
+
+    def __init__(self, lengths, sinks):
+        """
+        Init Splitter.
+
+        :param lengths: the length of each range, in bytes
+        :type lengths: list(int)
+        :param sinks: the sinks of each range
+        :type sinks: list(list)
+        """
+        assert len(lengths) == len(sinks), "need sinks for every range"
+        self._lengths = lengths
+        self._sinks = sinks
+        self._index = 0
+        self._left = lengths and lengths[0] or 0
+
+    def update(self, data):
+        while data and self._index < len(self._lengths):
+            piece = data[:self._left]
+            data = data[self._left:]
+            for sink in self._sinks[self._index]:
+                sink.update(piece)
+
+            self._left -= len(piece)
+            if self._left:
+                continue
+
+            for sink in self._sinks[self._index]:
+                if hasattr(sink, 'close'):
+                    sink.close()
+            self._index += 1
+            if self._index < len(self._lengths):
+                self._left = self._lengths[self._index]
+
+
+class DiscTrack:
+    """
+    The outcome of reading one track with :any:`ReadVerifyDiscTask`.
+
+    Has the same attributes as :any:`ReadVerifyTrackTask`, with the speed,
+    duration and quality of the passes over the whole range.
+
+    :cvar exception: why the track could not be ripped, if it could not
+    """
+
+    checksum = None
+    testchecksum = None
+    copychecksum = None
+    peak = None
+    quality = None
+    testspeed = None
+    copyspeed = None
+    testduration = None
+    copyduration = None
+    exception = None
+
+    def __init__(self, path, tmppath, start, stop):
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self._tmppath = tmppath
+
+
+class ReadVerifyDiscTask(task.MultiSeparateTask):
+    """
+    Task that reads, verifies and encodes consecutive tracks at once.
+
+    The whole range is read in one sequential test pass and one sequential
+    copy pass, saving the seeks and spin-ups of reading the tracks one by
+    one.  The audio is split into tracks while it is being streamed.
+
+    Tracks whose checksums don't match get their exception set and are not
+    stored, so that they can be ripped again one by one.
+
+    :ivar tracks: the outcome for each track
+    :vartype tracks: list(DiscTrack)
+    """
+
+    def __init__(self, tracks, table, overread, offset=0, device=None,
+                 what="tracks", coverArtPath=None, engine='cdparanoia'):
+        """
+        Init ReadVerifyDiscTask.
+
+        :param tracks: path, first frame, last frame (inclusive) and
+                       taglist of each track; the ranges must be
+                       consecutive
+        :type tracks: list(tuple(str, int, int, dict))
+        :param table: table of contents of CD
+        :type table: table.Table
+        :param offset: read offset, in samples
+        :type offset: int
+        :param device: the device to rip from
+        :type device: str
+        :param what: a string representing what's being read
+        :type what: str
+        :param engine: what to read the audio with; cdparanoia or libcdio
+        :type engine: str
+        """
+        task.MultiSeparateTask.__init__(self)
+
+        from whipper.common import checksum, encode
+
+        self.tracks = []
+        self._sinks = []
+        lengths = []
+        for path, start, stop, _ in tracks:
+            assert not self.tracks or start == self.tracks[-1].stop + 1, \
+                "track starting at %d is not consecutive" % start
+            path, tmpoutpath = _createPartFile(path)
+            self.tracks.append(DiscTrack(path, tmpoutpath, start, stop))
+            self._sinks.append((checksum.CRC32(), checksum.CRC32(),
+                                encode.PeakLevel(),
+                                encode.FlacEncodeTask(None, tmpoutpath)))
+            lengths.append((stop - start + 1) * common.BYTES_PER_FRAME)
+
+        testsinks = [[testcrc] for testcrc, _, _, _ in self._sinks]
+        copysinks = [list(sinks[1:]) for sinks in self._sinks]
+        start = self.tracks[0].start
+        stop = self.tracks[-1].stop
+        reader = _getReadTrackTask(engine)
+        self._read = reader(None, table, start, stop, overread,
+                            offset=offset, device=device, what=what,
+                            sinks=[Splitter(lengths, testsinks)])
+        self._verify = reader(None, table, start, stop, overread,
+                              offset=offset, device=device,
+                              action="Verifying", what=what,
+                              sinks=[Splitter(lengths, copysinks)])
+
+        self.tasks = [self._read, self._verify]
+        self.tasks.extend(sinks[3] for sinks in self._sinks)
+        for (_, _, _, taglist), track in zip(tracks, self.tracks):
+            self.tasks.append(encode.TaggingTask(track._tmppath, taglist))
+            self.tasks.append(encode.EmbedPictureTask(track._tmppath,
+                                                      coverArtPath))
+
+    def stop(self):
+        try:
+            if not self.exception:
+                frames = self.tracks[-1].stop - self.tracks[0].start + 1
+                for track, sinks in zip(self.tracks, self._sinks):
+                    self._finishTrack(track, sinks, float(
+                        track.stop - track.start + 1) / frames)
             else:
                 logger.debug('stop: exception %r', self.exception)
+                for track, sinks in zip(self.tracks, self._sinks):
+                    track.exception = self.exception
+                    sinks[3].abort()
+                    if os.path.exists(track._tmppath):
+                        os.unlink(track._tmppath)
         # FIXME: catching too general exception (Exception)
         except Exception as e:
             print('WARNING: unhandled exception %r' % (e, ))
 
         task.MultiSeparateTask.stop(self)
 
+    def _finishTrack(self, track, sinks, share):
+        testcrc, copycrc, peak, _ = sinks
+        track.quality = max(self._read.quality, self._verify.quality)
+        track.peak = peak.peak
+        track.testspeed = self._read.speed
+        track.copyspeed = self._verify.speed
+        track.testduration = self._read.duration * share
+        track.copyduration = self._verify.duration * share
+
+        track.testchecksum = c1 = testcrc.checksum
+        track.copychecksum = c2 = copycrc.checksum
+        if c1 == c2:
+            logger.info('checksums match, %08x', c1)
+            track.checksum = c1
+            try:
+                logger.debug('moving to final path %r', track.path)
+                cscratch.publish(track._tmppath, track.path)
+            # FIXME: catching too general exception (Exception)
+            except Exception as e:
+                logger.debug('exception while moving to final '
+                             'path %r: %s', track.path, e)
+                track.exception = e
+        else:
+            logger.info('checksums do not match, %08x %08x', c1, c2)
+            track.exception = ChecksumException(
+                'read and verify failed: test checksum')
+            os.unlink(track._tmppath)
+
 
 _VERSION_RE = re.compile(
     "^cdparanoia (?P<version>.+) release (?P<release>.+)")
@@ -577,7 +1366,28 @@ def getCdParanoiaVersion():
                                   _VERSION_RE,
                                   "%(version)s %(release)s")
 
-    return getter.get()
+    return cache.probeOnce('cd-paranoia', 'version', getter.get)
+
+
+def _supportsOverread():
+    try:
+        p = subprocess.run(['cd-paranoia', '--help'],
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        logger.debug('could not run cd-paranoia: %r', e)
+        return None
+    return b'--force-overread' in p.stdout
+
+
+def supportsOverread():
+    """
+    Return whether cd-paranoia can read into the lead-out.
+
+    Only the patched cdparanoia package can.
+
+    :rtype: bool or None
+    """
+    return cache.probeOnce('cd-paranoia', 'overread', _supportsOverread)
 
 
 _OK_RE = re.compile(r'Drive tests OK with Paranoia.')
@@ -1,14 +1,13 @@
 import os
 import re
-import shutil
 import tempfile
-import subprocess
 from subprocess import Popen, PIPE
 
+from whipper.common import cache
 from whipper.common.common import truncate_filename
 from whipper.image.toc import TocFile
+from whipper.common import task as ctask
 from whipper.extern.task import task
-from whipper.extern import asyncsub
 
 import logging
 logger = logging.getLogger(__name__)
@@ -31,6 +30,26 @@ class ProgressParser:
     currentTrack = 0
     oldline = ''  # for leadout/final track number detection
 
+    def __init__(self):
+        self._pending = bytearray()  # output after the last complete line
+
+    def feed(self, data):
+        """
+        Parse a chunk of cdrdao's output.
+
+        An incomplete last line is kept until the rest of it is fed, so a
+        multi-byte character split over two chunks is decoded whole.
+
+        :type data: bytes
+        """
+        pending = self._pending
+        pending += data
+        end = pending.rfind(b'\n') + 1
+        if end:
+            for line in pending[:end - 1].decode(errors='replace').split('\n'):
+                self.parse(line)
+            del pending[:end]
+
     def parse(self, line):
         cdrdao_m = _BEGIN_CDRDAO_RE.match(line)
 
@@ -69,6 +88,7 @@ class ReadTOCTask(task.Task):
 
     description = "Reading TOC"
     toc = None
+    contents = None  # the .toc file written by cdrdao
 
     def __init__(self, device, fast_toc=False, toc_path=None):
         """
@@ -84,7 +104,6 @@ class ReadTOCTask(task.Task):
         self.device = device
         self.fast_toc = fast_toc
         self.toc_path = toc_path
-        self._buffer = ""  # accumulate characters
         self._parser = ProgressParser()
 
         self.fd, self.tocfile = tempfile.mkstemp(
@@ -99,75 +118,56 @@ class ReadTOCTask(task.Task):
                + (['--fast-toc'] if self.fast_toc else [])
                + ['--device', self.device, self.tocfile])
 
-        self._popen = asyncsub.Popen(cmd,
-                                     bufsize=1024,
-                                     stdin=subprocess.PIPE,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE,
-                                     close_fds=True)
-
-        self.schedule(0.01, self._read, runner)
-
-    def _read(self, runner):
-        ret = self._popen.recv_err()
-        if not ret:
-            if self._popen.poll() is not None:
-                self._done()
-                return
-            self.schedule(0.01, self._read, runner)
-            return
-        self._buffer += ret.decode()
-
-        # parse buffer into lines if possible, and parse them
-        if "\n" in self._buffer:
-            lines = self._buffer.split('\n')
-            if lines[-1] != "\n":
-                # last line didn't end yet
-                self._buffer = lines[-1]
-                del lines[-1]
-            else:
-                self._buffer = ""
-            for line in lines:
-                self._parser.parse(line)
-                if (self._parser.currentTrack != 0 and
-                        self._parser.tracks != 0):
-                    progress = (float('%d' % self._parser.currentTrack) /
-                                float(self._parser.tracks))
-                    if progress < 1.0:
-                        self.setProgress(progress)
-
-        # 0 does not give us output before we complete, 1.0 gives us output
-        # too late
-        self.schedule(0.01, self._read, runner)
-
-    def _poll(self, runner):
-        if self._popen.poll() is None:
-            self.schedule(1.0, self._poll, runner)
-            return
+        self._popen = ctask.Process(self, cmd, stderr=self._readerr,
+                                    exited=self._exited)
 
+    def _readerr(self, data):
+        self._parser.feed(data)
+        if self._parser.currentTrack != 0 and self._parser.tracks != 0:
+            progress = (float('%d' % self._parser.currentTrack) /
+                        float(self._parser.tracks))
+            if progress < 1.0:
+                self.setProgress(progress)
+
+    def _exited(self, returncode):
         self._done()
 
     def _done(self):
         self.setProgress(1.0)
         self.toc = TocFile(self.tocfile)
         self.toc.parse()
+        with open(self.tocfile, 'rb') as f:
+            self.contents = f.read()
         if self.toc_path is not None:
-            t_comp = os.path.abspath(self.toc_path).split(os.sep)
-            t_dirn = os.sep.join(t_comp[:-1])
-            # If the output path doesn't exist, make it recursively
-            try:
-                os.makedirs(t_dirn)
-                logger.info("creating output directory %s", t_dirn)
-            except FileExistsError as e:
-                logger.debug(e)
-            t_dst = truncate_filename(
-                os.path.join(t_dirn, t_comp[-1] + '.toc'))
-            shutil.copy(self.tocfile, os.path.join(t_dirn, t_dst))
+            saveToc(self.contents, self.toc_path)
         os.unlink(self.tocfile)
         self.stop()
         return
 
 
+def saveToc(contents, toc_path):
+    """
+    Save a ``.toc`` file written by cdrdao next to the files of a rip.
+
+    :param contents: the ``.toc`` file
+    :type contents: bytes
+    :param toc_path: the path of the rip's files, without extension
+    :type toc_path: str
+    """
+    t_comp = os.path.abspath(toc_path).split(os.sep)
+    t_dirn = os.sep.join(t_comp[:-1])
+    # If the output path doesn't exist, make it recursively
+    try:
+        os.makedirs(t_dirn)
+        logger.info("creating output directory %s", t_dirn)
+    except FileExistsError as e:
+        logger.debug(e)
+    t_dst = truncate_filename(
+        os.path.join(t_dirn, t_comp[-1] + '.toc'))
+    with open(os.path.join(t_dirn, t_dst), 'wb') as f:
+        f.write(contents)
+
+
 def DetectCdr(device):
     """Whether cdrdao detects a CD-R for ``device``."""
     cmd = [CDRDAO, 'disk-info', '-v1', '--device', device]
@@ -177,7 +177,15 @@ def DetectCdr(device):
 
 
 def version():
-    """Return cdrdao version as a string."""
+    """
+    Return cdrdao version as a string.
+
+    cdrdao is only run again when its binary changes.
+    """
+    return cache.probeOnce(CDRDAO, 'version', _version)
+
+
+def _version():
     cdrdao = Popen(CDRDAO, stderr=PIPE)
     _, err = cdrdao.communicate()
     if cdrdao.returncode != 1:
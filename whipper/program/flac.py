@@ -1,20 +1,82 @@
-from subprocess import check_call, CalledProcessError
+import os
+from subprocess import check_call, CalledProcessError, Popen, PIPE
 
 import logging
 logger = logging.getLogger(__name__)
 
+# raw CD audio: 16-bit signed little-endian stereo samples at 44.1 kHz
+_RAW_FORMAT = ['--force-raw-format', '--endian=little', '--sign=signed',
+               '--channels=2', '--bps=16', '--sample-rate=44100']
 
-def encode(infile, outfile):
+
+def _deprioritize(pid, nice=0, cpus=None):
+    """Lower the CPU priority of a process, or restrict it to some cores."""
+    try:
+        if nice:
+            os.setpriority(os.PRIO_PROCESS, pid,
+                           os.getpriority(os.PRIO_PROCESS, 0) + nice)
+        if cpus:
+            os.sched_setaffinity(pid, cpus)
+    # the process may be gone already, or the platform can't do this
+    except (AttributeError, OSError) as e:
+        logger.debug('could not deprioritize flac: %r', e)
+
+
+def encode(infile, outfile, nice=0, cpus=None):
     """
     Encode infile to outfile, with flac.
 
+    Uses ``-f`` because whipper already creates the file.
+
+    :param nice: how much lower than whipper's the priority of flac is
+    :type nice: int
+    :param cpus: the cores flac may run on, or None for any
+    :type cpus: set(int) or None
+    """
+    # TODO: catch stderr and write it to logging
+    cmd = ['flac', '--silent', '--verify', '-o', outfile, '-f', infile]
+    popen = Popen(cmd)
+    _deprioritize(popen.pid, nice, cpus)
+    if popen.wait():
+        logger.error('flac failed')
+        raise CalledProcessError(popen.returncode, cmd)
+
+
+def decode(infile, outfile):
+    """
+    Decode infile to the WAV file outfile, with flac.
+
     Uses ``-f`` because whipper already creates the file.
     """
     try:
-        # TODO: Replace with Popen so that we can catch stderr and write it to
-        # logging
-        check_call(['flac', '--silent', '--verify', '-o', outfile,
-                    '-f', infile])
+        check_call(['flac', '--silent', '-d', '-o', outfile, '-f', infile])
     except CalledProcessError:
         logger.exception('flac failed')
         raise
+
+
+def decode_command(infile):
+    """
+    Return the flac command writing the raw CD audio of infile to stdout.
+
+    :param infile: path of the FLAC file to decode
+    :type infile: str
+    :rtype: list(str)
+    """
+    return ['flac', '--silent', '-d', '-c', '--force-raw-format',
+            '--endian=little', '--sign=signed', infile]
+
+
+def encoder(outfile):
+    """
+    Start a flac process encoding raw CD audio written to its stdin.
+
+    Uses ``-f`` because whipper already creates the file.
+
+    :param outfile: path to write the encoded file to
+    :type outfile: str
+    :returns: the running flac process
+    :rtype: subprocess.Popen
+    """
+    return Popen(['flac', '--silent', '--verify'] + _RAW_FORMAT +
+                 ['-o', outfile, '-f', '-'], stdin=PIPE)
@@ -0,0 +1,791 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_program_libcdio -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# This file is part of whipper.
+#
+# whipper is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whipper is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whipper.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read audio in-process through libcdio-paranoia.
+
+This is an alternative to running the cd-paranoia program: sectors are
+handed to the caller as buffers and paranoia callbacks are reported as
+events instead of being parsed from cd-paranoia's stderr.
+
+Besides drives, BIN/CUE images can be opened by passing the path to the
+.cue file as device.
+"""
+
+import copy
+import ctypes
+import ctypes.util
+import sys
+import time
+import wave
+from array import array
+
+from whipper.common import common
+from whipper.extern.task import task
+from whipper.program import cdparanoia
+
+import logging
+logger = logging.getLogger(__name__)
+
+# paranoia_mode_t flags, from cdio/paranoia/paranoia.h
+PARANOIA_MODE_DISABLE = 0x00
+PARANOIA_MODE_FULL = 0xff
+PARANOIA_MODE_NEVERSKIP = 0x20
+# what cd-paranoia uses unless told otherwise
+PARANOIA_MODE_DEFAULT = PARANOIA_MODE_FULL ^ PARANOIA_MODE_NEVERSKIP
+
+# paranoia_cb_mode_t values, named the way cd-paranoia prints them
+CALLBACKS = ('read', 'verify', 'jitter', 'correction', 'scratch',
+             'scratch repair', 'skip', 'drift', 'backoff', 'overlap',
+             'dropped', 'duped', 'transport error', 'cache error')
+
+_SEEK_SET = 0
+_CDDA_MESSAGE_FORGETIT = 0
+# cd-paranoia's default number of retries per sector
+_MAX_RETRIES = 20
+
+_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_long, ctypes.c_int)
+
+# READ CD arguments for audio sectors with their formatted Q sub-channel
+_CDDA_SECTOR = 1
+_SUBCHANNEL_Q = 2
+_Q_SIZE = 16
+_Q_SECTOR_SIZE = common.BYTES_PER_FRAME + _Q_SIZE
+# sectors read at once when looking for a position
+_Q_PROBE = 4
+_Q_RETRIES = 3
+# ISRC and MCN frames appear at least once in every 100 sectors
+_Q_ISRC_SECTORS = 100
+# sectors per READ CD command, to stay below common transfer limits
+_Q_BLOCKS = 25
+# 6-bit ISRC characters, from IEC 60908
+_ISRC_CHARACTERS = dict(
+    [(i, str(i)) for i in range(10)] +
+    [(0x11 + i, chr(ord('A') + i)) for i in range(26)])
+
+_libs = None
+
+
+class LibraryError(Exception):
+    """libcdio could not open or read the device."""
+
+
+def _load():
+    """
+    Load the libcdio libraries and declare the functions we use.
+
+    :returns: the cdio, cdda and paranoia libraries
+    :rtype: tuple(ctypes.CDLL)
+    :raises ImportError: if a library cannot be found
+    """
+    global _libs
+    if _libs is not None:
+        return _libs
+
+    libs = []
+    for name in ('cdio', 'cdio_cdda', 'cdio_paranoia'):
+        path = ctypes.util.find_library(name)
+        if not path:
+            raise ImportError('cannot find lib%s' % name)
+        libs.append(ctypes.CDLL(path))
+    cdio, cdda, paranoia = libs
+
+    p = ctypes.c_void_p
+    for lib, name, restype, argtypes in [
+            (cdio, 'cdio_open', p, [ctypes.c_char_p, ctypes.c_int]),
+            (cdio, 'cdio_open_bincue', p, [ctypes.c_char_p]),
+            (cdio, 'cdio_destroy', None, [p]),
+            (cdda, 'cdio_cddap_identify_cdio', p,
+             [p, ctypes.c_int, ctypes.c_void_p]),
+            (cdda, 'cdio_cddap_open', ctypes.c_int, [p]),
+            (cdda, 'cdio_cddap_close_no_free_cdio', ctypes.c_int, [p]),
+            (cdda, 'cdio_cddap_disc_lastsector', ctypes.c_int32, [p]),
+            (paranoia, 'cdio_paranoia_init', p, [p]),
+            (paranoia, 'cdio_paranoia_free', None, [p]),
+            (paranoia, 'cdio_paranoia_modeset', None, [p, ctypes.c_int]),
+            (paranoia, 'cdio_paranoia_seek', ctypes.c_int32,
+             [p, ctypes.c_int32, ctypes.c_int]),
+            (paranoia, 'cdio_paranoia_read_limited', p,
+             [p, _CALLBACK, ctypes.c_int])]:
+        f = getattr(lib, name)
+        f.restype = restype
+        f.argtypes = argtypes
+
+    _libs = cdio, cdda, paranoia
+    return _libs
+
+
+def available():
+    """
+    Return whether the libcdio-paranoia libraries can be used.
+
+    :rtype: bool
+    """
+    try:
+        _load()
+    except (ImportError, OSError, AttributeError) as e:
+        logger.debug('libcdio not available: %r', e)
+        return False
+    return True
+
+
+def getVersion():
+    """
+    Return the version of libcdio in use.
+
+    :rtype: str or None
+    """
+    try:
+        cdio = _load()[0]
+        return ctypes.c_char_p.in_dll(cdio,
+                                      'cdio_version_string').value.decode()
+    except (ImportError, OSError, ValueError, AttributeError) as e:
+        logger.debug('could not get libcdio version: %r', e)
+        return None
+
+
+def _bcd(value):
+    return (value >> 4) * 10 + (value & 0x0f)
+
+
+class QFrame:
+    """
+    The Q sub-channel of a sector.
+
+    :cvar adr: the mode of the frame: 1 for a position, 2 for the MCN and
+               3 for an ISRC
+    :cvar control: the control bits; 0x1 is set for pre-emphasis
+    :cvar track: the track number, for positions
+    :cvar index: the index number, for positions
+    :cvar absolute: the sector the frame belongs to, for positions
+    :cvar mcn: the media catalog number, for ADR 2
+    :cvar isrc: the ISRC, for ADR 3
+    """
+
+    adr = None
+    control = None
+    track = None
+    index = None
+    absolute = None
+    mcn = None
+    isrc = None
+
+    def __init__(self, data):
+        """
+        Parse the formatted Q sub-channel returned by READ CD.
+
+        :param data: the 16 bytes of the formatted Q sub-channel
+        :type data: bytes
+        """
+        self.control = data[0] >> 4
+        self.adr = data[0] & 0x0f
+        if self.adr == 1:
+            self.track = _bcd(data[1])
+            self.index = _bcd(data[2])
+            # absolute time counts from the start of the 150 sector
+            # pre-gap of track 1
+            self.absolute = ((_bcd(data[7]) * 60 + _bcd(data[8])) *
+                             common.FRAMES_PER_SECOND + _bcd(data[9]) - 150)
+        elif self.adr == 2:
+            digits = ''.join('%02x' % b for b in data[1:8])
+            self.mcn = digits[:13]
+        elif self.adr == 3:
+            bits = int.from_bytes(data[1:5], 'big') >> 2
+            chars = [_ISRC_CHARACTERS.get((bits >> shift) & 0x3f, '?')
+                     for shift in (24, 18, 12, 6, 0)]
+            digits = ''.join('%02x' % b for b in data[5:9])
+            self.isrc = ''.join(chars) + digits[:7]
+
+    @property
+    def position(self):
+        return self.track, self.index
+
+
+def getSectorRange(start, stop, offset=0):
+    """
+    Return the sectors to read for a range of frames and a read offset.
+
+    :param start: first frame to rip
+    :type start: int
+    :param stop: last frame to rip (inclusive)
+    :type stop: int
+    :param offset: read offset, in samples
+    :type offset: int
+    :returns: first sector, last sector (inclusive) and the number of bytes
+              to drop from the first sector
+    :rtype: tuple(int, int, int)
+    """
+    begin = start * common.BYTES_PER_FRAME + offset * 4
+    end = (stop + 1) * common.BYTES_PER_FRAME + offset * 4
+    first, skip = divmod(begin, common.BYTES_PER_FRAME)
+    last = (end - 1) // common.BYTES_PER_FRAME
+    return first, last, skip
+
+
+class Reader:
+    """
+    A drive or BIN/CUE image opened for paranoid reading.
+
+    Can be used as a context manager, which closes it on exit.
+
+    :ivar lastsector: the last audio sector on the disc
+    :vartype lastsector: int
+    """
+
+    def __init__(self, device=None, mode=PARANOIA_MODE_DEFAULT,
+                 retries=_MAX_RETRIES):
+        """
+        Open the given device or image.
+
+        :param device: the device or the .cue file to read from; None
+                       for the default device
+        :type device: str or None
+        :param mode: paranoia mode flags
+        :type mode: int
+        :param retries: number of retries per sector before skipping
+        :type retries: int
+        """
+        self._cdio, self._cdda, self._lib = _load()
+        self._retries = retries
+        self._callback = None
+        self._drive = None
+        self._paranoia = None
+        # keep a reference, the library calls it while reading
+        self._c_callback = _CALLBACK(self._onCallback)
+
+        source = device and device.encode()
+        if device and device.lower().endswith('.cue'):
+            self._handle = self._cdio.cdio_open_bincue(source)
+        else:
+            self._handle = self._cdio.cdio_open(source, 0)
+        if not self._handle:
+            raise LibraryError('could not open %r' % device)
+
+        self._drive = self._cdda.cdio_cddap_identify_cdio(
+            self._handle, _CDDA_MESSAGE_FORGETIT, None)
+        if not self._drive or self._cdda.cdio_cddap_open(self._drive):
+            self.close()
+            raise LibraryError('%r is not an audio CD' % device)
+
+        self._paranoia = self._lib.cdio_paranoia_init(self._drive)
+        self._lib.cdio_paranoia_modeset(self._paranoia, mode)
+        self.lastsector = self._cdda.cdio_cddap_disc_lastsector(
+            self._drive)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._paranoia:
+            self._lib.cdio_paranoia_free(self._paranoia)
+            self._paranoia = None
+        if self._drive:
+            self._cdda.cdio_cddap_close_no_free_cdio(self._drive)
+            self._drive = None
+        if self._handle:
+            self._cdio.cdio_destroy(self._handle)
+            self._handle = None
+
+    def _onCallback(self, wordOffset, function):
+        if self._callback and 0 <= function < len(CALLBACKS):
+            self._callback(CALLBACKS[function], wordOffset)
+
+    def read(self, start, stop, offset=0, callback=None, overread=False):
+        """
+        Read the given frames, one sector at a time.
+
+        Sectors outside of the disc are returned as silence, like
+        cd-paranoia does.  With overread, sectors past the last one are
+        read from the lead-out instead.
+
+        :param start: first frame to rip
+        :type start: int
+        :param stop: last frame to rip (inclusive)
+        :type stop: int
+        :param offset: read offset, in samples
+        :type offset: int
+        :param callback: called with the name of each paranoia callback
+                         and its offset in words, as well as with ``wrote``
+                         after each sector is returned
+        :type callback: callable or None
+        :param overread: whether to read into the lead-out
+        :type overread: bool
+        :returns: a generator of little-endian 16-bit stereo audio data
+        :rtype: generator(bytes)
+        """
+        first, last, skip = getSectorRange(start, stop, offset)
+        size = (stop - start + 1) * common.BYTES_PER_FRAME
+        readable = last if overread else min(last, self.lastsector)
+        silence = bytes(common.BYTES_PER_FRAME)
+
+        if max(first, 0) <= readable:
+            self._lib.cdio_paranoia_seek(self._paranoia, max(first, 0),
+                                         _SEEK_SET)
+
+        self._callback = callback
+        try:
+            for sector in range(first, last + 1):
+                if 0 <= sector <= readable:
+                    buf = self._lib.cdio_paranoia_read_limited(
+                        self._paranoia, self._c_callback, self._retries)
+                    if not buf:
+                        raise LibraryError('could not read sector %d' %
+                                           sector)
+                    data = ctypes.string_at(buf, common.BYTES_PER_FRAME)
+                    if sys.byteorder == 'big':
+                        samples = array('h', data)
+                        samples.byteswap()
+                        data = samples.tobytes()
+                else:
+                    data = silence
+
+                if skip:
+                    data = data[skip:]
+                    skip = 0
+                data = data[:size]
+                size -= len(data)
+
+                if callback:
+                    callback('wrote',
+                             (sector + 1) * common.WORDS_PER_FRAME - 1)
+                yield data
+        finally:
+            self._callback = None
+
+
+class ReadTrackTask(task.Task):
+    """
+    Task that reads a track using libcdio-paranoia.
+
+    It takes the same arguments as
+    :any:`whipper.program.cdparanoia.ReadTrackTask` and sets the same
+    attributes when done.
+    """
+
+    description = "Reading track"
+    quality = None  # set at end of reading
+    readCounts = None  # read count of each frame, set at end of reading
+    speed = None
+    duration = None  # in seconds
+
+    _MAXERROR = 100  # number of transport errors before giving up
+    _SECTORS = 75  # sectors read before handing control back to the runner
+
+    def __init__(self, path, table, start, stop, overread, offset=0,
+                 device=None, action="Reading", what="track", sinks=None,
+                 paranoia=True):
+        """
+        Read the given track.
+
+        :param path: where to store the ripped track; None when streaming
+        :type path: str or None
+        :param table: table of contents of CD; unused, frames are absolute
+        :type table: table.Table
+        :param start: first frame to rip
+        :type start: int
+        :param stop: last frame to rip (inclusive); >= start
+        :type stop: int
+        :param offset: read offset, in samples
+        :type offset: int
+        :param device: the device or .cue file to rip from
+        :type device: str
+        :param action: a string representing the action; e.g. Read/Verify
+        :type action: str
+        :param what: a string representing what's being read; e.g. Track
+        :type what: str
+        :param sinks: objects to stream the audio data to
+        :type sinks: list or None
+        :param paranoia: whether to verify the data read; without it every
+                         sector is read only once
+        :type paranoia: bool
+        """
+        if not sinks:
+            assert isinstance(path, str), "%r is not str" % path
+
+        self.path = path
+        self._start = start
+        self._stop = stop
+        self._offset = offset
+        self._overread = overread
+        self._device = device
+        self._mode = paranoia and PARANOIA_MODE_DEFAULT or \
+            PARANOIA_MODE_DISABLE
+        self._parser = cdparanoia.ProgressParser(start, stop)
+        self._sinks = sinks or []
+        self._start_time = None
+        self._reader = None
+        self._sectors = None
+        self._wav = None
+        self._size = 0
+        self.description = "%s %s" % (action, what)
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        logger.debug('ripping from %d to %d (inclusive) with libcdio',
+                     self._start, self._stop)
+        try:
+            self._reader = Reader(self._device, mode=self._mode)
+        except (ImportError, OSError, AttributeError) as e:
+            logger.debug('could not load libcdio: %r', e)
+            raise common.MissingDependencyException('libcdio-paranoia')
+
+        if self.path:
+            self._wav = wave.open(self.path, 'wb')
+            self._wav.setnchannels(2)
+            self._wav.setsampwidth(2)
+            self._wav.setframerate(44100)
+
+        self._sectors = self._reader.read(self._start, self._stop,
+                                          self._offset, self._event,
+                                          self._overread)
+        self._start_time = time.time()
+        self.schedule(0, self._read, runner)
+
+    def _event(self, function, wordOffset):
+        self._parser.event(function, wordOffset)
+        if function == 'transport error':
+            self._parser.errors += 1
+
+    def _read(self, runner):
+        count = 0
+        try:
+            for _, data in zip(range(self._SECTORS), self._sectors):
+                count += 1
+                self._size += len(data)
+                if self._wav:
+                    self._wav.writeframesraw(data)
+                for sink in self._sinks:
+                    sink.update(data)
+                if self._parser.errors > self._MAXERROR:
+                    raise LibraryError('%d transport errors' %
+                                       self._parser.errors)
+        # FIXME: catching too general exception (Exception)
+        except Exception as e:
+            logger.debug('exception while reading: %r', e)
+            self._close()
+            self.setException(e)
+            self.stop()
+            return
+
+        if count < self._SECTORS:
+            self._done()
+            return
+
+        num = self._parser.wrote - self._start + 1
+        den = self._stop - self._start + 1
+        self.setProgress(min(float(num) / float(den), 0.99))
+        self.schedule(0, self._read, runner)
+
+    def _close(self):
+        if self._wav:
+            self._wav.close()
+            self._wav = None
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+    def _done(self):
+        end_time = time.time()
+        self._close()
+        self.setProgress(1.0)
+
+        for sink in self._sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+        frames = self._stop - self._start + 1
+        expected = frames * common.BYTES_PER_FRAME
+        if self._size != expected:
+            self.setException(cdparanoia.FileSizeError(
+                self.path, "Read %d bytes instead of %d" % (
+                    self._size, expected)))
+
+        # without paranoia each frame is read once, there is no quality
+        if self._mode != PARANOIA_MODE_DISABLE:
+            self.quality = self._parser.getTrackQuality()
+            self.readCounts = self._parser.getReadCounts()
+        self.duration = end_time - self._start_time
+        self.speed = (frames / 75.0) / self.duration
+
+        self.stop()
+
+
+class SubchannelReader:
+    """
+    A drive opened for reading the Q sub-channel of audio sectors.
+
+    Can be used as a context manager, which closes it on exit.
+    """
+
+    def __init__(self, device, lastsector):
+        """
+        Open the given device.
+
+        :param device: the device to read from; None for the default device
+        :type device: str or None
+        :param lastsector: the last sector that can be read
+        :type lastsector: int
+        """
+        self._cdio = _load()[0]
+        p = ctypes.c_void_p
+        f = self._cdio.mmc_read_cd
+        f.restype = ctypes.c_int
+        f.argtypes = [p, p, ctypes.c_int32, ctypes.c_int, ctypes.c_bool,
+                      ctypes.c_bool, ctypes.c_uint8, ctypes.c_bool,
+                      ctypes.c_bool, ctypes.c_uint8, ctypes.c_uint8,
+                      ctypes.c_uint16, ctypes.c_uint32]
+        self.lastsector = lastsector
+        self._positions = {}
+        self._handle = self._cdio.cdio_open(device and device.encode(), 0)
+        if not self._handle:
+            raise LibraryError('could not open %r' % device)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._handle:
+            self._cdio.cdio_destroy(self._handle)
+            self._handle = None
+
+    def read(self, sector, count):
+        """
+        Read the Q sub-channel of consecutive sectors.
+
+        :param sector: the first sector
+        :type sector: int
+        :param count: the number of sectors
+        :type count: int
+        :rtype: list(QFrame)
+        """
+        buf = ctypes.create_string_buffer(count * _Q_SECTOR_SIZE)
+        if self._cdio.mmc_read_cd(self._handle, buf, sector, _CDDA_SECTOR,
+                                  False, False, 0, True, False, 0,
+                                  _SUBCHANNEL_Q, _Q_SECTOR_SIZE, count):
+            raise LibraryError('could not read the sub-channel of sectors '
+                               '%d to %d' % (sector, sector + count - 1))
+        data = buf.raw
+        return [QFrame(data[i * _Q_SECTOR_SIZE + common.BYTES_PER_FRAME:
+                            (i + 1) * _Q_SECTOR_SIZE])
+                for i in range(count)]
+
+    def position(self, sector):
+        """
+        Return the track and index a sector belongs to.
+
+        Frames holding an MCN or ISRC instead of a position take the
+        position of the next frame.
+
+        :param sector: the sector
+        :type sector: int
+        :rtype: tuple(int, int)
+        :raises LibraryError: when no position could be read
+        """
+        if sector not in self._positions:
+            count = max(1, min(_Q_PROBE, self.lastsector - sector + 1))
+            for _ in range(_Q_RETRIES):
+                frames = self.read(sector, count)
+                # drives may return the sub-channel of other sectors
+                found = [q for i, q in enumerate(frames)
+                         if q.adr == 1 and q.absolute == sector + i]
+                if found:
+                    self._positions[sector] = found[0].position
+                    break
+            else:
+                raise LibraryError('no position in the sub-channel of '
+                                   'sector %d' % sector)
+        return self._positions[sector]
+
+    def codes(self, sector, count):
+        """
+        Look for the MCN and an ISRC in the sub-channel of some sectors.
+
+        :param sector: the first sector
+        :type sector: int
+        :param count: the number of sectors
+        :type count: int
+        :returns: the MCN and the ISRC, if found
+        :rtype: tuple(str or None, str or None)
+        """
+        mcn = None
+        isrc = None
+        count = min(count, self.lastsector - sector + 1)
+        for first in range(sector, sector + count, _Q_BLOCKS):
+            for q in self.read(first, min(_Q_BLOCKS,
+                                          sector + count - first)):
+                mcn = q.mcn or mcn
+                isrc = q.isrc or isrc
+        return mcn, isrc
+
+
+def findBoundary(position, low, high, wanted):
+    """
+    Find where a position on the disc starts.
+
+    Positions only go up over the disc, so the boundary is searched for
+    backwards from ``high`` in growing steps, then halving them.  Pre-gaps
+    are short, so this takes few reads.
+
+    :param position: returns the (track, index) of a sector
+    :type position: callable
+    :param low: a sector before the wanted position
+    :type low: int
+    :param high: a sector at or after the wanted position
+    :type high: int
+    :param wanted: the (track, index) to find the start of
+    :type wanted: tuple(int, int)
+    :returns: the first sector at or after the wanted position
+    :rtype: int
+    """
+    step = 1
+    while high - step > low:
+        if position(high - step) < wanted:
+            low = high - step
+            break
+        high -= step
+        step *= 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        if position(middle) < wanted:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+class ReadIndexesTask(task.Task):
+    """
+    Task that reads the full table of contents of a disc through libcdio.
+
+    This is an alternative to the full TOC read of cdrdao, which reads the
+    sub-channel of the whole disc: starting from the fast table of
+    contents, only the sub-channel around the boundaries of the tracks is
+    read to find their pre-gaps and other indexes, and a hundred sectors
+    of each track for its ISRC.
+
+    :ivar table: the full table of contents, like the one of
+                 :any:`whipper.image.toc.TocFile`
+    :vartype table: whipper.image.table.Table
+    """
+
+    description = "Reading indexes"
+    table = None
+
+    def __init__(self, device, ittoc):
+        """
+        Read the indexes of the disc in ``device``.
+
+        :param device: the device to read from
+        :type device: str
+        :param ittoc: the fast table of contents of the disc
+        :type ittoc: whipper.image.table.Table
+        """
+        self._device = device
+        self._ittoc = ittoc
+        self._reader = None
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        self.table = copy.deepcopy(self._ittoc)
+        try:
+            self._reader = SubchannelReader(self._device,
+                                            self.table.leadout - 1)
+        except (ImportError, OSError, AttributeError) as e:
+            logger.debug('could not load libcdio: %r', e)
+            raise common.MissingDependencyException('libcdio')
+
+        # a hidden track before track 1 is its pre-gap
+        first = self.table.tracks[0].getIndex(1)
+        self._start = first.absolute
+        if self._start:
+            self.table.tracks[0].index(0, absolute=0, relative=0,
+                                       counter=0)
+        self._path = first.path
+        self._counter = first.counter
+        self.schedule(0, self._read, runner, 0)
+
+    def _index(self, track, number, absolute):
+        # relative to the first audio, like cdrdao after a SILENCE
+        track.index(number, absolute=absolute, path=self._path,
+                    relative=absolute - self._start, counter=self._counter)
+        logger.debug('track %d index %d at %d', track.number, number,
+                     absolute)
+
+    def _read(self, runner, i):
+        try:
+            self._readTrack(i)
+        except Exception:
+            self._close()
+            raise
+
+        self.setProgress(float(i + 1) / len(self.table.tracks))
+        if i + 1 < len(self.table.tracks):
+            self.schedule(0, self._read, runner, i + 1)
+        else:
+            self._close()
+            self.stop()
+
+    def _readTrack(self, i):
+        tracks = self.table.tracks
+        track = tracks[i]
+        if not track.audio:
+            return
+        position = self._reader.position
+
+        for number, index in list(track.indexes.items()):
+            if number:
+                self._index(track, number, index.absolute)
+
+        start = track.getIndex(1).absolute
+        end = self.table.getTrackEnd(track.number)
+        following = i + 1 < len(tracks) and tracks[i + 1]
+        if following and following.audio:
+            nextStart = following.getIndex(1).absolute
+            wanted = (following.number, 0)
+            pregap = findBoundary(position, start, nextStart, wanted)
+            if pregap < nextStart:
+                self._index(following, 0, pregap)
+                end = pregap - 1
+
+        # indexes after 01 are rare, but then the track ends in the last
+        lastTrack, lastIndex = position(end)
+        if lastTrack == track.number:
+            for number in range(2, lastIndex + 1):
+                self._index(track, number,
+                            findBoundary(position, start, end,
+                                         (track.number, number)))
+
+        mcn, isrc = self._reader.codes(start, min(_Q_ISRC_SECTORS,
+                                                  end - start + 1))
+        if isrc:
+            track.isrc = isrc
+        if mcn and not self.table.catalog:
+            self.table.catalog = mcn
+
+    def _close(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
@@ -1,7 +1,10 @@
 import os
+import wave
+from concurrent.futures import ThreadPoolExecutor
 
 from whipper.common import common
 from whipper.common import task as ctask
+from whipper.extern.task import task
 
 import logging
 logger = logging.getLogger(__name__)
@@ -9,6 +12,98 @@ logger = logging.getLogger(__name__)
 SOXI = 'soxi'
 
 
+def _streamInfo(f):
+    start = 0
+    header = f.read(10)
+    if header[:3] == b'ID3':
+        # skip an ID3v2 tag; its size is stored in 7-bit bytes
+        for b in header[6:10]:
+            start = start << 7 | (b & 0x7f)
+        start += 10
+    f.seek(start)
+    if f.read(4) != b'fLaC':
+        return None
+    # the first metadata block is always STREAMINFO
+    block = f.read(4 + 34)
+    if len(block) < 38 or block[0] & 0x7f != 0:
+        return None
+    return block[4:]
+
+
+def _flacLength(f):
+    info = _streamInfo(f)
+    if not info:
+        return None
+    # the sample rate, channels and bits per sample end with 36 bits of
+    # samples
+    samples = int.from_bytes(info[10:18], 'big') & ((1 << 36) - 1)
+    # 0 means the encoder did not know
+    return samples or None
+
+
+def getFlacMD5(path):
+    """
+    Read the MD5 sum of the audio stored in the header of a FLAC file.
+
+    :param path: path to a FLAC file
+    :type path: str
+    :returns: the MD5 sum as hex string; None if it is not a FLAC file or
+              the encoder did not store one
+    :rtype: str or None
+    """
+    with open(path, 'rb') as f:
+        info = _streamInfo(f)
+    if not info or not any(info[18:]):
+        return None
+    return info[18:].hex()
+
+
+def getLength(path):
+    """
+    Read the length of a FLAC or WAV file from its header.
+
+    :param path: path to audio track
+    :type path: str
+    :returns: length of the audio, in audio samples; None if it is not in
+              a FLAC or PCM WAV header
+    :rtype: int or None
+    """
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+            f.seek(0)
+            if magic == b'RIFF':
+                try:
+                    with wave.open(f) as w:
+                        return w.getnframes()
+                except (wave.Error, EOFError) as e:
+                    logger.debug('cannot read WAV header of %r: %r', path,
+                                 e)
+                    return None
+            return _flacLength(f)
+    except OSError as e:
+        logger.debug('cannot read header of %r: %r', path, e)
+        return None
+
+
+def getLengths(paths, workers=8):
+    """
+    Read the lengths of FLAC or WAV files from their headers, concurrently.
+
+    :param paths: paths to audio tracks
+    :type paths: list(str)
+    :param workers: how many files to read at once
+    :type workers: int
+    :returns: the length of each file, or None where it is not known from
+              its header
+    :rtype: list(int or None)
+    """
+    if len(paths) < 2:
+        return [getLength(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(getLength, paths))
+
+
 class AudioLengthTask(ctask.PopenTask):
     """
     Calculate the length of a track in audio samples.
@@ -32,11 +127,23 @@ class AudioLengthTask(ctask.PopenTask):
 
         self.logName = os.path.basename(path)
 
+        self.path = path
         self.command = [SOXI, '-s', path]
 
         self._error = []
         self._output = []
 
+    def start(self, runner):
+        self.length = getLength(self.path)
+        if self.length is None:
+            ctask.PopenTask.start(self, runner)
+            return
+
+        # known from the header, soxi is not needed
+        task.Task.start(self, runner)
+        self.setProgress(1.0)
+        self.schedule(0, self.stop)
+
     def commandMissing(self):
         raise common.MissingDependencyException('soxi')
 
@@ -38,8 +38,8 @@ class WhipperLogger(result.Logger):
 
         data["Drive"] = "%s%s (revision %s)" % (
             ripResult.vendor, ripResult.model, ripResult.release)
-        data["Extraction engine"] = "cdparanoia %s" % (
-            ripResult.cdparanoiaVersion)
+        data["Extraction engine"] = "%s %s" % (
+            ripResult.engine, ripResult.cdparanoiaVersion)
         data["Defeat audio cache"] = ripResult.cdparanoiaDefeatsCache
         data["Read offset correction"] = ripResult.offset
 
@@ -48,7 +48,8 @@ class WhipperLogger(result.Logger):
         data["Overread into lead-out"] = True if ripResult.overread else False
         # Next one fully works only using the patched cdparanoia package
         # lines.append("Fill up missing offset samples with silence: true")
-        data["Gap detection"] = "cdrdao %s" % ripResult.cdrdaoVersion
+        data["Gap detection"] = (ripResult.gapDetection or
+                                 "cdrdao %s" % ripResult.cdrdaoVersion)
 
         data["CD-R detected"] = ripResult.isCdr
         riplog["Ripping phase information"] = data
@@ -219,6 +220,12 @@ class WhipperLogger(result.Logger):
             track["Extraction quality"] = "%.2f %%" % (
                 trackResult.quality * 100.0, )
 
+        # Where frames had to be read again, by second
+        if trackResult.rereads:
+            track["Rereads"] = OrderedDict(
+                (common.framesToMSF(frame), extra)
+                for frame, extra in trackResult.rereads)
+
         # Ripper Test CRC
         if trackResult.testcrc is not None:
             track["Test CRC"] = "%08X" % trackResult.testcrc
@@ -253,6 +260,9 @@ class WhipperLogger(result.Logger):
         # Check if Test & Copy CRCs are equal
         elif trackResult.testcrc == trackResult.copycrc:
             track["Status"] = "Copy OK"
+        # Tracks read once are only kept if AccurateRip matched
+        elif trackResult.testcrc is None and ARDB_match:
+            track["Status"] = "Copy OK (no test pass, AccurateRip match)"
         else:
             self._errors = True
             track["Status"] = "Error, CRC mismatch"
@@ -29,6 +29,9 @@ class TrackResult:
     pre_emphasis = None
     peak = 0
     quality = 0.0
+    # (first frame, extra reads) for each second of the track that needed
+    # rereading
+    rereads = None
     testspeed = 0.0
     copyspeed = 0.0
     testduration = 0.0
@@ -81,7 +84,10 @@ class RipResult:
     :cvar model: model of the CD drive
     :cvar release: release of the CD drive
     :cvar cdrdaoVersion: version of cdrdao used for the rip
-    :cvar cdparanoiaVersion: version of cdparanoia used for the rip
+    :cvar gapDetection: what found the pre-gaps and indexes, with its
+                        version, when it was not cdrdao
+    :cvar engine: what the audio was read with
+    :cvar cdparanoiaVersion: version of the engine used for the rip
     """
 
     offset = 0
@@ -98,6 +104,8 @@ class RipResult:
     release = None
 
     cdrdaoVersion = None
+    gapDetection = None
+    engine = 'cdparanoia'
     cdparanoiaVersion = None
     cdparanoiaDefeatsCache = None
 
@@ -0,0 +1,88 @@
+# vi:si:et:sw=4:sts=4:ts=4:set fileencoding=utf-8
+"""Tests for whipper.command.image"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from whipper.command import image
+from whipper.test import common
+
+
+class FindCueFilesTestCase(common.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path in ('b/disc.cue', 'a/2/disc.CUE', 'a/1/disc.cue',
+                     'a/1/disc.log'):
+            path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testRecursesInOrder(self):
+        found = image.findCueFiles([self.root, 'other.cue'])
+        self.assertEqual(
+            [os.path.relpath(p, self.root) for p in found[:-1]],
+            ['a/1/disc.cue', 'a/2/disc.CUE', 'b/disc.cue'])
+        self.assertEqual(found[-1], 'other.cue')
+
+
+class ReadStateTestCase(common.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.whipper.state')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def testReadState(self):
+        entry = {'cue': '/music/disc.cue', 'status': 'verified',
+                 'tracks': [], 'error': None}
+        with open(self.path, 'w') as f:
+            f.write(json.dumps(entry) + '\n')
+            # cut short by an interrupted run
+            f.write('{"cue": "/music/oth')
+        self.assertEqual(image.readState(self.path),
+                         {'/music/disc.cue': entry})
+
+    def testMissingState(self):
+        self.assertEqual(image.readState(self.path + '.missing'), {})
+
+
+class PendingCueFilesTestCase(common.TestCase):
+
+    def testRetriesErrors(self):
+        done = {os.path.abspath(name + '.cue'): {'status': status}
+                for name, status in [('good', 'verified'),
+                                     ('bad', 'unverified'),
+                                     ('unknown', 'not found'),
+                                     ('offline', 'error')]}
+        cuePaths = ['good.cue', 'bad.cue', 'unknown.cue', 'offline.cue',
+                    'new.cue']
+        self.assertEqual(image.pendingCueFiles(cuePaths, done),
+                         ['offline.cue', 'new.cue'])
+
+
+def _verifyImage(cuePath, workers=None, arCache=None, verbose=True):
+    return {'cue': cuePath, 'status': 'verified', 'tracks': [],
+            'error': None}
+
+
+class VerifyJobsTestCase(common.TestCase):
+
+    def testJobs(self):
+        verify = image.Verify.__new__(image.Verify)
+        verify.options = argparse.Namespace(jobs=2, workers=None)
+        cuePaths = ['%d.cue' % i for i in range(7)]
+        with mock.patch.object(image, 'verifyImage', _verifyImage), \
+                mock.patch('sys.stdout', new_callable=io.StringIO):
+            entries = list(verify._verify(cuePaths, None))
+        self.assertEqual(sorted(e['cue'] for e in entries), cuePaths)
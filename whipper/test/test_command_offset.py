@@ -0,0 +1,31 @@
+# vi:si:et:sw=4:sts=4:ts=4:set fileencoding=utf-8
+"""Tests for whipper.command.offset"""
+
+from unittest import mock
+
+from whipper.command import offset
+from whipper.extern.task import task
+from whipper.program import cdparanoia
+from whipper.test import common
+
+
+class ReadMatchesTestCase(common.TestCase):
+
+    def testFailedReadIsSplit(self):
+        reads = []
+
+        def matches(runner, table, track, offsets, responses):
+            reads.append(list(offsets))
+            # the drive cannot read with the lowest offset
+            if -1164 in offsets:
+                raise task.TaskException(cdparanoia.FileSizeError(
+                    'track.wav', 'bad size'))
+            return [o for o in offsets if o in (6, 48)]
+
+        find = offset.Find.__new__(offset.Find)
+        with mock.patch.object(find, '_matches', matches):
+            matched = find._readMatches(None, None, 1,
+                                        [48, -1164, 6, 667, 0], [])
+        self.assertEqual(matched, [48, 6])
+        self.assertEqual(reads[0], [48, -1164, 6, 667, 0])
+        self.assertIn([-1164], reads)
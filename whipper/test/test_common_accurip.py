@@ -1,14 +1,22 @@
 # -*- Mode: Python; test-case-name: whipper.test.test_common_accurip -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
+import os
 import sys
+import wave
 from io import StringIO
 from os.path import dirname, join
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp, mkstemp
 from unittest import TestCase
 
 from whipper.common.accurip import (
-    calculate_checksums, get_db_entry, print_report, verify_result,
-    _split_responses, EntryNotFound
+    calculate_checksums, get_db_entry, match_track, print_report,
+    verify_result, _split_responses, EntryNotFound
+)
+from whipper.program.arc import (
+    accuraterip_buffer, accuraterip_checksum, accuraterip_sink,
+    accuraterip_window
 )
 from whipper.result.result import RipResult, TrackResult
 
@@ -25,6 +33,16 @@ class TestAccurateRipResponse(TestCase):
         with self.assertRaises(EntryNotFound):
             get_db_entry('definitely_a_404')
 
+    def test_uses_kept_entry(self):
+        cache = mkdtemp()
+        self.addCleanup(rmtree, cache)
+        os.makedirs(join(cache, dirname(self.path)))
+        copyfile(join(dirname(__file__), self.path[6:]),
+                 join(cache, self.path))
+        responses = get_db_entry(self.path, cache=cache)
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(responses[0].checksums[0], '284fc705')
+
     def test_AccurateRipResponse_parses_correctly(self):
         responses = get_db_entry(self.path)
         self.assertEqual(len(responses), 2)
@@ -47,7 +65,43 @@ class TestAccurateRipResponse(TestCase):
         self.assertEqual(responses[1].checksums[0], 'dc77f9ab')
         self.assertEqual(responses[1].checksums[1], 'dd97d2c3')
 
-# XXX: test arc.py
+
+class TestArc(TestCase):
+    def setUp(self):
+        # a bit more than the ten sectors skipped on a single track disc
+        self.data = bytes(range(7, 256)) * 500
+        fd, self.path = mkstemp(suffix='.whipper.wav')
+        os.close(fd)
+        with wave.open(self.path, 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(44100)
+            w.writeframes(self.data)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_sink_matches_file(self):
+        for number, total in ((1, 1), (1, 2), (2, 3), (3, 3)):
+            sink = accuraterip_sink(number, total)
+            # pieces that split samples
+            for i in range(0, len(self.data), 1001):
+                sink.update(memoryview(self.data)[i:i + 1001])
+            self.assertEqual(
+                sink.digest(),
+                accuraterip_checksum(self.path, number, total))
+
+    def test_window_matches_buffer(self):
+        length = 3000
+        for number, total in ((1, 3), (2, 3), (3, 3)):
+            checksums = accuraterip_window(self.data, number, total, length)
+            self.assertEqual(len(checksums),
+                             len(self.data) // 4 - length + 1)
+            for shift in (0, 1, 17, len(checksums) - 1):
+                window = self.data[shift * 4:(shift + length) * 4]
+                self.assertEqual(
+                    checksums[shift],
+                    accuraterip_buffer(window, number, total)[0])
 
 
 class TestCalculateChecksums(TestCase):
@@ -57,7 +111,41 @@ class TestCalculateChecksums(TestCase):
             {'v1': [None], 'v2': [None]}
         )
 
-    # TODO: test success when file exists
+    def test_keeps_track_order_with_workers(self):
+        fd, path = mkstemp(suffix='.whipper.wav')
+        os.close(fd)
+        try:
+            with wave.open(path, 'wb') as w:
+                w.setnchannels(2)
+                w.setsampwidth(2)
+                w.setframerate(44100)
+                w.writeframes(bytes(range(256)) * 1000)
+            paths = ['/does/not/exist', path, '/does/not/exist/either']
+            checksums = calculate_checksums(paths, workers=3)
+            self.assertEqual(checksums, calculate_checksums(paths, workers=1))
+            self.assertEqual(checksums['v1'][0::2], [None, None])
+            self.assertEqual(checksums['v1'][1], '%08x' % accuraterip_checksum(
+                path, 2, 3)[0])
+        finally:
+            os.unlink(path)
+
+
+class TestMatchTrack(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = 'dBAR-002-0000f21c-00027ef8-05021002.bin'
+        with open(join(dirname(__file__), path), 'rb') as f:
+            cls.responses = _split_responses(f.read())
+
+    def test_highest_confidence_of_either_version(self):
+        self.assertEqual(match_track(self.responses, 1, {
+            'v1': '284fc705', 'v2': 'dc77f9ab'}), 12)
+        self.assertEqual(match_track(self.responses, 2, {
+            'v1': None, 'v2': 'dd97d2c3'}), 7)
+
+    def test_no_match(self):
+        self.assertEqual(match_track(self.responses, 1, {
+            'v1': '9cc1f32e', 'v2': None}), 0)
 
 
 class TestVerifyResult(TestCase):
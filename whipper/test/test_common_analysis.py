@@ -0,0 +1,58 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_analysis -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import binascii
+import hashlib
+import os
+import struct
+import tempfile
+import wave
+
+from whipper.common import analysis
+from whipper.extern.task import task
+from whipper.test import common
+
+
+class AnalyzerTestCase(common.TestCase):
+
+    def setUp(self):
+        self.data = struct.pack('<4h', 3, -1200, 32767, -32768) * 1000
+
+    def testPieces(self):
+        analyzer = analysis.Analyzer()
+        # pieces that split samples
+        for i in range(0, len(self.data), 999):
+            analyzer.update(self.data[i:i + 999])
+        result = analyzer.result()
+
+        self.assertEqual(result.checksum, binascii.crc32(self.data))
+        self.assertEqual(result.peak, 32768)
+        self.assertEqual(result.md5, hashlib.md5(self.data).hexdigest())
+        self.assertEqual(result.length, len(self.data))
+        # the position of the track on the disc is unknown
+        self.assertIsNone(result.v1)
+
+
+class AnalyzeTaskTestCase(common.TestCase):
+
+    def setUp(self):
+        self.data = struct.pack('<2h', 100, -5000) * 50000
+        fd, self.path = tempfile.mkstemp(suffix='.whipper.wav')
+        os.close(fd)
+        with wave.open(self.path, 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(44100)
+            w.writeframes(self.data)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def testWave(self):
+        t = analysis.AnalyzeTask(self.path, frames=True)
+        task.SyncRunner(verbose=False).run(t)
+
+        self.assertEqual(t.checksum, binascii.crc32(self.data))
+        self.assertEqual(t.peak, 5000)
+        self.assertEqual(t.analysis.md5, hashlib.md5(self.data).hexdigest())
+        self.assertEqual(len(t.frames), len(self.data) // 2352)
@@ -0,0 +1,101 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_cache -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from whipper.common import cache
+from whipper.image import toc
+
+from whipper.test import common
+
+
+class TocCacheTestCase(common.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        path = os.path.join(os.path.dirname(__file__), 'capital.1.toc')
+        with open(path, 'rb') as f:
+            self.contents = f.read()
+        self.toc = toc.TocFile(path)
+        self.toc.parse()
+        self.table = self.toc.table
+        self.cache = cache.TocCache(self.directory)
+
+    def testRoundTrip(self):
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.put('key', self.contents, self.table)
+        contents, itable = self.cache.get('key')
+        self.assertEqual(contents, self.contents)
+        self.assertEqual(itable.getCDDBDiscId(), self.table.getCDDBDiscId())
+        self.assertEqual(len(itable.tracks), len(self.table.tracks))
+
+    @mock.patch('whipper.image.table.Table.getMusicBrainzDiscId',
+                return_value='1zK.CQJ4a4ruCn0pvsU5sSEQ0Xs-')
+    def testKeyDependsOnDrive(self, _):
+        self.assertNotEqual(
+            cache.TocCache.key(self.table, ('A', 'B', '1')),
+            cache.TocCache.key(self.table, ('A', 'C', '1')))
+
+    def testOutdated(self):
+        self.table.instanceVersion = self.table.classVersion - 1
+        self.cache.put('old', self.contents, self.table)
+        self.assertIsNone(self.cache.get('old'))
+        self.assertFalse(os.listdir(self.directory))
+
+    def testEvictsLeastRecentlyUsed(self):
+        self.cache.put('a', self.contents, self.table)
+        size = os.path.getsize(os.path.join(self.directory, 'a.pickle'))
+        self.cache.size = size * 2
+        os.utime(os.path.join(self.directory, 'a.pickle'), (1, 1))
+        self.cache.put('b', self.contents, self.table)
+        os.utime(os.path.join(self.directory, 'b.pickle'), (2, 2))
+        # using a makes b the least recently used
+        self.assertIsNotNone(self.cache.get('a'))
+        self.cache.put('c', self.contents, self.table)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+
+class ProbeCacheTestCase(common.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'probes.json')
+        self.calls = []
+
+    def _probe(self):
+        self.calls.append(None)
+        return '1.0'
+
+    def testRemembered(self):
+        self.assertEqual(cache.ProbeCache(self.path).get(
+            'sh', 'version', self._probe), '1.0')
+        # also by other commands
+        self.assertEqual(cache.ProbeCache(self.path).get(
+            'sh', 'version', self._probe), '1.0')
+        self.assertEqual(len(self.calls), 1)
+
+    def testBinaryChanged(self):
+        probes = cache.ProbeCache(self.path)
+        probes.get('sh', 'version', self._probe)
+        with mock.patch.object(cache.ProbeCache, '_binary',
+                               return_value=['/bin/sh', 1, 2, 3]):
+            probes.get('sh', 'version', self._probe)
+        self.assertEqual(len(self.calls), 2)
+
+    def testFailureNotRemembered(self):
+        probes = cache.ProbeCache(self.path)
+        self.assertIsNone(probes.get('sh', 'version', lambda: None))
+        self.assertEqual(probes.get('sh', 'version', self._probe), '1.0')
+
+    def testMissingProgram(self):
+        probes = cache.ProbeCache(self.path)
+        probes.get('whipper-no-such-program', 'version', self._probe)
+        probes.get('whipper-no-such-program', 'version', self._probe)
+        self.assertEqual(len(self.calls), 2)
@@ -0,0 +1,87 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_checksum -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import binascii
+import os
+import tempfile
+import wave
+
+from whipper.common import checksum
+from whipper.extern.task import task
+from whipper.test import common
+
+
+class CRC32TestCase(common.TestCase):
+
+    def testIncremental(self):
+        data = bytes(range(256)) * 100
+        crc = checksum.CRC32()
+        for i in range(0, len(data), 1000):
+            crc.update(data[i:i + 1000])
+
+        self.assertEqual(crc.checksum, binascii.crc32(data))
+
+
+class FrameCRC32TestCase(common.TestCase):
+
+    def testFrames(self):
+        frame = 2352
+        data = bytes(range(256)) * 30
+        frames = checksum.FrameCRC32()
+        for i in range(0, len(data), 1000):
+            frames.update(data[i:i + 1000])
+
+        # the incomplete last frame is not checksummed
+        self.assertEqual(list(frames.frames), [
+            binascii.crc32(data[i:i + frame])
+            for i in range(0, len(data) - frame + 1, frame)])
+
+
+class FrameVerifierTestCase(common.TestCase):
+
+    def setUp(self):
+        self.data = bytes(range(256)) * 92  # 10 frames and a bit
+        self.test = checksum.FrameCRC32()
+        self.test.update(self.data)
+
+    def testMatch(self):
+        verifier = checksum.FrameVerifier(self.test)
+        verifier.update(self.data)
+        self.assertEqual(verifier.mismatches, 0)
+
+    def testLimit(self):
+        bad = bytearray(self.data)
+        for frame in (1, 5):
+            bad[frame * 2352] ^= 0xff
+        verifier = checksum.FrameVerifier(self.test, limit=1)
+        verifier.update(bytes(bad[:4 * 2352]))
+        self.assertEqual(verifier.mismatches, 1)
+        self.assertRaises(checksum.ChecksumMismatch, verifier.update,
+                          bytes(bad[4 * 2352:]))
+
+
+class CRC32TaskTestCase(common.TestCase):
+
+    def setUp(self):
+        # a bit more than two chunks, ending in an incomplete frame
+        self.data = bytes(range(256)) * (
+            checksum._CHUNK * 2 // 256 + 100)
+        fd, self.path = tempfile.mkstemp(suffix='.whipper.wav')
+        os.close(fd)
+        with wave.open(self.path, 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(44100)
+            w.writeframes(self.data)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def testWave(self):
+        t = checksum.CRC32Task(self.path, frames=True)
+        task.SyncRunner(verbose=False).run(t)
+
+        self.assertEqual(t.checksum, binascii.crc32(self.data))
+        frames = checksum.FrameCRC32()
+        frames.update(self.data)
+        self.assertEqual(t.frames, frames.frames)
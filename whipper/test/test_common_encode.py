@@ -0,0 +1,51 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_encode -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import struct
+import threading
+
+from whipper.common import encode
+from whipper.test import common
+
+
+class PeakLevelTestCase(common.TestCase):
+
+    def testOddChunks(self):
+        data = struct.pack('<6h', 0, 100, -32768, 5, 32767, -3)
+        peak = encode.PeakLevel()
+        for i in range(0, len(data), 3):
+            peak.update(data[i:i + 3])
+
+        self.assertEqual(peak.peak, 32768)
+
+    def testSilence(self):
+        peak = encode.PeakLevel()
+        peak.update(b'\0' * 2352)
+
+        self.assertEqual(peak.peak, 0)
+
+
+class EncodePoolTestCase(common.TestCase):
+
+    def testBounded(self):
+        pool = encode.EncodePool(workers=1, waiting=1)
+        release = threading.Event()
+        running = []
+
+        def job(number):
+            running.append(number)
+            release.wait()
+            return number
+
+        futures = [pool.submit(job, 0), pool.submit(job, 1)]
+        # a third track has to wait until a worker is done with one
+        submitter = threading.Thread(
+            target=lambda: futures.append(pool.submit(job, 2)))
+        submitter.start()
+        submitter.join(0.1)
+        self.assertTrue(submitter.is_alive())
+
+        release.set()
+        submitter.join()
+        pool.shutdown()
+        self.assertEqual([f.result() for f in futures], [0, 1, 2])
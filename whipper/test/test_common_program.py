@@ -4,11 +4,15 @@
 
 import os
 import shutil
+import threading
 import unittest
 
 from tempfile import NamedTemporaryFile
-from whipper.common import program, mbngs, config
+from unittest import mock
+from whipper.common import accurip, program, mbngs, config
 from whipper.command.cd import DEFAULT_DISC_TEMPLATE
+from whipper.image import table
+from whipper.result import result
 
 
 class PathTestCase(unittest.TestCase):
@@ -44,6 +48,48 @@ class PathTestCase(unittest.TestCase):
 
 
 # TODO: Test cover art embedding too.
+class AccurateRipPositionTestCase(unittest.TestCase):
+
+    def testEnhancedCD(self):
+        prog = program.Program(config.Config())
+        prog.result = result.RipResult()
+        prog.result.table = table.Table([
+            table.Track(1), table.Track(2), table.Track(3, audio=False)])
+        self.assertEqual(prog.getAccurateRipPosition(0), (None, 2))
+        self.assertEqual(prog.getAccurateRipPosition(2), (2, 2))
+
+    def testMixedModeCD(self):
+        prog = program.Program(config.Config())
+        prog.result = result.RipResult()
+        prog.result.table = table.Table([
+            table.Track(1, audio=False), table.Track(2), table.Track(3)])
+        self.assertEqual(prog.getAccurateRipPosition(2), (1, 2))
+        self.assertEqual(prog.getAccurateRipPosition(3), (2, 2))
+
+
+class PrefetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = mock.Mock(spec=program.LookupCache)
+        self.prog = program.Program(config.Config(), cache=self.cache)
+        self.prog.accurateRipCache = '/cache/accuraterip'
+        self.ittoc = mock.Mock()
+        self.ittoc.getMusicBrainzDiscId.return_value = 'mbdiscid'
+        self.ittoc.accuraterip_path.return_value = 'path.bin'
+
+    def testAccurateRip(self):
+        self.prog.prefetch(self.ittoc)
+        self.cache.prefetch.assert_any_call(
+            ('accuraterip', 'path.bin'), accurip.get_db_entry, 'path.bin',
+            '/cache/accuraterip')
+
+    def testWithoutAccurateRip(self):
+        self.prog.prefetch(self.ittoc, accuraterip=False)
+        self.assertEqual([c[0][0][0] for c in
+                          self.cache.prefetch.call_args_list],
+                         ['musicbrainz'])
+
+
 class CoverArtTestCase(unittest.TestCase):
 
     @staticmethod
@@ -92,3 +138,56 @@ class CoverArtTestCase(unittest.TestCase):
         release_id = "76df3287-6cda-33eb-8e9a-044b5e15ffdd"
         coverArtPath = self._mock_getCoverArt(path, release_id)
         self.assertTrue(os.path.isfile(coverArtPath))
+
+
+class LookupCacheTestCase(unittest.TestCase):
+
+    def testLookupOnce(self):
+        calls = []
+
+        def lookup(discid):
+            calls.append(discid)
+            return [discid]
+
+        cache = program.LookupCache()
+        first = cache.get(('test', 'a'), lookup, 'a')
+        first.append('changed')
+        self.assertEqual(cache.get(('test', 'a'), lookup, 'a'), ['a'])
+        self.assertEqual(calls, ['a'])
+
+    def testFailureNotRemembered(self):
+        def lookup():
+            raise IOError
+
+        cache = program.LookupCache()
+        self.assertRaises(IOError, cache.get, ('test', ), lookup)
+        self.assertEqual(cache.get(('test', ), list), [])
+
+    def testPrefetch(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def lookup(discid):
+            calls.append(discid)
+            started.set()
+            release.wait()
+            return [discid]
+
+        cache = program.LookupCache()
+        cache.prefetch(('test', 'a'), lookup, 'a')
+        started.wait()
+        # the lookup runs while the caller goes on
+        cache.prefetch(('test', 'a'), lookup, 'a')
+        release.set()
+        self.assertEqual(cache.get(('test', 'a'), lookup, 'a'), ['a'])
+        self.assertEqual(calls, ['a'])
+
+    def testPrefetchFailureNotRemembered(self):
+        def lookup():
+            raise IOError
+
+        cache = program.LookupCache()
+        cache.prefetch(('test', ), lookup)
+        self.assertRaises(IOError, cache.get, ('test', ), lookup)
+        self.assertEqual(cache.get(('test', ), list), [])
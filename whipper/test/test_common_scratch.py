@@ -0,0 +1,53 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_scratch -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import shutil
+import tempfile
+
+from whipper.common import scratch
+from whipper.test import common
+
+
+class ScratchTestCase(common.TestCase):
+
+    def setUp(self):
+        self.memory = tempfile.mkdtemp(suffix='.whipper.test')
+        self.output = tempfile.mkdtemp(suffix='.whipper.test')
+
+    def tearDown(self):
+        shutil.rmtree(self.memory)
+        shutil.rmtree(self.output)
+
+    def testBudget(self):
+        s = scratch.Scratch(memory=100, directories=[self.memory])
+        first = s.mkstemp(60, self.output)
+        second = s.mkstemp(60, self.output)
+        self.assertEqual(os.path.dirname(first), self.memory)
+        self.assertEqual(os.path.dirname(second), self.output)
+
+        # the memory is given back once the file is released
+        s.release(first)
+        self.assertFalse(os.path.exists(first))
+        third = s.mkstemp(60, self.output)
+        self.assertEqual(os.path.dirname(third), self.memory)
+
+    def testNoMemory(self):
+        s = scratch.Scratch(directories=[self.memory])
+        path = s.mkstemp(1, self.output)
+        self.assertEqual(os.path.dirname(path), self.output)
+
+    def testPublish(self):
+        source = os.path.join(self.output, 'track.flac.part')
+        destination = os.path.join(self.output, 'track.flac')
+        with open(source, 'wb') as f:
+            f.write(b'audio')
+        scratch.publish(source, destination)
+        self.assertFalse(os.path.exists(source))
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), b'audio')
+
+    def testCheckFreeSpace(self):
+        scratch.checkFreeSpace(self.output, 0)
+        self.assertRaises(scratch.NoSpaceError, scratch.checkFreeSpace,
+                          self.output, 1 << 62)
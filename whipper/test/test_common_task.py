@@ -0,0 +1,52 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_task -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+from whipper.common import task
+
+from whipper.test import common
+
+
+class _ShellTask(task.PopenTask):
+
+    def __init__(self, script):
+        self.command = ['sh', '-c', script]
+        self.out = b''
+        self.err = b''
+        self.result = None
+
+    def readbytesout(self, bytes_stdout):
+        self.out += bytes_stdout
+
+    def readbyteserr(self, bytes_stderr):
+        self.err += bytes_stderr
+
+    def done(self):
+        self.result = 'done'
+
+    def failed(self):
+        self.result = 'failed'
+
+
+class PopenTaskTestCase(common.TestCase):
+
+    def setUp(self):
+        self.runner = task.SyncRunner(verbose=False)
+
+    def testOutput(self):
+        t = _ShellTask('echo out; echo err >&2')
+        self.runner.run(t)
+        self.assertEqual(t.out, b'out\n')
+        self.assertEqual(t.err, b'err\n')
+        self.assertEqual(t.result, 'done')
+
+    def testFailed(self):
+        t = _ShellTask('exit 3')
+        self.runner.run(t)
+        self.assertEqual(t._popen.returncode, 3)
+        self.assertEqual(t.result, 'failed')
+
+    def testLargeOutput(self):
+        # more than fits in a pipe, all of it handed over before the exit
+        t = _ShellTask('head -c 1000000 /dev/zero')
+        self.runner.run(t)
+        self.assertEqual(len(t.out), 1000000)
@@ -89,3 +89,24 @@ FILE "track02.wav" WAVE
     INDEX 01 00:00:00
 """ % whipper.__version__, it.cue())
         os.unlink(path)
+
+
+class RewriteCueFileTestCase(unittest.TestCase):
+
+    def testRewrite(self):
+        fd, path = tempfile.mkstemp(suffix='.whipper.test.cue')
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+
+        cuefile = cue.CueFile(os.path.join(os.path.dirname(__file__),
+                                           'kanye.cue'))
+        cuefile.parse()
+        name = 'Kanye West - 808s & Heartbreak\\Kanye West - Say You Will.wav'
+        cuefile.rewrite(path, {name: 'Say You Will.flac'})
+        with open(os.path.join(os.path.dirname(__file__), 'kanye.cue')) as f:
+            original = f.read()
+        with open(path) as f:
+            rewritten = f.read()
+        self.assertEqual(rewritten, original.replace(
+            'FILE "%s" WAVE' % name, 'FILE "Say You Will.flac" WAVE'))
+        self.assertNotEqual(rewritten, original)
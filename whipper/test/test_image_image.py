@@ -0,0 +1,94 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_image_image -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import hashlib
+import os
+import shutil
+import tempfile
+import wave
+from unittest import mock
+
+from whipper.common import checksum, common, encode
+from whipper.extern.task import task
+from whipper.image import image
+
+from whipper.test import common as tcommon
+
+CUE = '''FILE "track01.wav" WAVE
+  TRACK 01 AUDIO
+    INDEX 01 00:00:00
+FILE "track02.wav" WAVE
+  TRACK 02 AUDIO
+    INDEX 01 00:00:00
+'''
+
+
+def _fakeFlac(path, md5):
+    # only the STREAMINFO block, which is all that is read of it
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + bytes([0x80, 0, 0, 34]) + bytes(18) + md5)
+
+
+class ImageEncodeTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp(suffix='.whipper.test')
+        self.outdir = tempfile.mkdtemp(suffix='.whipper.test')
+        self.audio = {}
+        for number in (1, 2):
+            path = os.path.join(self.source, 'track%02d.wav' % number)
+            data = bytes([number]) * (3 * common.BYTES_PER_FRAME)
+            with wave.open(path, 'wb') as w:
+                w.setnchannels(2)
+                w.setsampwidth(2)
+                w.setframerate(44100)
+                w.writeframes(data)
+            self.audio[path] = hashlib.md5(data).digest()
+        self.cuePath = os.path.join(self.source, 'disc.cue')
+        with open(self.cuePath, 'w') as f:
+            f.write(CUE)
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.outdir)
+
+    def _encode(self, infile, outfile, nice=0, cpus=None):
+        _fakeFlac(outfile, self.audio[infile])
+
+    def testEncode(self):
+        pool = encode.EncodePool(2)
+        self.addCleanup(pool.shutdown)
+        t = image.ImageEncodeTask(image.Image(self.cuePath), self.outdir,
+                                  pool)
+        with mock.patch('whipper.program.flac.encode', self._encode):
+            task.SyncRunner(verbose=False).run(t)
+
+        self.assertEqual(t.cuePath, os.path.join(self.outdir, 'disc.cue'))
+        with open(t.cuePath) as f:
+            self.assertEqual(f.read(), CUE.replace('.wav', '.flac'))
+        for number in (1, 2):
+            name = 'track%02d' % number
+            self.assertEqual(
+                checksum.getAudioMD5(os.path.join(self.outdir,
+                                                  name + '.flac')),
+                checksum.getAudioMD5(os.path.join(self.source,
+                                                  name + '.wav')))
+
+    def testMismatch(self):
+        def encodeBadly(infile, outfile, nice=0, cpus=None):
+            if infile.endswith('track02.wav'):
+                _fakeFlac(outfile, b'\x01' * 16)
+            else:
+                self._encode(infile, outfile)
+
+        t = image.ImageEncodeTask(image.Image(self.cuePath), self.outdir)
+        with mock.patch('whipper.program.flac.encode', encodeBadly):
+            self.assertRaises(task.TaskException,
+                              task.SyncRunner(verbose=False).run, t)
+        # neither the bad file, the good one of the same image nor a .cue
+        # file referring to them are kept
+        self.assertEqual(os.listdir(self.outdir), [])
+
+    def testOverwrite(self):
+        self.assertRaises(ValueError, image.ImageEncodeTask,
+                          image.Image(self.cuePath), self.source)
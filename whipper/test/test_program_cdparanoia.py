@@ -1,7 +1,10 @@
 # -*- Mode: Python; test-case-name: whipper.test.test_program_cdparanoia -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
+import binascii
 import os
+import tempfile
+import wave
 
 from whipper.extern.task import task
 
@@ -27,6 +30,43 @@ class ParseTestCase(common.TestCase):
         q = '%.01f %%' % (self._parser.getTrackQuality() * 100.0, )
         self.assertEqual(q, '99.6 %')
 
+    def testReadCounts(self):
+        for line in self._handle.readlines():
+            self._parser.parse(line)
+
+        counts = self._parser.getReadCounts()
+        self.assertEqual(len(counts), 47719 - 45990 + 1)
+        self.assertEqual(sum(counts), self._parser.reads)
+
+
+class FeedTestCase(common.TestCase):
+
+    def testChunks(self):
+        # chunks split lines anywhere, but parse the same as whole lines
+        path = os.path.join(os.path.dirname(__file__),
+                            'cdparanoia.progress.error')
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        parser = cdparanoia.ProgressParser(start=0, stop=10800)
+        for i in range(0, len(data), 1000):
+            parser.feed(data[i:i + 1000])
+
+        q = '%.01f %%' % (parser.getTrackQuality() * 100.0, )
+        self.assertEqual(q, '79.6 %')
+        self.assertEqual(parser.errors, 216)
+
+
+class RereadMapTestCase(common.TestCase):
+
+    def testMap(self):
+        counts = [2] * 300
+        counts[10] = 5
+        counts[80] = 3
+        counts[200] = 1
+        self.assertEqual(cdparanoia.getRereadMap(counts),
+                         [(0, 3), (75, 1)])
+
 
 class Parse1FrameTestCase(common.TestCase):
 
@@ -63,6 +103,102 @@ class ErrorTestCase(common.TestCase):
         self.assertEqual(q, '79.6 %')
 
 
+class _Sink:
+
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def update(self, data):
+        assert not self.closed
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+
+class StreamTestCase(common.TestCase):
+
+    def testFeedSkipsHeader(self):
+        sink = _Sink()
+        t = cdparanoia.ReadTrackTask(None, None, 0, 0, False, sinks=[sink])
+        audio = bytes(range(256)) * 10
+        stream = b'RIFF' + b'\0' * 40 + audio
+        # feed in pieces that do not line up with the header
+        for i in range(0, len(stream), 30):
+            t._feed(stream[i:i + 30])
+
+        self.assertEqual(sink.data, audio)
+        self.assertEqual(t._streamed, len(audio))
+
+
+class SplitterTestCase(common.TestCase):
+
+    def testSplit(self):
+        sinks = [_Sink(), _Sink(), _Sink()]
+        splitter = cdparanoia.Splitter([3, 5, 2], [[s] for s in sinks])
+        for piece in (b'ab', b'cdefghi', b'j'):
+            splitter.update(piece)
+
+        self.assertEqual([s.data for s in sinks], [b'abc', b'defgh', b'ij'])
+        self.assertEqual([s.closed for s in sinks], [True, True, True])
+
+
+class DivergentRangesTestCase(common.TestCase):
+
+    def testMerge(self):
+        test = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+        copy = [1, 0, 3, 4, 5, 6, 0, 8, 0, 10]
+        self.assertEqual(cdparanoia.getDivergentRanges(test, copy),
+                         [(1, 1), (6, 6), (8, 8)])
+        self.assertEqual(cdparanoia.getDivergentRanges(test, copy, 1),
+                         [(0, 2), (5, 9)])
+
+    def testShortCopy(self):
+        self.assertEqual(cdparanoia.getDivergentRanges([1, 2, 3], [1]),
+                         [(1, 2)])
+
+
+class SpliceTestCase(common.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.whipper.test.wav')
+        os.close(fd)
+        with wave.open(self.path, 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(44100)
+            w.writeframes(bytes(2352 * 4))
+        self.runner = task.SyncRunner(verbose=False)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _reread(self, data, other=None):
+        buffers = (cdparanoia._Buffer(), cdparanoia._Buffer())
+        buffers[0].update(data)
+        buffers[1].update(other or data)
+        return buffers
+
+    def testSplice(self):
+        frame = b'\x00\x80' * 1176
+        t = cdparanoia.SpliceTask(self.path,
+                                  [(2, ) + self._reread(frame)])
+        self.runner.run(t)
+
+        with wave.open(self.path) as w:
+            audio = w.readframes(w.getnframes())
+        self.assertEqual(audio, bytes(2352 * 2) + frame + bytes(2352))
+        self.assertEqual(t.checksum, binascii.crc32(audio))
+        self.assertEqual(t.peak, 32768)
+        self.assertEqual(t.frames, 1)
+
+    def testRereadsDiffer(self):
+        t = cdparanoia.SpliceTask(self.path, [
+            (0, ) + self._reread(bytes(2352), b'\x01' * 2352)])
+        self.assertRaises(task.TaskException, self.runner.run, t)
+
+
 class VersionTestCase(common.TestCase):
 
     def testGetVersion(self):
@@ -1,6 +1,8 @@
 # -*- Mode: Python; test-case-name: whipper.test.test_program_cdparanoia -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
+import os
+
 from whipper.program import cdrdao
 from whipper.test import common
 
@@ -13,3 +15,18 @@ class VersionTestCase(common.TestCase):
         self.assertTrue(v)
         # make sure it starts with a digit
         self.assertTrue(int(v[0]))
+
+
+class FeedTestCase(common.TestCase):
+    def testChunks(self):
+        path = os.path.join(os.path.dirname(__file__),
+                            'cdrdao.readtoc.progress')
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        parser = cdrdao.ProgressParser()
+        for i in range(0, len(data), 7):
+            parser.feed(data[i:i + 7])
+
+        self.assertEqual(int(parser.tracks), 11)
+        self.assertEqual(parser.currentTrack, 11)
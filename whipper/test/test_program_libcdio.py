@@ -0,0 +1,158 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_program_libcdio -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from whipper.common import common as wcommon
+from whipper.common import task
+from whipper.image import toc
+from whipper.program import libcdio
+
+from whipper.test import common
+
+
+class SectorRangeTestCase(common.TestCase):
+
+    def testNoOffset(self):
+        self.assertEqual(libcdio.getSectorRange(10, 19), (10, 19, 0))
+
+    def testPositiveOffset(self):
+        self.assertEqual(libcdio.getSectorRange(0, 9, 6), (0, 10, 24))
+
+    def testNegativeOffset(self):
+        self.assertEqual(libcdio.getSectorRange(0, 9, -6),
+                         (-1, 9, wcommon.BYTES_PER_FRAME - 24))
+
+
+class ImageTestCase(common.TestCase):
+
+    if not libcdio.available():
+        skip = 'libcdio-paranoia is not available'
+
+    SECTORS = 300
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix='.whipper.test')
+        with open(os.path.join(self._dir, 'image.bin'), 'wb') as f:
+            f.write(bytes(self.SECTORS * wcommon.BYTES_PER_FRAME))
+        self._cue = os.path.join(self._dir, 'image.cue')
+        with open(self._cue, 'w') as f:
+            f.write('FILE "image.bin" BINARY\n'
+                    '  TRACK 01 AUDIO\n'
+                    '    INDEX 01 00:00:00\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def testReadWithOffset(self):
+        events = []
+        with libcdio.Reader(self._cue) as reader:
+            self.assertEqual(reader.lastsector, self.SECTORS - 1)
+            data = b''.join(reader.read(
+                self.SECTORS - 10, self.SECTORS - 1, offset=6,
+                callback=lambda *args: events.append(args)))
+
+        self.assertEqual(data, bytes(10 * wcommon.BYTES_PER_FRAME))
+        self.assertIn(('wrote', self.SECTORS * wcommon.WORDS_PER_FRAME - 1),
+                      events)
+        self.assertIn('read', [function for function, _ in events])
+
+
+class QFrameTestCase(common.TestCase):
+
+    def testPosition(self):
+        q = libcdio.QFrame(bytes([0x11, 0x02, 0x01, 0, 0, 0, 0,
+                                  0x00, 0x04, 0x10]) + bytes(6))
+        self.assertEqual(q.adr, 1)
+        self.assertEqual(q.control, 1)
+        self.assertEqual(q.position, (2, 1))
+        self.assertEqual(q.absolute, 4 * 75 + 10 - 150)
+
+    def testMCN(self):
+        q = libcdio.QFrame(b'\x02' + bytes.fromhex('07243842607270') +
+                           bytes(8))
+        self.assertEqual(q.mcn, '0724384260727')
+        self.assertIsNone(q.isrc)
+
+    def testISRC(self):
+        bits = 0
+        for c in 'GBAAA':
+            bits = bits << 6 | (0x11 + ord(c) - ord('A'))
+        q = libcdio.QFrame(b'\x03' + (bits << 2).to_bytes(4, 'big') +
+                           bytes.fromhex('03003500') + bytes(7))
+        self.assertEqual(q.isrc, 'GBAAA0300350')
+
+
+class _Disc:
+    """The sub-channel of a disc, from the start of each index."""
+
+    def __init__(self, starts, lastsector):
+        self.starts = sorted(starts.items(), key=lambda s: s[1])
+        self.lastsector = lastsector
+        self.reads = 0
+
+    def position(self, sector):
+        self.reads += 1
+        return [p for p, start in self.starts if start <= sector][-1]
+
+    def codes(self, sector, count):
+        track = self.position(sector)[0]
+        return '0724384260727', 'GBAAA03003%02d' % track
+
+    def close(self):
+        pass
+
+
+class FindBoundaryTestCase(common.TestCase):
+
+    def testPregap(self):
+        disc = _Disc({(1, 1): 0, (2, 0): 20455, (2, 1): 20535}, 30000)
+        self.assertEqual(libcdio.findBoundary(disc.position, 0, 20535,
+                                              (2, 0)), 20455)
+        # much less than a scan of the track
+        self.assertLess(disc.reads, 20)
+
+    def testNoPregap(self):
+        disc = _Disc({(1, 1): 0, (2, 1): 20535}, 30000)
+        self.assertEqual(libcdio.findBoundary(disc.position, 0, 20535,
+                                              (2, 0)), 20535)
+        self.assertEqual(disc.reads, 1)
+
+
+class ReadIndexesTaskTestCase(common.TestCase):
+
+    def testIndexes(self):
+        path = os.path.join(os.path.dirname(__file__), 'capital.fast.toc')
+        fast = toc.TocFile(path)
+        fast.parse()
+        ittoc = fast.table
+        starts = {}
+        for track in ittoc.tracks:
+            start = track.getIndex(1).absolute
+            starts[(track.number, 1)] = start
+            if track.number > 1:
+                starts[(track.number, 0)] = start - 80
+        starts[(3, 2)] = ittoc.tracks[2].getIndex(1).absolute + 100
+        disc = _Disc(starts, ittoc.leadout - 1)
+
+        t = libcdio.ReadIndexesTask(None, ittoc)
+        with mock.patch.object(libcdio, 'SubchannelReader',
+                               return_value=disc):
+            task.SyncRunner(verbose=False).run(t)
+
+        tracks = t.table.tracks
+        self.assertEqual(tracks[0].getPregap(), 0)
+        self.assertEqual(tracks[1].getPregap(), 80)
+        self.assertEqual(tracks[2].getIndex(2).absolute,
+                         tracks[2].getIndex(1).absolute + 100)
+        self.assertEqual(tracks[1].getIndex(0).relative,
+                         tracks[1].getIndex(1).relative - 80)
+        self.assertEqual(tracks[3].isrc, 'GBAAA0300304')
+        self.assertEqual(t.table.catalog, '0724384260727')
+        # the ids do not change
+        self.assertEqual(t.table.getCDDBDiscId(), ittoc.getCDDBDiscId())
+        # nor does the fast table
+        self.assertNotIn(0, ittoc.tracks[1].indexes)
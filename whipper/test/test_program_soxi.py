@@ -2,10 +2,11 @@
 
 import os
 import tempfile
+import wave
 
 from whipper.common import common
 from whipper.extern.task import task
-from whipper.program.soxi import AudioLengthTask
+from whipper.program.soxi import AudioLengthTask, getLength, getLengths
 from whipper.test import common as tcommon
 
 base_track_file = os.path.join(os.path.dirname(__file__), 'track.flac')
@@ -59,3 +60,29 @@ class AbsentFileAudioLengthPathTestCase(AudioLengthPathTestCase):
                           t, verbose=False)
 
         os.rmdir(tempdir)
+
+
+class HeaderLengthTestCase(tcommon.TestCase):
+
+    def testFlac(self):
+        self.assertEqual(getLength(base_track_file), base_track_length)
+
+    def testWave(self):
+        fd, path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(44100)
+            w.writeframes(bytes(3 * common.BYTES_PER_FRAME))
+        self.assertEqual(getLength(path), 3 * common.SAMPLES_PER_FRAME)
+        self.assertEqual(getLengths([path, base_track_file]),
+                         [3 * common.SAMPLES_PER_FRAME, base_track_length])
+
+    def testOtherFormat(self):
+        fd, path = tempfile.mkstemp(suffix='.mp3')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'ID3\x04\x00\x00\x00\x00\x00\x00')
+        self.addCleanup(os.unlink, path)
+        self.assertIsNone(getLength(path))